@@ -0,0 +1,121 @@
+import collections
+import hashlib
+import os
+import threading
+
+
+class TTSAudioCache:
+    """Size-bounded on-disk cache of rendered speech keyed on (text, voice id, rate)
+
+    Each entry is one audio file named after a hash of its key, so the index
+    is rebuilt from the directory listing on startup. The least recently
+    used files are deleted once the total size exceeds max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=50 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        # file name -> size in bytes; ordered from least to most recently used
+        self._files = collections.OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        """Rebuild the index from files left by previous runs"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                # Leftover from an interrupted render
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self._total_bytes += size
+        self._evict()
+
+    @staticmethod
+    def _name_for(text, voice_id, rate):
+        """File name for a cache key"""
+        key = f"{voice_id}\0{int(rate)}\0{text.strip()}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest() + ".wav"
+
+    def lookup(self, text, voice_id, rate):
+        """Return the path of the rendered audio, or None if it is not cached"""
+        name = self._name_for(text, voice_id, rate)
+        with self._lock:
+            if name not in self._files:
+                self.misses += 1
+                return None
+            self._files.move_to_end(name)
+            self.hits += 1
+        path = os.path.join(self.directory, name)
+        try:
+            # Keep the on-disk order in step with use for the next startup
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._total_bytes -= self._files.pop(name, 0)
+            return None
+        return path
+
+    def contains(self, text, voice_id, rate):
+        """True if the key is cached, without counting a hit or miss"""
+        with self._lock:
+            return self._name_for(text, voice_id, rate) in self._files
+
+    def temp_path(self, text, voice_id, rate):
+        """Path to render into before the file is added to the cache"""
+        return os.path.join(self.directory, self._name_for(text, voice_id, rate) + ".tmp")
+
+    def add(self, text, voice_id, rate, rendered_path):
+        """Move a rendered file into the cache and evict old entries if needed"""
+        name = self._name_for(text, voice_id, rate)
+        path = os.path.join(self.directory, name)
+        os.replace(rendered_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._total_bytes -= self._files.pop(name, 0)
+            self._files[name] = size
+            self._total_bytes += size
+            self._evict()
+        return path
+
+    def _evict(self):
+        """Delete least recently used files until the cache fits in max_bytes"""
+        while self._total_bytes > self.max_bytes and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            return {
+                "entries": len(self._files),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,341 @@
+import audioop
+import collections
+import queue
+import threading
+import time
+import speech_recognition as sr
+from noise_calibration import NoiseFloorTracker
+
+# Input streams currently held open by capture readers, for the resource monitor
+_open_inputs = 0
+_open_inputs_lock = threading.Lock()
+
+
+def open_input_streams():
+    """Number of audio input streams AudioCapture instances hold open"""
+    return _open_inputs
+
+
+def _count_input(delta):
+    global _open_inputs
+    with _open_inputs_lock:
+        _open_inputs += delta
+
+
+class Utterance:
+    """A single endpointed stretch of speech taken from the capture stream"""
+
+    def __init__(self, audio, started_at, ended_at, speech_ended_at, truncated=False, speech_started_at=None,
+                 provisional=False):
+        self.audio = audio
+        # perf_counter() time of the first frame (including pre-roll)
+        self.started_at = started_at
+        # perf_counter() time of the first frame that contained speech
+        self.speech_started_at = speech_started_at if speech_started_at is not None else started_at
+        # perf_counter() time when endpointing closed the utterance
+        self.ended_at = ended_at
+        # perf_counter() time of the last frame that contained speech
+        self.speech_ended_at = speech_ended_at
+        # True when the utterance was cut at the maximum length
+        self.truncated = truncated
+        # True for an early snapshot taken at a pause; the final utterance follows
+        self.provisional = provisional
+
+    @property
+    def duration(self):
+        """Length of the captured audio in seconds"""
+        return len(self.audio.frame_data) / float(self.audio.sample_rate * self.audio.sample_width)
+
+
+class PushAudioSource(sr.AudioSource):
+    """Audio source fed by the application, e.g. with chunks received over the network
+
+    push() hands over raw 16-bit mono audio of any length; the capture reader
+    receives it in CHUNK-sized frames. close() ends the stream once the
+    pushed audio has been read.
+    """
+
+    def __init__(self, sample_rate=16000, chunk_size=512):
+        self.SAMPLE_RATE = sample_rate
+        self.SAMPLE_WIDTH = 2
+        self.CHUNK = chunk_size
+        self.stream = None
+        self._chunks = queue.Queue()
+        self.bytes_pushed = 0
+
+    def push(self, data):
+        """Queue raw audio for the reader"""
+        self.bytes_pushed += len(data)
+        self._chunks.put(data)
+
+    def close(self):
+        """End the stream after the audio pushed so far"""
+        self._chunks.put(None)
+
+    def __enter__(self):
+        self.stream = _PushStream(self._chunks)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stream = None
+
+
+class _PushStream:
+    """The read() side of a PushAudioSource"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = bytearray()
+        self._closed = False
+
+    def read(self, size):
+        frame_bytes = size * 2
+        while len(self._buffer) < frame_bytes and not self._closed:
+            data = self._chunks.get()
+            if data is None:
+                self._closed = True
+            else:
+                self._buffer.extend(data)
+        frame = bytes(self._buffer[:frame_bytes])
+        del self._buffer[:frame_bytes]
+        return frame
+
+    def close(self):
+        pass
+
+
+class AudioCapture:
+    """Continuously open audio input feeding a ring buffer of frames
+
+    A reader thread keeps the source open for the whole conversation, runs
+    frame-level voice activity detection and turns each stretch of speech
+    into an Utterance. Consumers such as the main loop and the interruption
+    listener take utterances from one shared queue instead of reopening the
+    device; alternatively on_utterance(utterance) is called on the reader
+    thread for each one.
+
+    With early_endpoint set, a provisional utterance holding the speech so
+    far is emitted once the silence after it lasts that long, ahead of the
+    final utterance that closes after the full hangover.
+
+    on_speech_start(speech_started_at) is called on the reader thread as
+    soon as speech begins, long before the utterance is endpointed.
+
+    An echo suppressor, if given, has the final say on every frame's voice
+    activity decision, so the bot's own voice does not open utterances.
+    """
+
+    def __init__(self, source, energy_threshold=300, pre_roll=0.3, hangover=0.8,
+                 min_speech=0.1, max_utterance=10, ring_seconds=10, max_pending=8,
+                 calibrator=None, on_utterance=None, early_endpoint=None, on_speech_start=None, echo=None):
+        self.source = source
+        self.on_utterance = on_utterance
+        self.on_speech_start = on_speech_start
+        self.echo = echo
+
+        # Background noise calibration; the threshold is read per frame without blocking
+        self.calibrator = calibrator or NoiseFloorTracker(initial_threshold=energy_threshold)
+
+        # Endpointing settings, all in seconds
+        self.pre_roll = pre_roll
+        self.hangover = hangover
+        self.min_speech = min_speech
+        self.max_utterance = max_utterance
+        self.ring_seconds = ring_seconds
+        self.early_endpoint = early_endpoint
+
+        # Endpointed utterances waiting for a consumer
+        self._utterances = collections.deque(maxlen=max_pending)
+        self._condition = threading.Condition()
+
+        # Ring buffer of the most recent frames, used for pre-roll
+        self._ring = None
+
+        self._stream_source = None
+        self._thread = None
+        self._running = False
+        self.in_speech = False
+        self.frames_read = 0
+        self.dropped_utterances = 0
+        self.provisional_utterances = 0
+
+    def start(self):
+        """Open the source and start the reader thread"""
+        if self._running:
+            return
+        # Clean up after a finite source that ran out on its own
+        self.stop()
+        self._stream_source = self.source.__enter__()
+        _count_input(1)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="audio-capture")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the reader thread and close the source"""
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if self._stream_source is not None:
+            try:
+                self.source.__exit__(None, None, None)
+            except Exception as e:
+                print(f"Error closing audio source: {e}")
+            self._stream_source = None
+            _count_input(-1)
+        with self._condition:
+            self._condition.notify_all()
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def energy_threshold(self):
+        """Current speech/non-speech threshold published by the calibrator"""
+        return self.calibrator.energy_threshold
+
+    def get_utterance(self, timeout=None):
+        """Return the next endpointed utterance, or None on timeout"""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self._condition:
+            while not self._utterances:
+                if not self._running:
+                    return None
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            return self._utterances.popleft()
+
+    def push_back(self, utterance):
+        """Return an utterance to the front of the queue for another consumer"""
+        with self._condition:
+            self._utterances.appendleft(utterance)
+            self._condition.notify()
+
+    def clear(self):
+        """Discard utterances nobody has consumed yet"""
+        with self._condition:
+            self._utterances.clear()
+
+    def _emit(self, utterance):
+        """Hand a finished utterance to waiting consumers"""
+        if self.on_utterance is not None:
+            try:
+                self.on_utterance(utterance)
+            except Exception as e:
+                print(f"Error handling utterance: {e}")
+            return
+        with self._condition:
+            if len(self._utterances) == self._utterances.maxlen:
+                self.dropped_utterances += 1
+            self._utterances.append(utterance)
+            self._condition.notify()
+
+    def _is_speech(self, energy):
+        """Frame-level voice activity decision"""
+        speech = self.calibrator.calibrated and energy > self.calibrator.energy_threshold
+        if self.echo is not None:
+            speech = self.echo.admit(energy, speech)
+        return speech
+
+    def _run(self):
+        """Reader thread: read frames, detect speech and endpoint utterances"""
+        source = self._stream_source
+        sample_rate = source.SAMPLE_RATE
+        sample_width = source.SAMPLE_WIDTH
+        seconds_per_frame = float(source.CHUNK) / sample_rate
+
+        def frames_for(seconds):
+            return max(1, int(round(seconds / seconds_per_frame)))
+
+        pre_roll_frames = frames_for(self.pre_roll)
+        hangover_frames = frames_for(self.hangover)
+        min_speech_frames = frames_for(self.min_speech)
+        max_frames = frames_for(self.max_utterance)
+        early_frames = frames_for(self.early_endpoint) if self.early_endpoint else None
+        self._ring = collections.deque(maxlen=max(frames_for(self.ring_seconds), pre_roll_frames + min_speech_frames))
+
+        speech_run = 0
+        silence_run = 0
+        utterance_frames = []
+        utterance_start = None
+        speech_start = None
+        last_speech_time = None
+        provisional_sent = False
+
+        while self._running:
+            try:
+                frame = source.stream.read(source.CHUNK)
+            except Exception as e:
+                print(f"Error reading audio frame: {e}")
+                break
+            if not frame:
+                # End of a finite source such as a WAV file
+                break
+
+            now = time.perf_counter()
+            self.frames_read += 1
+            self._ring.append(frame)
+
+            # Classify the frame and let the calibrator learn from it
+            energy = audioop.rms(frame, sample_width)
+            speech = self._is_speech(energy)
+            self.calibrator.update(energy, speech, seconds_per_frame)
+
+            if not self.in_speech:
+                speech_run = speech_run + 1 if speech else 0
+                if speech_run >= min_speech_frames:
+                    # Start of speech: include the pre-roll frames that preceded it
+                    lead = min(len(self._ring), speech_run + pre_roll_frames)
+                    utterance_frames = list(self._ring)[-lead:]
+                    utterance_start = now - lead * seconds_per_frame
+                    speech_start = now - speech_run * seconds_per_frame
+                    last_speech_time = now
+                    silence_run = 0
+                    provisional_sent = False
+                    self.in_speech = True
+                    if self.on_speech_start is not None:
+                        try:
+                            self.on_speech_start(speech_start)
+                        except Exception as e:
+                            print(f"Error handling speech start: {e}")
+                continue
+
+            utterance_frames.append(frame)
+            if speech:
+                silence_run = 0
+                last_speech_time = now
+                # Speech resumed after a pause; the next pause gets its own snapshot
+                provisional_sent = False
+            else:
+                silence_run += 1
+
+            if early_frames is not None and not provisional_sent and early_frames <= silence_run < hangover_frames:
+                # The user has probably finished: hand out what we have so far
+                provisional_sent = True
+                self.provisional_utterances += 1
+                audio = sr.AudioData(b"".join(utterance_frames), sample_rate, sample_width)
+                self._emit(Utterance(audio, utterance_start, now, last_speech_time, speech_started_at=speech_start,
+                                     provisional=True))
+
+            truncated = len(utterance_frames) >= max_frames
+            if silence_run >= hangover_frames or truncated:
+                audio = sr.AudioData(b"".join(utterance_frames), sample_rate, sample_width)
+                self._emit(Utterance(audio, utterance_start, now, last_speech_time, truncated, speech_start))
+                utterance_frames = []
+                speech_run = 0
+                self.in_speech = False
+
+        # Flush speech that was still open when the stream ended
+        if self.in_speech and utterance_frames:
+            audio = sr.AudioData(b"".join(utterance_frames), sample_rate, sample_width)
+            now = time.perf_counter()
+            self._emit(Utterance(audio, utterance_start, now, last_speech_time, speech_started_at=speech_start))
+        self.in_speech = False
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
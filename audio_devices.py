@@ -0,0 +1,104 @@
+import json
+import os
+import time
+
+import speech_recognition as sr
+
+
+def is_preferred_microphone(name):
+    """True for the Intel Smart Sound Technology microphone array"""
+    return "Intel" in name and "Smart" in name and "Microphone" in name
+
+
+class MicrophoneSelection:
+    """Result of picking an input device"""
+
+    def __init__(self, device_index, name, names, cached):
+        self.device_index = device_index
+        self.name = name
+        self.names = names
+        self.cached = cached
+
+
+class DeviceCache:
+    """Remember the chosen input device on disk so startup can skip enumeration
+
+    Listing devices initializes PortAudio and probes every device, which is
+    slow on some machines. The device list and the chosen index are stored in
+    a JSON file; later startups reuse them, checking only that the device at
+    the cached index still has the cached name, and enumerate again when it
+    does not, when it can no longer be opened or when a refresh is requested.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Return the cached selection, or None"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            return MicrophoneSelection(stored["device_index"], stored["name"], stored["names"], True)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading device cache: {e}")
+            return None
+
+    def save(self, selection):
+        """Write the selection to disk atomically"""
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"device_index": selection.device_index, "name": selection.name,
+                           "names": selection.names, "saved_at": time.time()}, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error saving device cache: {e}")
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def discover(self):
+        """Enumerate the input devices once and pick the preferred one"""
+        names = sr.Microphone.list_microphone_names()
+        device_index = next((index for index, name in enumerate(names) if is_preferred_microphone(name)), None)
+        name = names[device_index] if device_index is not None else None
+        selection = MicrophoneSelection(device_index, name, names, False)
+        self.save(selection)
+        return selection
+
+    def select(self, refresh=False):
+        """Return the cached selection, discovering devices if there is none"""
+        selection = None if refresh else self.load()
+        return selection or self.discover()
+
+    @staticmethod
+    def device_name(device_index):
+        """Name of the device currently at device_index; queries that one device only"""
+        audio = sr.Microphone.get_pyaudio().PyAudio()
+        try:
+            return audio.get_device_info_by_index(device_index).get("name")
+        finally:
+            audio.terminate()
+
+    def open_microphone(self, refresh=False):
+        """Create the sr.Microphone for the selected device; returns (microphone, selection)"""
+        selection = self.select(refresh)
+        try:
+            if selection.cached and selection.device_index is not None:
+                name = self.device_name(selection.device_index)
+                if name != selection.name:
+                    raise LookupError(f"device {selection.device_index} is now {name!r}, not {selection.name!r}")
+            return sr.Microphone(device_index=selection.device_index), selection
+        except Exception as e:
+            if not selection.cached:
+                raise
+            # The cached device is gone (unplugged) or another one took its index; look again
+            print(f"Cached microphone unavailable ({e}), rediscovering devices")
+            selection = self.discover()
+            return sr.Microphone(device_index=selection.device_index), selection
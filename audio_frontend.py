@@ -0,0 +1,252 @@
+"""Audio front end: prepare captured speech before it is sent to the recognizer
+
+Captured utterances arrive at the device's sample rate, often 44.1 or 48 kHz,
+and with silence before and after the speech. recognize_google encodes
+whatever it is given as FLAC, so the front end first resamples to 16 kHz
+mono (all the recognizer uses) and trims the silence, which cuts the bytes
+uploaded per utterance.
+
+The work is vectorized with NumPy when it is installed: frames are views
+over the captured bytes (no copies), and RMS, zero crossings and the
+resampling filter run over whole utterances at once. NumPy is imported on
+first use rather than at startup, as importing it is slow. Without it the
+same results come from audioop, a frame at a time.
+
+    python audio_frontend.py --rate 48000 --seconds 3
+compares bytes uploaded and CPU per second of audio with the raw path.
+"""
+import argparse
+import audioop
+import sys
+import threading
+import time
+
+import speech_recognition as sr
+
+# The numpy module once _numpy() has imported it; None until then, and when it is not installed
+np = None
+_numpy_imported = False
+
+# What the recognizer is sent
+TARGET_RATE = 16000
+TARGET_WIDTH = 2
+
+# Taps of the low-pass filter applied before downsampling
+FILTER_TAPS = 63
+
+
+def _numpy():
+    """numpy, imported on first use, or None when it is not installed"""
+    global np, _numpy_imported
+    if not _numpy_imported:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+        _numpy_imported = True
+    return np
+
+
+def _samples(data, sample_width):
+    """16-bit samples of raw audio: a view over data when it is 16-bit already"""
+    if sample_width != 2:
+        data = audioop.lin2lin(data, sample_width, 2)
+    return np.frombuffer(data, dtype="<i2")
+
+
+def frame_view(samples, frame_samples):
+    """(frames, frame_samples) view over whole frames of a sample array; the tail is left out"""
+    count = len(samples) // frame_samples
+    return samples[:count * frame_samples].reshape(count, frame_samples)
+
+
+def frame_energies(data, sample_width, frame_samples):
+    """RMS of each whole frame of raw mono audio"""
+    np = _numpy()
+    if np is None:
+        frame_bytes = frame_samples * sample_width
+        return [audioop.rms(data[i:i + frame_bytes], sample_width)
+                for i in range(0, len(data) - frame_bytes + 1, frame_bytes)]
+    frames = frame_view(_samples(data, sample_width), frame_samples).astype(np.float32)
+    return np.sqrt(np.mean(frames * frames, axis=1)).tolist()
+
+
+def frame_crossings(data, sample_width, frame_samples):
+    """Zero crossings in each whole frame of raw mono audio"""
+    np = _numpy()
+    if np is None:
+        frame_bytes = frame_samples * sample_width
+        return [audioop.cross(data[i:i + frame_bytes], sample_width)
+                for i in range(0, len(data) - frame_bytes + 1, frame_bytes)]
+    negative = np.signbit(frame_view(_samples(data, sample_width), frame_samples))
+    return np.count_nonzero(negative[:, 1:] != negative[:, :-1], axis=1).tolist()
+
+
+def _lowpass(cutoff):
+    """Windowed-sinc low-pass filter; cutoff is a fraction of the sample rate"""
+    n = np.arange(FILTER_TAPS) - (FILTER_TAPS - 1) / 2.0
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(FILTER_TAPS)
+    return taps / taps.sum()
+
+
+def to_mono_16k(data, sample_rate, sample_width, channels=1):
+    """Raw audio as 16-bit mono at TARGET_RATE"""
+    np = _numpy()
+    if np is None:
+        if sample_width != TARGET_WIDTH:
+            data = audioop.lin2lin(data, sample_width, TARGET_WIDTH)
+        if channels == 2:
+            data = audioop.tomono(data, TARGET_WIDTH, 0.5, 0.5)
+        if sample_rate != TARGET_RATE:
+            data, _ = audioop.ratecv(data, TARGET_WIDTH, 1, sample_rate, TARGET_RATE, None)
+        return data
+
+    samples = _samples(data, sample_width)
+    if channels > 1:
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    if sample_rate == TARGET_RATE:
+        return samples.astype("<i2", copy=False).tobytes()
+
+    samples = samples.astype(np.float32)
+    if sample_rate > TARGET_RATE:
+        # Remove what cannot be represented at the lower rate before decimating
+        samples = np.convolve(samples, _lowpass(0.5 * TARGET_RATE / sample_rate * 0.9), mode="same")
+    count = int(len(samples) * TARGET_RATE / sample_rate)
+    positions = np.arange(count) * (sample_rate / float(TARGET_RATE))
+    resampled = np.interp(positions, np.arange(len(samples)), samples)
+    return np.clip(np.round(resampled), -32768, 32767).astype("<i2").tobytes()
+
+
+def speech_bounds(energies, threshold):
+    """(first, last) index of the frames louder than threshold, or None"""
+    np = _numpy()
+    if np is not None:
+        loud = np.flatnonzero(np.asarray(energies) > threshold)
+        return (int(loud[0]), int(loud[-1])) if len(loud) else None
+    loud = [i for i, energy in enumerate(energies) if energy > threshold]
+    return (loud[0], loud[-1]) if loud else None
+
+
+class AudioFrontEnd:
+    """Resample and trim utterances for the recognizer, and count what it saves
+
+    prepare() returns the utterance as 16 kHz 16-bit mono sr.AudioData with
+    the silence before and after the speech cut down to padding seconds.
+    Speech is every frame louder than the threshold passed in (the capture
+    stream's energy threshold), or than relative_threshold of the loudest
+    frame without one. Audio with no speech at all is only resampled, and
+    the recognizer decides.
+    """
+
+    def __init__(self, frame_seconds=0.02, padding=0.2, relative_threshold=0.05):
+        self.frame_seconds = frame_seconds
+        self.padding = padding
+        self.relative_threshold = relative_threshold
+        self._lock = threading.Lock()
+
+        self.utterances = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.audio_seconds = 0.0
+        self.trimmed_seconds = 0.0
+        self.cpu_seconds = 0.0
+
+    def prepare(self, audio_data, threshold=None):
+        """The utterance as it should be sent to the recognizer"""
+        cpu_started = time.thread_time()
+        data = to_mono_16k(audio_data.frame_data, audio_data.sample_rate, audio_data.sample_width)
+
+        frame_samples = int(TARGET_RATE * self.frame_seconds)
+        energies = frame_energies(data, TARGET_WIDTH, frame_samples)
+        loudest = max(energies, default=0)
+        bounds = speech_bounds(energies, threshold if threshold is not None else loudest * self.relative_threshold)
+        if bounds is not None and loudest:
+            pad = int(round(self.padding / self.frame_seconds))
+            frame_bytes = frame_samples * TARGET_WIDTH
+            start = max(0, bounds[0] - pad) * frame_bytes
+            end = min(len(data), (bounds[1] + 1 + pad) * frame_bytes)
+            data = data[start:end]
+        prepared = sr.AudioData(data, TARGET_RATE, TARGET_WIDTH)
+
+        seconds = len(audio_data.frame_data) / float(audio_data.sample_rate * audio_data.sample_width)
+        with self._lock:
+            self.utterances += 1
+            self.bytes_in += len(audio_data.frame_data)
+            self.bytes_out += len(data)
+            self.audio_seconds += seconds
+            self.trimmed_seconds += seconds - len(data) / float(TARGET_RATE * TARGET_WIDTH)
+            self.cpu_seconds += time.thread_time() - cpu_started
+        return prepared
+
+    def stats(self):
+        """Bytes per utterance before and after, the silence trimmed and CPU per second of audio"""
+        with self._lock:
+            count = self.utterances
+            return {
+                "vectorized": _numpy() is not None,
+                "utterances": count,
+                "bytes_in_per_utterance": self.bytes_in // count if count else None,
+                "bytes_out_per_utterance": self.bytes_out // count if count else None,
+                "trimmed_seconds": round(self.trimmed_seconds, 2),
+                "cpu_ms_per_audio_second": (self.cpu_seconds / self.audio_seconds * 1000.0
+                                            if self.audio_seconds else None),
+            }
+
+
+def _test_utterance(seconds, sample_rate, silence=0.5):
+    """Speech-like audio with silence on both sides, as 16-bit mono at sample_rate"""
+    from fakes import synthetic_speech
+    speech = synthetic_speech(seconds, sample_rate=sample_rate)
+    quiet = bytes(int(silence * sample_rate) * 2)
+    return quiet + speech + quiet
+
+
+def _cpu_per_second(step, audio_seconds, repeat):
+    started = time.thread_time()
+    for _ in range(repeat):
+        step()
+    return (time.thread_time() - started) / repeat / audio_seconds * 1000.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the audio front end with sending raw captured audio")
+    parser.add_argument("--rate", type=int, default=48000, help="capture sample rate")
+    parser.add_argument("--seconds", type=float, default=3.0, help="seconds of speech per utterance")
+    parser.add_argument("--chunk", type=int, default=1024, help="capture frame size in samples")
+    parser.add_argument("--repeat", type=int, default=20, help="repetitions of each CPU measurement")
+    args = parser.parse_args(argv)
+
+    data = _test_utterance(args.seconds, args.rate)
+    audio = sr.AudioData(data, args.rate, 2)
+    audio_seconds = len(data) / 2.0 / args.rate
+    frontend = AudioFrontEnd()
+    prepared = frontend.prepare(audio)
+
+    # Energy of every capture frame: per frame in Python against one vectorized pass
+    frame_bytes = args.chunk * 2
+    def per_frame():
+        return [audioop.rms(data[i:i + frame_bytes], 2) for i in range(0, len(data) - frame_bytes + 1, frame_bytes)]
+
+    print(f"NumPy: {np.__version__ if _numpy() is not None else 'not installed (audioop fallback)'}")
+    print(f"Utterance: {audio_seconds:.1f} s at {args.rate} Hz, {args.seconds:.1f} s of it speech\n")
+    # FLAC encoding runs in a subprocess on every recognize_google call, so it is timed by the clock
+    print(f"{'path':<28}{'PCM bytes':>12}{'FLAC bytes':>12}{'CPU ms/s':>10}{'FLAC ms/s':>11}")
+    for name, sent, prepare in (
+        ("raw (current)", audio, lambda: None),
+        ("front end", prepared, lambda: frontend.prepare(audio)),
+    ):
+        cpu = _cpu_per_second(prepare, audio_seconds, args.repeat)
+        started = time.perf_counter()
+        flac = len(sent.get_flac_data(convert_rate=None if sent.sample_rate >= 8000 else 8000, convert_width=2))
+        encode = (time.perf_counter() - started) / audio_seconds * 1000.0
+        print(f"{name:<28}{len(sent.frame_data):>12}{flac:>12}{cpu:>10.2f}{encode:>11.2f}")
+    print()
+    print(f"{'frame energy, per frame':<28}{'':>24}{_cpu_per_second(per_frame, audio_seconds, args.repeat):>10.2f}")
+    print(f"{'frame energy, vectorized':<28}{'':>24}"
+          f"{_cpu_per_second(lambda: frame_energies(data, 2, args.chunk), audio_seconds, args.repeat):>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
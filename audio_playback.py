@@ -0,0 +1,72 @@
+import threading
+import time
+import wave
+
+# PyAudio is already required by sr.Microphone; one instance serves all playback
+_pyaudio = None
+_pyaudio_lock = threading.Lock()
+
+# Output streams currently open, for the resource monitor
+_open_outputs = 0
+
+
+def get_pyaudio():
+    """Return the shared PyAudio instance, creating it on first use"""
+    global _pyaudio
+    with _pyaudio_lock:
+        if _pyaudio is None:
+            import pyaudio
+            _pyaudio = pyaudio.PyAudio()
+        return _pyaudio
+
+
+def open_output_streams():
+    """Number of playback streams currently open"""
+    return _open_outputs
+
+
+def _count_output(delta):
+    global _open_outputs
+    with _pyaudio_lock:
+        _open_outputs += delta
+
+
+def play_wav_file(path, should_stop=None, block_seconds=0.05, output_device_index=None, is_paused=None,
+                  on_block=None):
+    """Play a WAV file in small blocks, stopping early when should_stop() returns True
+
+    path may also be a file object, e.g. io.BytesIO with WAV bytes rendered
+    in memory. While is_paused() returns True no audio is written and the
+    stream stays open. block_seconds bounds how long either takes to be
+    heard. on_block(data, sample_width) is called with every block written.
+    Returns the number of seconds of audio that were played.
+    """
+    pa = get_pyaudio()
+    with wave.open(path, 'rb') as wav:
+        sample_width = wav.getsampwidth()
+        channels = wav.getnchannels()
+        rate = wav.getframerate()
+        stream = pa.open(format=pa.get_format_from_width(sample_width), channels=channels,
+                         rate=rate, output=True, output_device_index=output_device_index)
+        _count_output(1)
+        frames_per_block = max(1, int(rate * block_seconds))
+        played = 0
+        try:
+            while True:
+                if should_stop is not None and should_stop():
+                    break
+                if is_paused is not None and is_paused():
+                    time.sleep(block_seconds)
+                    continue
+                data = wav.readframes(frames_per_block)
+                if not data:
+                    break
+                stream.write(data)
+                if on_block is not None:
+                    on_block(data, sample_width)
+                played += len(data) // (sample_width * channels)
+        finally:
+            stream.stop_stream()
+            stream.close()
+            _count_output(-1)
+    return played / float(rate)
@@ -0,0 +1,336 @@
+"""Batch transcription and reply over recorded utterances
+
+Replays WAV files through speech recognition and Gemini, optionally renders
+each reply to a WAV file, and appends one JSON line per file with the
+transcript, reply and per-stage timings. Runs are resumable: files already
+in the results file are skipped.
+
+    python batch.py recordings/ --results results.jsonl --render-dir replies/
+    python batch.py manifest.jsonl --jobs 8 --llm-concurrency 4
+
+A manifest is a .jsonl file with one {"path": ..., "id": ..., "expected": ...}
+object per line (id and expected optional; relative paths are resolved
+against the manifest's directory), or a .txt file with one path per line.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import speech_recognition as sr
+from dotenv import load_dotenv
+
+from audio_frontend import AudioFrontEnd
+from latency_tracing import percentile
+from llm_client import ResilientModel
+from prompt_builder import PromptBuilder
+from response_cache import normalize_utterance
+
+STAGES = ("load", "stt", "llm", "tts", "total")
+
+
+class BatchItem:
+    """One recorded utterance to process"""
+
+    def __init__(self, item_id, path, expected=None):
+        self.id = item_id
+        self.path = path
+        self.expected = expected
+
+
+def collect_items(inputs):
+    """Expand directories and manifests into BatchItems"""
+    items = []
+    for source in inputs:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                for name in sorted(files):
+                    if name.lower().endswith(".wav"):
+                        path = os.path.join(root, name)
+                        items.append(BatchItem(os.path.relpath(path, source), path, _sidecar_transcript(path)))
+        elif source.endswith(".jsonl"):
+            base = os.path.dirname(os.path.abspath(source))
+            with open(source, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        path = os.path.join(base, entry["path"])
+                        items.append(BatchItem(entry.get("id", entry["path"]), path, entry.get("expected")))
+        else:
+            base = os.path.dirname(os.path.abspath(source))
+            with open(source, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip() and not line.startswith("#"):
+                        path = os.path.join(base, line.strip())
+                        items.append(BatchItem(line.strip(), path, _sidecar_transcript(path)))
+    return items
+
+
+def _sidecar_transcript(path):
+    """Expected transcript from a .txt file next to the recording, if there is one"""
+    transcript_path = os.path.splitext(path)[0] + ".txt"
+    if os.path.exists(transcript_path):
+        with open(transcript_path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    return None
+
+
+def render_path(render_dir, item_id):
+    """Where the reply to item_id is rendered; always a .wav file inside render_dir
+
+    Manifest ids may be absolute or climb out with '..'; the drive, root and
+    parent parts are dropped so only the rest names the file below render_dir.
+    """
+    relative = os.path.splitdrive(item_id.replace("\\", "/"))[1]
+    parts = [part for part in relative.split("/") if part not in ("", ".", "..")]
+    if not parts:
+        raise ValueError(f"no file name in id {item_id!r}")
+    root = os.path.realpath(render_dir)
+    path = os.path.realpath(os.path.join(root, *parts[:-1], os.path.splitext(parts[-1])[0] + ".wav"))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"rendered reply for {item_id!r} would be written outside {render_dir}")
+    return path
+
+
+def load_done(results_path, retry_failed=True):
+    """IDs already processed according to an existing results file"""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run; the file will be redone
+                continue
+            if entry.get("status") != "error" or not retry_failed:
+                done.add(entry["id"])
+    return done
+
+
+class BatchRunner:
+    """Process BatchItems in parallel with a concurrency bound per backend"""
+
+    def __init__(self, recognizer, model, tts=None, render_dir=None, jobs=4,
+                 stt_concurrency=4, llm_concurrency=4, tts_concurrency=1):
+        self.recognizer = recognizer
+        self.model = model
+        self.tts = tts
+        self.render_dir = render_dir
+        self.jobs = jobs
+        # Recordings are resampled to 16 kHz and trimmed before they are uploaded
+        self.frontend = AudioFrontEnd()
+
+        # Each external backend gets its own limit, whatever the number of jobs
+        self._stt_slots = threading.Semaphore(stt_concurrency)
+        self._llm_slots = threading.Semaphore(llm_concurrency)
+        self._tts_slots = threading.Semaphore(tts_concurrency)
+
+    def process(self, item):
+        """Run one file through STT, the LLM and optionally TTS; returns its result record"""
+        result = {"id": item.id, "path": item.path, "expected": item.expected, "timings": {}}
+        timings = result["timings"]
+        started = time.perf_counter()
+        stage_started = started
+
+        def lap(stage):
+            nonlocal stage_started
+            now = time.perf_counter()
+            timings[stage] = round((now - stage_started) * 1000.0, 1)
+            stage_started = now
+
+        try:
+            with sr.AudioFile(item.path) as source:
+                audio = sr.Recognizer().record(source)
+            audio = self.frontend.prepare(audio)
+            result["upload_bytes"] = len(audio.frame_data)
+            if hasattr(self.recognizer, "add") and item.expected:
+                # Fake recognizer: it answers with the expected transcript
+                self.recognizer.add(audio, item.expected)
+            lap("load")
+
+            with self._stt_slots:
+                stage_started = time.perf_counter()
+                try:
+                    transcript = self.recognizer.recognize_google(audio)
+                except sr.UnknownValueError:
+                    transcript = None
+            lap("stt")
+            result["transcript"] = transcript
+            if item.expected is not None:
+                result["match"] = transcript is not None and \
+                    normalize_utterance(transcript) == normalize_utterance(item.expected)
+            if not transcript:
+                result["status"] = "unrecognized"
+                return result
+
+            # Each recording is a conversation of its own
+            prompt_builder = PromptBuilder()
+            prompt_builder.add("user", transcript)
+            with self._llm_slots:
+                stage_started = time.perf_counter()
+                response = self.model.generate_content(prompt_builder.build())
+            lap("llm")
+            if hasattr(response, 'parts') and response.parts:
+                reply = response.parts[0].text.strip()
+            else:
+                reply = response.text.strip()
+            result["reply"] = reply
+            result["fallback"] = bool(getattr(response, 'local', False))
+
+            if self.render_dir and self.tts is not None:
+                with self._tts_slots:
+                    stage_started = time.perf_counter()
+                    job = self.tts.synthesize(reply)
+                    job.wait()
+                if job.error is not None:
+                    raise job.error
+                out_path = render_path(self.render_dir, item.id)
+                if os.path.exists(out_path) and os.path.samefile(out_path, item.path):
+                    raise ValueError(f"rendered reply would overwrite the recording {item.path}")
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                with open(out_path, "wb") as f:
+                    f.write(job.audio or b"")
+                lap("tts")
+                result["audio_out"] = out_path
+            result["status"] = "ok"
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = f"{type(e).__name__}: {e}"
+        finally:
+            timings["total"] = round((time.perf_counter() - started) * 1000.0, 1)
+            result["finished_at"] = round(time.time(), 3)
+        return result
+
+    def run(self, items, results_path, progress=True):
+        """Process every item, appending results as they finish; returns the new records
+
+        On Ctrl+C, files not yet started are cancelled rather than run, the
+        records of files already finished are written, and the
+        KeyboardInterrupt is re-raised.
+        """
+        lock = threading.Lock()
+        records = []
+        written = set()
+        executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="batch")
+        with open(results_path, "a", encoding="utf-8") as results:
+            def write(future):
+                record = future.result()
+                with lock:
+                    results.write(json.dumps(record) + "\n")
+                    results.flush()
+                    records.append(record)
+                    written.add(future)
+                return record
+
+            futures = [executor.submit(self.process, item) for item in items]
+            try:
+                for count, future in enumerate(as_completed(futures), 1):
+                    record = write(future)
+                    if progress:
+                        print(f"[{count}/{len(items)}] {record['status']:<12} {record['id']} "
+                              f"({record['timings']['total']:.0f} ms)")
+            except KeyboardInterrupt:
+                # Queued files would each cost a recognizer call; only those already running finish
+                for future in futures:
+                    future.cancel()
+                executor.shutdown(wait=False)
+                for future in futures:
+                    if future.done() and not future.cancelled() and future not in written:
+                        write(future)
+                raise
+        executor.shutdown()
+        return records
+
+
+def summarize(records):
+    """Print status counts, transcript accuracy and stage timing percentiles"""
+    statuses = {}
+    for record in records:
+        statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+    print("Results: " + ", ".join(f"{count} {status}" for status, count in sorted(statuses.items())))
+
+    checked = [record for record in records if "match" in record]
+    if checked:
+        matches = sum(1 for record in checked if record["match"])
+        print(f"Transcripts matching the expected text: {matches}/{len(checked)}")
+
+    print(f"{'stage':<8}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}")
+    for stage in STAGES:
+        values = sorted(record["timings"][stage] for record in records if stage in record["timings"])
+        if values:
+            print(f"{stage:<8}{len(values):>7}{percentile(values, 50):>10.1f}{percentile(values, 95):>10.1f}")
+
+
+def create_components(fake=False, render=False):
+    """Recognizer, model and (when rendering) TTS service for a batch run"""
+    if fake:
+        from fakes import FakeModel, FakeTTSEngine, LookupRecognizer
+        from tts_engine import TTSEngineService
+        recognizer = LookupRecognizer()
+        model = FakeModel()
+        tts = TTSEngineService(engine_factory=lambda driver_name: FakeTTSEngine()) if render else None
+    else:
+        import google.generativeai as genai
+        from tts_engine import get_tts_service
+        load_dotenv()
+        recognizer = sr.Recognizer()
+        genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+        model = genai.GenerativeModel('gemini-1.5-flash')
+        tts = get_tts_service() if render else None
+    if tts is not None:
+        tts.wait_ready()
+        if tts.init_error:
+            raise tts.init_error
+    return recognizer, ResilientModel(model), tts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Transcribe and answer recorded utterances in bulk")
+    parser.add_argument("inputs", nargs="+", help="directories of WAV files or manifest files")
+    parser.add_argument("--results", default="batch_results.jsonl", help="JSONL results file (appended to)")
+    parser.add_argument("--render-dir", help="write each reply as a WAV file into this directory")
+    parser.add_argument("--jobs", type=int, default=8, help="files processed in parallel")
+    parser.add_argument("--stt-concurrency", type=int, default=4, help="concurrent speech recognition requests")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="concurrent Gemini requests")
+    parser.add_argument("--tts-concurrency", type=int, default=1, help="concurrent speech synthesis jobs")
+    parser.add_argument("--restart", action="store_true", help="ignore earlier results and process every file")
+    parser.add_argument("--keep-failed", action="store_true", help="do not retry files that failed earlier")
+    parser.add_argument("--fake", action="store_true",
+                        help="use fake backends; transcripts come from the manifest or .txt sidecars")
+    parser.add_argument("--quiet", action="store_true", help="no per-file progress lines")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    items = collect_items(args.inputs)
+    if args.restart and os.path.exists(args.results):
+        os.remove(args.results)
+    done = load_done(args.results, retry_failed=not args.keep_failed)
+    todo = [item for item in items if item.id not in done]
+    print(f"{len(items)} files, {len(items) - len(todo)} already done, {len(todo)} to process")
+    if not todo:
+        return 0
+
+    recognizer, model, tts = create_components(args.fake, render=bool(args.render_dir))
+    runner = BatchRunner(recognizer, model, tts, args.render_dir, args.jobs,
+                         args.stt_concurrency, args.llm_concurrency, args.tts_concurrency)
+    try:
+        records = runner.run(todo, args.results, progress=not args.quiet)
+    except KeyboardInterrupt:
+        print("Interrupted; run again to continue where this run stopped")
+        return 130
+    finally:
+        if tts is not None:
+            tts.shutdown()
+    summarize(records)
+    return 1 if any(record["status"] == "error" for record in records) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,422 @@
+"""Offline end-to-end benchmark of the speech bot
+
+Drives scripted conversations, including mid-reply interruptions, through
+the real SpeechBot pipeline with a fake microphone, recognizer, LLM and TTS
+engine, so latency and throughput can be compared across commits without
+audio hardware or network access.
+
+    python benchmark.py --turns 12 --save-baseline baseline.json
+    python benchmark.py --turns 12 --compare baseline.json --fail-on-regression
+"""
+import argparse
+import contextlib
+import datetime
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import speech_recognition as sr
+
+from fakes import (FakeModel, FakeTTSEngine, ScriptedAudioSource, ScriptedRecognizer, fixed_latency,
+                   lognormal_latency, load_wav, synthetic_speech)
+from latency_tracing import percentile, print_summary
+from speech_bot import SpeechBot
+from tts_engine import TTSEngineService
+
+# Short exchanges, answered in one or two sentences
+TURNS = [
+    ("what time is it in tokyo", "It is early evening in Tokyo right now."),
+    ("how do i boil an egg", "Put the egg in boiling water for about nine minutes. Then cool it in cold water."),
+    ("what is the capital of australia", "The capital of Australia is Canberra."),
+    ("thanks that helps", "You're welcome! Let me know if there is anything else."),
+]
+
+# Requests with long replies; these are the turns the user interrupts
+LONG_TURNS = [
+    ("tell me about the history of the printing press",
+     "The printing press was developed by Johannes Gutenberg around 1440. "
+     "It used movable metal type, oil based ink and a wooden screw press. "
+     "Within a few decades printing shops had spread to more than two hundred cities in Europe. "
+     "Books became far cheaper, literacy rose and ideas travelled faster than ever before. "
+     "Many historians count it among the most important inventions of the second millennium."),
+    ("explain how a rainbow forms",
+     "A rainbow forms when sunlight enters raindrops and is bent on the way in. "
+     "Inside the drop the light reflects off the back surface. "
+     "It bends again as it leaves, and each colour bends by a slightly different amount. "
+     "That spreads white light into a band of colours at an angle of about forty two degrees. "
+     "You always see it with the sun behind you and the rain in front of you."),
+]
+
+INTERRUPTIONS = [
+    ("okay stop that is enough", "Sure, I'll stop there."),
+    ("wait what year was that", "That was around the year 1440."),
+]
+
+# The interruption with --command: a bare voice command
+COMMAND = "stop"
+
+# Metrics compared against a baseline; True when a higher value is better
+METRICS = {
+    "turn_latency_p50": False,
+    "turn_latency_p95": False,
+    "barge_in_p50": False,
+    "barge_in_p95": False,
+    "chunk_gap_p50": False,
+    "chunk_gap_p95": False,
+    "command_reaction_p50": False,
+    "command_reaction_p95": False,
+    "turns_per_minute": True,
+    "cpu_ms_per_turn": False,
+    "upload_bytes_per_utterance": False,
+}
+
+
+def make_reply(replies, default="I'm not sure about that."):
+    """FakeModel reply function answering the last user line of the prompt"""
+    def reply(prompt):
+        user_lines = [line for line in prompt.splitlines() if line.startswith("User: ")]
+        text = user_lines[-1][len("User: "):].strip() if user_lines else ""
+        return replies.get(text, default)
+    return reply
+
+
+def load_wav_turns(directory, sample_rate):
+    """(transcript, audio) pairs from WAV files, transcripts from sibling .txt files or the file name"""
+    turns = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.wav"))):
+        transcript_path = os.path.splitext(path)[0] + ".txt"
+        if os.path.exists(transcript_path):
+            with open(transcript_path, "r", encoding="utf-8") as f:
+                transcript = f.read().strip()
+        else:
+            transcript = os.path.splitext(os.path.basename(path))[0].replace("_", " ")
+        turns.append((transcript, load_wav(path, sample_rate)))
+    return turns
+
+
+def speech_for(text, sample_rate, seed):
+    """Synthetic speech lasting about as long as saying text"""
+    return synthetic_speech(max(0.6, len(text.split()) / 3.0), sample_rate=sample_rate, seed=seed)
+
+
+def git_commit():
+    """Current commit hash, or None outside a git checkout"""
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=5,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return output.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def wait_until_quiet(bot, engine, settle=0.5, timeout=30.0):
+    """Wait until the bot has stopped speaking and stayed quiet for settle seconds"""
+    deadline = time.perf_counter() + timeout
+    quiet_since = None
+    while time.perf_counter() < deadline:
+        busy = engine.current is not None or bot.tts.is_busy() or bot.conversation.busy
+        if busy:
+            quiet_since = None
+        elif quiet_since is None:
+            quiet_since = time.perf_counter()
+        elif time.perf_counter() - quiet_since >= settle:
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class BenchmarkRun:
+    """One scripted conversation against a headless SpeechBot"""
+
+    def __init__(self, args, workdir):
+        self.args = args
+        rate = 16000
+        self.sample_rate = rate
+
+        replies = dict(TURNS + LONG_TURNS + INTERRUPTIONS)
+        if args.wav_dir:
+            self.turns = load_wav_turns(args.wav_dir, rate)
+            if not self.turns:
+                raise SystemExit(f"No WAV files found in {args.wav_dir}")
+        else:
+            self.turns = [(text, speech_for(text, rate, seed)) for seed, (text, _) in enumerate(TURNS)]
+        self.long_turns = [(text, speech_for(text, rate, 100 + seed)) for seed, (text, _) in enumerate(LONG_TURNS)]
+        self.interruptions = [(text, speech_for(text, rate, 200 + seed))
+                              for seed, (text, _) in enumerate(INTERRUPTIONS)]
+        if args.command:
+            self.interruptions = [(COMMAND, speech_for(COMMAND, rate, 300))]
+
+        def latency(median):
+            return lognormal_latency(median, args.jitter) if args.jitter else fixed_latency(median)
+
+        self.engine = FakeTTSEngine(words_per_second=args.tts_wps)
+        echo = None
+        hears_echo = None
+        if args.echo:
+            # The bot's voice leaks into the microphone; recognizing it yields what it said
+            echo = lambda size: self.engine.echo(size, args.echo)
+            hears_echo = lambda audio: (None if self.source.contains_clip(audio.get_raw_data())
+                                        else self.engine.utterances[-1].text if self.engine.utterances else None)
+        self.source = ScriptedAudioSource(sample_rate=rate, seed=args.seed, echo=echo)
+        self.recognizer = ScriptedRecognizer(latency=latency(args.stt_latency), seed=args.seed, hears_echo=hears_echo)
+        self.model = FakeModel(reply=make_reply(replies), latency=latency(args.llm_latency),
+                               chunk_latency=fixed_latency(args.chunk_latency), seed=args.seed)
+        self.tts = TTSEngineService(engine_factory=lambda driver_name: self.engine, buffered=args.buffered,
+                                    player=self.engine.play_wav)
+        self.tts.wait_ready()
+
+        self.bot = SpeechBot(microphone=self.source, recognizer=self.recognizer, model=self.model, tts=self.tts,
+                             headless=True, stream_responses=not args.no_stream,
+                             speculative_generation=args.speculate,
+                             echo_suppression=not args.no_echo_suppression,
+                             command_spotting=not args.no_command_spotting,
+                             command_templates_path=os.path.join(workdir, "commands.json"),
+                             conversation_store_path=os.path.join(workdir, "conversations.db"),
+                             response_cache_path=os.path.join(workdir, "responses.json"),
+                             tts_cache_dir=os.path.join(workdir, "tts"),
+                             latency_log_path=os.path.join(workdir, "latency.jsonl"))
+
+        # The user's own example of the command, as enrollment would record it
+        self.spotting = args.command and self.bot.commands is not None
+        if self.spotting:
+            self.bot.commands.enroll(COMMAND, sr.AudioData(self.interruptions[0][1], rate, 2))
+
+        self.turn_latencies = []
+        self.barge_ins = []
+        self.command_reactions = []
+        self.chunk_gaps = []
+        self.missed_replies = 0
+        self.missed_barge_ins = 0
+
+    def run(self):
+        """Play every turn and return the measured metrics"""
+        self.bot.start_conversation()
+        try:
+            # Let the noise floor tracker finish its warm-up before the first turn
+            deadline = time.perf_counter() + 5.0
+            while not self.bot.calibrator.calibrated and time.perf_counter() < deadline:
+                time.sleep(0.05)
+
+            started = time.perf_counter()
+            cpu_started = time.process_time()
+            for index in range(self.args.turns):
+                interrupt = self.args.interrupt_every and (index + 1) % self.args.interrupt_every == 0
+                self.run_turn(index, interrupt)
+            wall = time.perf_counter() - started
+            cpu = time.process_time() - cpu_started
+        finally:
+            self.bot.stop_conversation()
+            self.tts.shutdown()
+        return self.metrics(wall, cpu)
+
+    def run_turn(self, index, interrupt):
+        """Speak one user turn and measure until the bot has finished answering"""
+        engine = self.engine
+        if interrupt:
+            text, audio = self.long_turns[index % len(self.long_turns)]
+        else:
+            text, audio = self.turns[index % len(self.turns)]
+        heard = len(engine.utterances)
+
+        self.expect(text)
+        clip = self.source.inject(audio)
+
+        # Turn latency: end of the user's speech -> first audio of the reply
+        if not engine.wait_for(lambda e: len(e.utterances) > heard, timeout=self.args.timeout):
+            self.missed_replies += 1
+            wait_until_quiet(self.bot, engine)
+            return
+        self.turn_latencies.append(engine.utterances[heard].started_at - clip.ended_at)
+
+        if interrupt:
+            time.sleep(self.args.interrupt_after)
+            interruption, interruption_audio = self.interruptions[index % len(self.interruptions)]
+            self.expect(interruption, spotted=self.spotting)
+            barge_in = self.source.inject(interruption_audio)
+
+            # Barge-in latency: user starts talking over the bot -> bot audio stops
+            def interrupted(e):
+                return next((u for u in e.utterances[heard:] if u.silenced_at and barge_in.started_at
+                             and u.silenced_at >= barge_in.started_at), None)
+            if engine.wait_for(interrupted, timeout=self.args.timeout):
+                self.barge_ins.append(interrupted(engine).silenced_at - barge_in.started_at)
+            else:
+                self.missed_barge_ins += 1
+
+            # Command reaction: user stops saying the command -> the reply is stopped
+            if self.args.command:
+                def stopped(e):
+                    return next((u for u in e.utterances[heard:] if u.interrupted and u.finished_at), None)
+                if engine.wait_for(stopped, timeout=self.args.timeout) and barge_in.ended_at:
+                    self.command_reactions.append(stopped(engine).finished_at - barge_in.ended_at)
+
+        wait_until_quiet(self.bot, engine, timeout=self.args.timeout)
+
+        # Silence between consecutive sentences of a reply that was not cut short
+        spoken = engine.utterances[heard:]
+        for previous, utterance in zip(spoken, spoken[1:]):
+            if not previous.interrupted and previous.finished_at is not None:
+                self.chunk_gaps.append(utterance.started_at - previous.finished_at)
+
+    def expect(self, text, spotted=False):
+        """Script the transcript of the next user utterance; a spotted command never reaches the recognizer"""
+        if spotted:
+            return
+        if self.args.speculate:
+            # The interim transcript taken at the pause comes first
+            self.recognizer.expect(text)
+        self.recognizer.expect(text)
+
+    def metrics(self, wall, cpu):
+        turn_latencies = sorted(self.turn_latencies)
+        barge_ins = sorted(self.barge_ins)
+        chunk_gaps = sorted(self.chunk_gaps)
+        command_reactions = sorted(self.command_reactions)
+        speculation = self.bot.conversation.speculation_stats.stats()
+        echo = self.bot.echo.stats() if self.bot.echo is not None else {}
+        frontend = self.bot.frontend.stats()
+        return {
+            "turns": self.args.turns,
+            "wall_seconds": wall,
+            "cpu_seconds": cpu,
+            "turn_latency_p50": percentile(turn_latencies, 50),
+            "turn_latency_p95": percentile(turn_latencies, 95),
+            "barge_in_p50": percentile(barge_ins, 50),
+            "barge_in_p95": percentile(barge_ins, 95),
+            "chunk_gap_p50": percentile(chunk_gaps, 50),
+            "chunk_gap_p95": percentile(chunk_gaps, 95),
+            "command_reaction_p50": percentile(command_reactions, 50),
+            "command_reaction_p95": percentile(command_reactions, 95),
+            "turns_per_minute": self.args.turns / wall * 60.0 if wall else None,
+            "cpu_ms_per_turn": cpu / self.args.turns * 1000.0 if self.args.turns else None,
+            "missed_replies": self.missed_replies,
+            "missed_barge_ins": self.missed_barge_ins,
+            "stt_calls": self.recognizer.calls,
+            "upload_bytes_per_utterance": frontend["bytes_out_per_utterance"],
+            "frontend_cpu_ms_per_s": frontend["cpu_ms_per_audio_second"],
+            "replies_cancelled": self.bot.conversation.replies_cancelled,
+            "commands_handled": self.bot.conversation.commands_handled,
+            "echo_suppressed": echo.get("segments_suppressed"),
+            "echo_rejected": echo.get("transcripts_rejected"),
+            "speculation_hit_rate": speculation["hit_rate"],
+            "speculation_saved_ms": speculation["saved_ms_per_hit"],
+        }
+
+
+def print_metrics(metrics, file=None):
+    file = file or sys.stdout
+    for name, value in metrics.items():
+        if isinstance(value, float):
+            print(f"{name:<28}{value:>12.3f}", file=file)
+        else:
+            print(f"{name:<28}{str(value):>12}", file=file)
+
+
+def compare(metrics, baseline, threshold):
+    """Print current vs baseline metrics; return the names of regressed metrics"""
+    regressions = []
+    print(f"{'metric':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, higher_is_better in METRICS.items():
+        old = baseline.get("metrics", {}).get(name)
+        new = metrics.get(name)
+        if old is None or new is None:
+            print(f"{name:<28}{str(old):>12}{str(new):>12}{'-':>10}")
+            continue
+        change = (new - old) / old * 100.0 if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<28}{old:>12.3f}{new:>12.3f}{change:>+9.1f}%{flag}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the speech bot")
+    parser.add_argument("--turns", type=int, default=8, help="number of user turns to play")
+    parser.add_argument("--interrupt-every", type=int, default=4,
+                        help="interrupt the bot mid-reply on every Nth turn (0 disables)")
+    parser.add_argument("--interrupt-after", type=float, default=1.0,
+                        help="seconds of bot speech before the user interrupts")
+    parser.add_argument("--wav-dir", help="directory of recorded user turns (*.wav with optional .txt transcripts)")
+    parser.add_argument("--stt-latency", type=float, default=0.3, help="median recognizer latency in seconds")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="median LLM time to first chunk in seconds")
+    parser.add_argument("--chunk-latency", type=float, default=0.03, help="gap between streamed LLM chunks")
+    parser.add_argument("--tts-wps", type=float, default=5.0, help="speaking speed of the fake TTS in words/second")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="lognormal sigma applied to STT and LLM latency (0 for fixed latency)")
+    parser.add_argument("--no-stream", action="store_true", help="benchmark the non-streaming reply path")
+    parser.add_argument("--buffered", action="store_true",
+                        help="render the next sentence while the current one plays")
+    parser.add_argument("--echo", type=float, default=0.0,
+                        help="fraction of the bot's voice leaking into the microphone (0 for none)")
+    parser.add_argument("--no-echo-suppression", action="store_true",
+                        help="let the bot's own voice reach speech detection and recognition")
+    parser.add_argument("--speculate", action="store_true",
+                        help="start generating from interim transcripts before endpointing")
+    parser.add_argument("--command", action="store_true",
+                        help=f"interrupt with the bare command '{COMMAND}' instead of a sentence")
+    parser.add_argument("--no-command-spotting", action="store_true",
+                        help="recognize commands through the recognizer instead of on the device")
+    parser.add_argument("--timeout", type=float, default=30.0, help="give up on a turn after this many seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", metavar="PATH", help="write the results as a baseline JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="compare the results with a saved baseline")
+    parser.add_argument("--threshold", type=float, default=15.0,
+                        help="percent change counted as a regression when comparing")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="exit with status 1 if any metric regressed beyond the threshold")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own log output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="speech-bot-bench-")
+
+    # The bot logs every step; keep the report readable unless asked otherwise
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            run = BenchmarkRun(args, workdir)
+            metrics = run.run()
+    stages = run.bot.tracer.summary()
+    run.bot.tracer.close()
+
+    print("Benchmark results")
+    print_metrics(metrics)
+    print("\nPer-stage latency")
+    print_summary(stages)
+
+    results = {
+        "commit": git_commit(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("save_baseline", "compare", "fail_on_regression", "verbose")},
+        "metrics": metrics,
+        "stages": stages,
+    }
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline written to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.compare} (commit {baseline.get('commit') or 'unknown'})")
+        if baseline.get("config") != results["config"]:
+            print("Warning: the baseline was recorded with different settings")
+        regressions = compare(metrics, baseline, args.threshold)
+        if regressions and args.fail_on_regression:
+            print(f"Regressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
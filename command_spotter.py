@@ -0,0 +1,259 @@
+"""Local spotting of short voice commands
+
+Matches a captured utterance against recorded examples of each command
+(dynamic time warping over per-frame loudness and zero-crossing rate), so
+'stop' or 'repeat' can be acted on without a recognizer round trip or an
+LLM call. Templates are enrolled from the user's own voice:
+
+    python command_spotter.py enroll stop
+    python command_spotter.py test
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+from audio_frontend import TARGET_RATE, TARGET_WIDTH, frame_crossings, frame_energies, to_mono_16k
+from response_cache import normalize_utterance
+
+# Commands understood out of the box
+COMMANDS = ("stop", "pause", "resume", "repeat", "louder", "quieter", "slower", "faster")
+
+# Audio is compared at the recognizer's sample rate and width, in frames of this length
+SAMPLE_RATE = TARGET_RATE
+SAMPLE_WIDTH = TARGET_WIDTH
+FRAME_SECONDS = 0.02
+
+# Frames quieter than this, relative to the loudest, are trimmed from both ends
+TRIM_DB = 25.0
+
+# Zero-crossing rate is scaled to weigh about as much as loudness in the distance
+ZCR_WEIGHT = 10.0
+
+
+def features(raw_data, sample_rate=SAMPLE_RATE, sample_width=SAMPLE_WIDTH, frame_seconds=FRAME_SECONDS):
+    """Per-frame (loudness, zero-crossing rate) of the speech in raw audio, silence trimmed"""
+    samples_per_frame = int(sample_rate * frame_seconds)
+    energies = frame_energies(raw_data, sample_width, samples_per_frame)
+    loudest = max(energies, default=0)
+    if not loudest:
+        return []
+
+    # Keep the stretch between the first and last frame within TRIM_DB of the peak
+    floor = loudest * 10 ** (-TRIM_DB / 20.0)
+    voiced = [i for i, energy in enumerate(energies) if energy >= floor]
+    first, last = voiced[0], voiced[-1]
+
+    frame_bytes = samples_per_frame * sample_width
+    crossings = frame_crossings(raw_data[first * frame_bytes:(last + 1) * frame_bytes], sample_width,
+                                samples_per_frame)
+    result = []
+    for energy, crossing in zip(energies[first:last + 1], crossings):
+        # Loudness in bels below the peak, so the distance ignores the recording level
+        loudness = math.log10((energy + 1.0) / (loudest + 1.0))
+        result.append((loudness, crossing / float(samples_per_frame) * ZCR_WEIGHT))
+    return result
+
+
+def dtw_distance(a, b, band=0.5):
+    """Average frame distance along the best alignment of two feature sequences
+
+    Alignments are confined to a band around the diagonal, band times the
+    longer sequence wide.
+    """
+    n, m = len(a), len(b)
+    if not n or not m:
+        return float("inf")
+    width = max(int(band * max(n, m)), abs(n - m) + 1)
+    infinity = float("inf")
+    previous = [infinity] * (m + 1)
+    previous[0] = 0.0
+    for i in range(1, n + 1):
+        current = [infinity] * (m + 1)
+        centre = i * m // n
+        ai = a[i - 1]
+        for j in range(max(1, centre - width), min(m, centre + width) + 1):
+            bj = b[j - 1]
+            cost = math.sqrt((ai[0] - bj[0]) ** 2 + (ai[1] - bj[1]) ** 2)
+            current[j] = cost + min(previous[j], previous[j - 1], current[j - 1])
+        previous = current
+    return previous[m] / (n + m)
+
+
+def match_command(text, commands=COMMANDS):
+    """The command a transcript consists of, or None"""
+    text = normalize_utterance(text)
+    return text if text in commands else None
+
+
+class CommandSpotter:
+    """Recognize a small set of spoken commands on the device
+
+    Each command has one or more templates, feature sequences of enrolled
+    examples. spot() compares an utterance with every template and returns
+    the closest command when its distance is below threshold; utterances
+    longer than max_seconds of speech are left to the recognizer without
+    being compared, and a template is only compared with speech at most
+    max_stretch times longer or shorter than itself. Templates are
+    persisted as JSON at path.
+    """
+
+    def __init__(self, path=None, commands=COMMANDS, threshold=0.2, max_seconds=1.2, max_stretch=1.5,
+                 max_templates=5):
+        self.path = path
+        self.commands = tuple(commands)
+        self.threshold = threshold
+        self.max_frames = int(max_seconds / FRAME_SECONDS)
+        self.max_stretch = max_stretch
+        self.max_templates = max_templates
+        self._templates = {}
+        self._lock = threading.Lock()
+
+        self.spotted = 0
+        self.rejected = 0
+        self.skipped = 0
+        self.seconds = 0.0
+
+        if path and os.path.exists(path):
+            self.load()
+
+    @property
+    def active(self):
+        """True once at least one command has a template"""
+        return bool(self._templates)
+
+    def enroll(self, command, audio_data):
+        """Add an example of a command, given as sr.AudioData"""
+        if command not in self.commands:
+            raise ValueError(f"Unknown command: {command}")
+        template = features(self._raw(audio_data))
+        if not template:
+            raise ValueError("No speech in the example")
+        with self._lock:
+            templates = self._templates.setdefault(command, [])
+            templates.append(template)
+            del templates[:-self.max_templates]
+
+    def spot(self, audio_data):
+        """The command spoken in an utterance (sr.AudioData), or None"""
+        if not self._templates:
+            return None
+        started = time.perf_counter()
+        try:
+            sequence = features(self._raw(audio_data))
+            if not sequence or len(sequence) > self.max_frames:
+                self.skipped += 1
+                return None
+            with self._lock:
+                templates = [(command, template) for command, examples in self._templates.items()
+                             for template in examples]
+            best, best_distance = None, float("inf")
+            for command, template in templates:
+                stretch = max(len(sequence), len(template)) / float(min(len(sequence), len(template)))
+                if stretch > self.max_stretch:
+                    continue
+                distance = dtw_distance(sequence, template)
+                if distance < best_distance:
+                    best, best_distance = command, distance
+            if best_distance > self.threshold:
+                self.rejected += 1
+                return None
+            self.spotted += 1
+            return best
+        finally:
+            self.seconds += time.perf_counter() - started
+
+    @staticmethod
+    def _raw(audio_data):
+        return to_mono_16k(audio_data.frame_data, audio_data.sample_rate, audio_data.sample_width)
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._templates = {command: [[tuple(frame) for frame in template] for template in templates]
+                               for command, templates in data.get("templates", {}).items()
+                               if command in self.commands}
+        except (OSError, ValueError) as e:
+            print(f"Error loading command templates: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with self._lock:
+                data = {"templates": self._templates}
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving command templates: {e}")
+
+    def stats(self):
+        """Counters of spotted, rejected and skipped utterances and the time spent"""
+        compared = self.spotted + self.rejected
+        return {
+            "templates": sum(len(templates) for templates in self._templates.values()),
+            "spotted": self.spotted,
+            "rejected": self.rejected,
+            "skipped": self.skipped,
+            "ms_per_utterance": self.seconds / (compared + self.skipped) * 1000.0 if compared + self.skipped else None,
+        }
+
+
+def _record(recognizer, microphone, prompt):
+    print(prompt)
+    with microphone as source:
+        return recognizer.listen(source, timeout=5, phrase_time_limit=2)
+
+
+def main(argv=None):
+    # Only the enrollment tool needs the microphone
+    import speech_recognition as sr
+
+    default_path = os.getenv('COMMAND_TEMPLATES_PATH') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), ".cache", "commands.json")
+    parser = argparse.ArgumentParser(description="Enroll and test local voice commands")
+    parser.add_argument("--path", default=default_path, help="where the command templates are stored")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    enroll = subparsers.add_parser("enroll", help="record examples of commands")
+    enroll.add_argument("commands", nargs="*", help=f"commands to record (default: {' '.join(COMMANDS)})")
+    enroll.add_argument("--examples", type=int, default=3, help="examples to record per command")
+    subparsers.add_parser("test", help="say commands and see what is spotted")
+    args = parser.parse_args(argv)
+
+    spotter = CommandSpotter(path=args.path)
+    recognizer = sr.Recognizer()
+    microphone = sr.Microphone(sample_rate=SAMPLE_RATE)
+    with microphone as source:
+        recognizer.adjust_for_ambient_noise(source, duration=1)
+
+    if args.action == "enroll":
+        for command in args.commands or COMMANDS:
+            for example in range(args.examples):
+                audio = _record(recognizer, microphone, f"Say '{command}' ({example + 1}/{args.examples})")
+                spotter.enroll(command, audio)
+        spotter.save()
+        print(f"Templates saved to {args.path}")
+        return 0
+
+    if not spotter.active:
+        print(f"No templates in {args.path}; run 'enroll' first")
+        return 1
+    try:
+        while True:
+            audio = _record(recognizer, microphone, "Say a command (Ctrl+C to quit)")
+            print(f"Spotted: {spotter.spot(audio)}  {spotter.stats()}")
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
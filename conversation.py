@@ -0,0 +1,509 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from generation import GenerationCancelled
+from speculation import SpeculationStats, transcript_similarity
+from text_segmenter import SentenceSegmenter
+
+# Conversation states
+IDLE = "idle"
+LISTENING = "listening"
+THINKING = "thinking"
+SPEAKING = "speaking"
+STOPPED = "stopped"
+
+# Steps applied by the louder/quieter and slower/faster commands
+VOLUME_STEP = 0.2
+RATE_STEP = 25
+MIN_RATE = 80
+MAX_RATE = 300
+
+
+class Transcript:
+    """What the user said, with the timing of the utterance it came from"""
+
+    def __init__(self, text, turn_id, speech_started_at=None, speech_ended_at=None, provisional=False,
+                 command=None):
+        self.text = text
+        self.turn_id = turn_id
+        self.speech_started_at = speech_started_at
+        self.speech_ended_at = speech_ended_at
+        # True for an interim transcript taken at a pause, before endpointing
+        self.provisional = provisional
+        # A voice command such as "stop", carried out without a reply
+        self.command = command
+
+
+class Reply:
+    """The bot's answer to one transcript: its LLM generation and queued speech"""
+
+    def __init__(self, reply_id, transcript):
+        self.id = reply_id
+        self.transcript = transcript
+        self.generation = None
+        self.jobs = []
+        self.generated = False
+        self.text = None
+        self.cancelled = False
+        self.barge_in_started_at = None
+        # A repeat of an earlier reply, spoken again without generating
+        self.repeated = False
+
+        # A speculative reply answers an interim transcript; its sentences are
+        # held back until the final transcript confirms it
+        self.speculative = False
+        self.pending = []
+        self.started_at = time.perf_counter()
+        self.first_sentence_at = None
+
+    def spoken_jobs(self):
+        """Jobs that actually started playing"""
+        return [job for job in self.jobs if job.started_at is not None]
+
+    def playing(self):
+        return any(not job.done.is_set() for job in self.jobs)
+
+
+class ConversationOrchestrator:
+    """Event-driven turn taking: one thread owns all conversation state
+
+    A recognizer thread turns endpointed utterances into transcript events;
+    LLM sentences and completions arrive from the reply workers, and the TTS
+    service reports finished playback through job callbacks. Everything is
+    funnelled through one bounded event queue and handled in order on the
+    orchestrator thread, so there is at most one active reply and no flag is
+    shared between threads. A transcript that arrives while a reply is being
+    generated or spoken cancels that reply (generation and playback) before
+    the new one starts.
+
+    With speculate set, an interim transcript taken at a pause starts a
+    speculative reply whose sentences are held back. If the final transcript
+    is at least speculation_threshold similar, that reply is committed and
+    its sentences spoken; otherwise it is cancelled and a normal reply
+    starts. At most one speculation is in flight, and none while the bot is
+    speaking.
+
+    With barge_in_on_speech set, playback is paused the moment the capture
+    stream hears speech over the bot, so it falls silent without waiting
+    for the transcript; it resumes if the speech produces no transcript.
+    Whether paused or stopped, only the words that were heard go into the
+    history.
+
+    A transcript carrying a command (stop, pause, resume, repeat, louder,
+    quieter, slower, faster) is acted on directly: no reply is generated
+    and a reply in progress is only cancelled when the command says so.
+    """
+
+    def __init__(self, bot, fallback_message, error_message, max_events=64, speculate=False,
+                 speculation_threshold=0.9, barge_in_on_speech=False):
+        self.bot = bot
+        self.fallback_message = fallback_message
+        self.error_message = error_message
+        self.state = IDLE
+        self.reply = None
+        self.speculation = None
+        self.speculate = speculate
+        self.speculation_threshold = speculation_threshold
+        self.barge_in_on_speech = barge_in_on_speech
+        self._interrupted = None
+        # What the bot said last, for "repeat", and whether the user paused it
+        self._last_reply_text = None
+        self._user_paused = False
+        self._events = queue.Queue(maxsize=max_events)
+        self._reply_ids = itertools.count(1)
+        self._stopped = threading.Event()
+        self._thread = None
+        self._recognizer_thread = None
+
+        # Reply workers are reused across turns; a cancelled reply frees its worker at once
+        self._workers = ThreadPoolExecutor(max_workers=2, thread_name_prefix="reply")
+
+        # Counters for the status bar and benchmarks
+        self.replies_started = 0
+        self.replies_cancelled = 0
+        self.commands_handled = 0
+        self.speculation_stats = SpeculationStats()
+
+    @property
+    def busy(self):
+        """True while a reply is being generated or spoken"""
+        return self.reply is not None
+
+    def start(self):
+        """Start the orchestrator and recognizer threads"""
+        self._stopped.clear()
+        self.state = LISTENING
+        self._thread = threading.Thread(target=self._run, name="conversation")
+        self._thread.daemon = True
+        self._thread.start()
+        self._recognizer_thread = threading.Thread(target=self._recognize, name="recognizer")
+        self._recognizer_thread.daemon = True
+        self._recognizer_thread.start()
+
+    def stop(self, timeout=2.0):
+        """Cancel the active reply and stop both threads"""
+        self._stopped.set()
+        self._events.put(("stop",))
+        for thread in (self._thread, self._recognizer_thread):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join(timeout)
+        self._thread = None
+        self._recognizer_thread = None
+
+    def wait(self, timeout=None):
+        """Wait until the conversation has been stopped"""
+        return self._stopped.wait(timeout)
+
+    def post(self, *event):
+        """Queue an event for the orchestrator thread"""
+        if not self._stopped.is_set():
+            self._events.put(event)
+
+    def interrupt(self):
+        """Stop the current reply without starting a new one"""
+        self.post("interrupt")
+
+    def _recognize(self):
+        """Recognizer thread: transcribe every utterance the capture stream endpoints"""
+        while not self._stopped.is_set():
+            transcript = self.bot.listen(timeout=0.5)
+            if transcript is not None:
+                self.post("transcript", transcript)
+            elif self.bot.tts.paused and not self.bot.capture.in_speech:
+                # The speech that paused the bot did not turn into a transcript
+                self.post("no_speech")
+
+    def _run(self):
+        """Orchestrator thread: handle events one at a time"""
+        while True:
+            event = self._events.get()
+            kind = event[0]
+            if kind == "stop":
+                self._drop_speculation()
+                self._cancel_reply()
+                self.state = STOPPED
+                return
+            try:
+                getattr(self, f"_on_{kind}")(*event[1:])
+            except Exception as e:
+                print(f"Error handling {kind} event: {e}")
+                self._cancel_reply()
+                self._speak_error()
+
+    # Event handlers, all running on the orchestrator thread
+
+    def _on_transcript(self, transcript):
+        if transcript.provisional:
+            self._speculate(transcript)
+            return
+        if transcript.command is not None:
+            self._drop_speculation()
+            self._on_command(transcript)
+            return
+        if self.speculation is not None and self._commit_speculation(transcript):
+            return
+        if self.reply is not None:
+            # The user spoke over the bot: barge in
+            print(f"Interruption detected: {transcript.text}")
+            self.bot.gui.put(f"Interruption: {transcript.text}")
+            self._cancel_reply(barge_in_started_at=transcript.speech_started_at)
+        self._start_reply(transcript)
+
+    def _on_interrupt(self):
+        self._cancel_reply()
+
+    def _on_speech_started(self, started_at):
+        reply = self.reply
+        if not self.barge_in_on_speech or reply is None or not reply.playing() or self.bot.tts.paused:
+            return
+        # Fall silent now; the transcript decides whether this is a barge-in
+        self.bot.tts.pause()
+        print("Speech detected, pausing the reply")
+
+    def _on_no_speech(self):
+        if self.bot.tts.paused and not self._user_paused:
+            print("No interruption after all, resuming the reply")
+            self.bot.tts.resume()
+
+    def _on_command(self, transcript):
+        command = transcript.command
+        print(f"Command: {command}")
+        self.commands_handled += 1
+        tts = self.bot.tts
+        if command == "stop":
+            self._user_paused = False
+            self._cancel_reply(barge_in_started_at=transcript.speech_started_at)
+            tts.stop()
+        elif command == "pause":
+            if self.reply is not None and self.reply.playing():
+                # Stays paused until "resume", whatever else is heard
+                tts.pause()
+                self._user_paused = tts.paused
+                if not tts.paused:
+                    # Speech through the engine cannot be held; stop it instead
+                    self._cancel_reply(barge_in_started_at=transcript.speech_started_at)
+        elif command == "repeat":
+            self._cancel_reply(barge_in_started_at=transcript.speech_started_at)
+            self._repeat(transcript)
+        else:
+            if command == "louder":
+                tts.apply_settings(volume=tts.volume + VOLUME_STEP)
+            elif command == "quieter":
+                tts.apply_settings(volume=tts.volume - VOLUME_STEP)
+            elif command == "faster":
+                tts.apply_settings(rate=min(MAX_RATE, tts.rate + RATE_STEP))
+            elif command == "slower":
+                tts.apply_settings(rate=max(MIN_RATE, tts.rate - RATE_STEP))
+            # Anything but "pause" lets a reply paused at speech onset carry on
+            self._user_paused = False
+            if tts.paused:
+                tts.resume()
+        self.bot.tracer.record_between(transcript.turn_id, "command_to_action", transcript.speech_ended_at,
+                                       time.perf_counter())
+
+    def _repeat(self, transcript):
+        """Say the last reply again, as a reply of its own so it can be interrupted"""
+        self._user_paused = False
+        if self.bot.tts.paused:
+            self.bot.tts.resume()
+        if not self._last_reply_text:
+            return
+        reply = Reply(next(self._reply_ids), transcript)
+        reply.generated = True
+        reply.repeated = True
+        self.reply = reply
+        segmenter = SentenceSegmenter()
+        for sentence in segmenter.feed(self._last_reply_text) + segmenter.flush():
+            self._on_sentence(reply.id, sentence)
+        self._maybe_finish()
+
+    def _on_sentence(self, reply_id, sentence):
+        speculation = self.speculation
+        if speculation is not None and speculation.id == reply_id:
+            # Not confirmed yet: hold the sentence back
+            if speculation.first_sentence_at is None:
+                speculation.first_sentence_at = time.perf_counter()
+            speculation.pending.append(sentence)
+            return
+        reply = self.reply
+        if reply is None or reply.id != reply_id:
+            return
+        job = self.bot.tts.say(sentence)
+        reply.jobs.append(job)
+        job.add_done_callback(lambda job: self.post("played", reply_id, job))
+        if self.state != SPEAKING:
+            self.state = SPEAKING
+            self.bot.set_status("Speaking...")
+
+    def _on_generated(self, reply_id, text):
+        speculation = self.speculation
+        if speculation is not None and speculation.id == reply_id:
+            speculation.generated = True
+            speculation.text = text
+            if speculation.first_sentence_at is None:
+                speculation.first_sentence_at = time.perf_counter()
+            return
+        reply = self.reply
+        if reply is None or reply.id != reply_id:
+            return
+        reply.generated = True
+        reply.text = text
+        if text:
+            self.bot.gui.put(f"Bot: {text}")
+        self._maybe_finish()
+
+    def _on_played(self, reply_id, job):
+        reply = self.reply
+        if reply is None or reply.id != reply_id:
+            # Playback of a cancelled reply has stopped: barge-in is complete
+            self._record_barge_in(job)
+            return
+        if job.error:
+            print(f"Error speaking response: {job.error}")
+        self._maybe_finish()
+
+    # Reply lifecycle
+
+    def _start_reply(self, transcript):
+        """Begin generating the reply to a transcript"""
+        self._user_paused = False
+        reply = Reply(next(self._reply_ids), transcript)
+        # The generation is created here, in event order, so a late worker can never cancel a newer reply
+        reply.generation = self.bot.generations.begin()
+        reply.generation.turn_id = transcript.turn_id
+        self.reply = reply
+        self.replies_started += 1
+        self.bot.turn_id = transcript.turn_id
+        self.state = THINKING
+        self._workers.submit(self._generate, reply)
+
+    def _generate(self, reply):
+        """Reply worker: run the LLM and forward sentences as events"""
+        try:
+            if self.bot.stream_responses or reply.speculative:
+                text = self.bot.get_llm_response(reply.transcript.text, generation=reply.generation,
+                                                 on_sentence=lambda s: self.post("sentence", reply.id, s),
+                                                 speculative=reply.speculative)
+            else:
+                text = self.bot.get_llm_response(reply.transcript.text, generation=reply.generation)
+                if text is None:
+                    return
+                if not text:
+                    text = self.fallback_message
+                segmenter = SentenceSegmenter()
+                for sentence in segmenter.feed(text) + segmenter.flush():
+                    self.post("sentence", reply.id, sentence)
+            if text is not None:
+                self.post("generated", reply.id, text)
+        except GenerationCancelled:
+            pass
+        except Exception as e:
+            print(f"Error generating reply: {e}")
+            self.post("generated", reply.id, None)
+
+    def _maybe_finish(self):
+        """Close the reply once it is fully generated and spoken"""
+        reply = self.reply
+        if reply is None or not reply.generated or reply.playing():
+            return
+        self.reply = None
+        if reply.repeated:
+            self.state = LISTENING
+            self.bot.set_status("Listening...")
+            return
+        if reply.jobs:
+            self.bot._record_playback(reply.transcript.turn_id, reply.transcript.speech_ended_at, reply.jobs[0])
+            self._record_chunk_gaps(reply)
+        if reply.text:
+            self._last_reply_text = reply.text
+            self.bot.prompt_builder.add("assistant", reply.text,
+                                        latency=self.bot.tracer.turn_stages(reply.transcript.turn_id))
+        self.state = LISTENING
+        print("Ready for next input...")
+        self.bot.set_status("Listening...")
+
+    def _cancel_reply(self, barge_in_started_at=None):
+        """Cancel generation and playback of the active reply"""
+        reply = self.reply
+        if reply is None:
+            return
+        self.reply = None
+        reply.cancelled = True
+        reply.barge_in_started_at = barge_in_started_at
+        self.replies_cancelled += 1
+
+        # Abandon the LLM request and silence the speaker
+        if reply.generation is not None:
+            reply.generation.cancel()
+            self.bot.generations.cancel_current()
+        self.bot.tts.stop()
+
+        if reply.jobs and not reply.repeated:
+            self.bot._record_playback(reply.transcript.turn_id, reply.transcript.speech_ended_at, reply.jobs[0])
+        if reply.repeated:
+            self._interrupted = reply
+            self.state = LISTENING
+            return
+        # Only the words that reached the speaker belong in the history; the
+        # stopped utterance finishes within one audio block and reports them
+        for job in reply.spoken_jobs():
+            job.wait(0.5)
+        spoken = " ".join(text for text in (job.heard_text() for job in reply.spoken_jobs()) if text)
+        print(f"Reply interrupted after: {spoken}")
+        if reply.text or spoken:
+            # "repeat" says the whole reply if it was fully generated, else what was heard
+            self._last_reply_text = reply.text or spoken
+        if spoken:
+            self.bot.prompt_builder.add("assistant", spoken, interrupted=True,
+                                        latency=self.bot.tracer.turn_stages(reply.transcript.turn_id))
+
+        self._interrupted = reply
+        self.state = LISTENING
+        for job in reply.spoken_jobs():
+            if job.done.is_set():
+                self._record_barge_in(job)
+
+    # Speculative replies
+
+    def _speculate(self, transcript):
+        """Start a speculative reply to an interim transcript"""
+        if not self.speculate or self.reply is not None:
+            # While the bot is talking only the final transcript may barge in
+            return
+        self._drop_speculation()
+        reply = Reply(next(self._reply_ids), transcript)
+        reply.speculative = True
+        reply.generation = self.bot.generations.begin()
+        # The turn id is assigned once the final transcript confirms the speculation
+        reply.generation.turn_id = None
+        self.speculation = reply
+        self.speculation_stats.record_start()
+        self._workers.submit(self._generate, reply)
+
+    def _commit_speculation(self, transcript):
+        """Adopt the speculative reply if the final transcript matches; True when it was used"""
+        reply = self.speculation
+        self.speculation = None
+        similarity = transcript_similarity(reply.transcript.text, transcript.text)
+        failed = reply.generated and not reply.text
+        if self.reply is not None or failed or similarity < self.speculation_threshold:
+            print(f"Speculation discarded (similarity {similarity:.2f}): {reply.transcript.text}")
+            reply.generation.cancel()
+            self.speculation_stats.record_miss()
+            return False
+
+        # The head start: how much of the wait for the first sentence had already passed
+        now = time.perf_counter()
+        saved = min(now, reply.first_sentence_at or now) - reply.started_at
+        self.speculation_stats.record_hit(saved)
+        self.bot.tracer.record(transcript.turn_id, "speculation_saved", saved)
+        print(f"Speculation committed (similarity {similarity:.2f}, {saved * 1000.0:.0f} ms ahead)")
+
+        reply.transcript = transcript
+        reply.generation.turn_id = transcript.turn_id
+        self.bot.prompt_builder.add("user", transcript.text, latency=self.bot.tracer.turn_stages(transcript.turn_id))
+        self.reply = reply
+        self.replies_started += 1
+        self.bot.turn_id = transcript.turn_id
+        self.state = THINKING
+
+        pending, reply.pending = reply.pending, []
+        for sentence in pending:
+            self._on_sentence(reply.id, sentence)
+        if reply.generated:
+            self.bot.gui.put(f"Bot: {reply.text}")
+            self._maybe_finish()
+        return True
+
+    def _drop_speculation(self):
+        """Cancel the speculation in flight, if any"""
+        reply = self.speculation
+        if reply is None:
+            return
+        self.speculation = None
+        reply.generation.cancel()
+        self.speculation_stats.record_miss()
+
+    def _record_chunk_gaps(self, reply):
+        """Trace the silence between sentences that were queued before the previous one ended"""
+        for previous, job in zip(reply.jobs, reply.jobs[1:]):
+            if previous.finished_at is not None and job.queued_at <= previous.finished_at:
+                self.bot.tracer.record_between(reply.transcript.turn_id, "inter_chunk_gap", previous.finished_at,
+                                               job.started_at)
+
+    def _record_barge_in(self, job):
+        """Trace barge-in time to silence once the interrupted sentence has stopped"""
+        reply = self._interrupted
+        if reply is None or job not in reply.jobs or job.started_at is None or not job.cancelled:
+            return
+        self._interrupted = None
+        self.bot.tracer.record_between(reply.transcript.turn_id, "barge_in_to_silence", reply.barge_in_started_at,
+                                       job.silenced_at or job.finished_at)
+
+    def _speak_error(self):
+        """Let the user know something went wrong"""
+        job = self.bot.tts.say(self.error_message)
+        job.add_done_callback(lambda job: job.error and print("Failed to speak error message"))
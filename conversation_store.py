@@ -0,0 +1,201 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Words too common to say anything about what a turn is about
+STOPWORDS = {
+    "the", "and", "for", "are", "but", "not", "you", "your", "yours", "all", "any", "can", "had", "her", "was",
+    "one", "our", "out", "has", "have", "him", "his", "how", "its", "may", "now", "see", "she", "way", "who",
+    "did", "get", "got", "let", "say", "said", "too", "use", "that", "this", "with", "what", "when", "where",
+    "which", "while", "from", "they", "them", "then", "than", "there", "their", "these", "those", "will",
+    "would", "could", "should", "about", "into", "just", "like", "some", "more", "most", "very", "also",
+    "been", "were", "being", "does", "doing", "here", "only", "over", "such", "well", "want", "know",
+    "tell", "please", "okay", "yes", "yeah", "thanks", "thank", "sure", "i'm", "it's", "don't", "that's",
+}
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS turns_by_session ON turns (session_id, id);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT NOT NULL,
+    turn_id INTEGER NOT NULL,
+    PRIMARY KEY (term, turn_id)
+) WITHOUT ROWID;
+"""
+
+
+def keywords(text):
+    """Distinct lower-case words of text worth indexing"""
+    words = []
+    for word in _WORD.findall(text.lower()):
+        word = word.strip("'")
+        if len(word) > 2 and word not in STOPWORDS and word not in words:
+            words.append(word)
+    return words
+
+
+class ConversationStore:
+    """Append-only SQLite log of every turn of every session
+
+    Each turn is stored with its wall-clock time and metadata (latency of
+    its pipeline stages, whether it was interrupted) and indexed by its
+    keywords in an inverted index (term -> turn ids). Nothing is held in
+    memory: resuming a session reads only its last turns through the
+    session index, and search() reads at most per_term_limit of the most
+    recent postings of each query keyword, so memory and lookup time stay
+    flat however long the history grows. Writes use WAL mode, so a turn is
+    recorded without waiting for the disk.
+    """
+
+    def __init__(self, path, per_term_limit=500):
+        self.path = path
+        self.per_term_limit = per_term_limit
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self.session_id = None
+
+        self.appended = 0
+        self.searches = 0
+        self.recalled = 0
+        self.append_seconds = 0.0
+        self.search_seconds = 0.0
+
+    def start_session(self, resume=False):
+        """Open a new session, or with resume continue the most recent one; returns its id"""
+        with self._lock:
+            if resume:
+                row = self._db.execute("SELECT MAX(id) FROM sessions").fetchone()
+                if row[0] is not None:
+                    self.session_id = row[0]
+                    return self.session_id
+            with self._db:
+                cursor = self._db.execute("INSERT INTO sessions (started_at) VALUES (?)", (time.time(),))
+            self.session_id = cursor.lastrowid
+            return self.session_id
+
+    def append(self, role, content, metadata=None):
+        """Record a turn of the current session and return its id"""
+        if self.session_id is None:
+            self.start_session()
+        started = time.perf_counter()
+        with self._lock:
+            with self._db:
+                cursor = self._db.execute(
+                    "INSERT INTO turns (session_id, created_at, role, content, metadata) VALUES (?, ?, ?, ?, ?)",
+                    (self.session_id, time.time(), role, content,
+                     json.dumps(metadata, default=str) if metadata else None))
+                turn_id = cursor.lastrowid
+                self._db.executemany("INSERT OR IGNORE INTO terms (term, turn_id) VALUES (?, ?)",
+                                     [(term, turn_id) for term in keywords(content)])
+            self.appended += 1
+            self.append_seconds += time.perf_counter() - started
+        return turn_id
+
+    def recent(self, limit, session_id=None):
+        """The last limit turns of a session (the current one by default), oldest first"""
+        session_id = session_id if session_id is not None else self.session_id
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, created_at, role, content, metadata FROM turns WHERE session_id = ? "
+                "ORDER BY id DESC LIMIT ?", (session_id, limit)).fetchall()
+        return [self._entry(row) for row in reversed(rows)]
+
+    def search(self, query, limit=2, before=None):
+        """Exchanges from any session most relevant to query, oldest first
+
+        Turns are scored by the keywords they share with the query, rare
+        words weighing more; only turns older than the turn id before are
+        considered. Each hit comes back with the other half of its
+        exchange (the reply to a user turn, the question of a reply).
+        """
+        terms = keywords(query)
+        if not terms:
+            return []
+        started = time.perf_counter()
+        with self._lock:
+            newest = self._db.execute("SELECT MAX(id) FROM turns").fetchone()[0] or 0
+            before = before if before is not None else newest + 1
+            scores = {}
+            for term in terms:
+                ids = [row[0] for row in self._db.execute(
+                    "SELECT turn_id FROM terms WHERE term = ? AND turn_id < ? ORDER BY turn_id DESC LIMIT ?",
+                    (term, before, self.per_term_limit))]
+                weight = math.log(1.0 + newest / float(len(ids))) if ids else 0.0
+                for turn_id in ids:
+                    scores[turn_id] = scores.get(turn_id, 0.0) + weight
+            best = sorted(scores, key=lambda turn_id: (scores[turn_id], turn_id), reverse=True)[:limit]
+
+            wanted = set()
+            for turn_id in best:
+                wanted.add(turn_id)
+                wanted.update((turn_id - 1, turn_id + 1))
+            rows = self._db.execute(
+                f"SELECT id, created_at, role, content, metadata, session_id FROM turns "
+                f"WHERE id IN ({','.join('?' * len(wanted))}) ORDER BY id", sorted(wanted)).fetchall() \
+                if wanted else []
+            self.searches += 1
+            self.search_seconds += time.perf_counter() - started
+
+        # Keep each hit and the neighbour completing its exchange within the same session
+        by_id = {row[0]: row for row in rows}
+        keep = set()
+        for turn_id in best:
+            row = by_id.get(turn_id)
+            if row is None:
+                continue
+            keep.add(turn_id)
+            partner = by_id.get(turn_id + 1 if row[2] == "user" else turn_id - 1)
+            if partner is not None and partner[5] == row[5] and partner[2] != row[2] and partner[0] < before:
+                keep.add(partner[0])
+        self.recalled += len(best)
+        return [self._entry(by_id[turn_id][:5]) for turn_id in sorted(keep)]
+
+    @staticmethod
+    def _entry(row):
+        turn_id, created_at, role, content, metadata = row
+        entry = {"role": role, "content": content, "id": turn_id, "created_at": created_at}
+        if metadata:
+            entry.update(json.loads(metadata))
+        return entry
+
+    def stats(self):
+        """Turns stored and the time spent appending and searching"""
+        with self._lock:
+            turns = self._db.execute("SELECT COUNT(*) FROM turns").fetchone()[0]
+            sessions = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {
+            "session": self.session_id,
+            "sessions": sessions,
+            "turns": turns,
+            "appended": self.appended,
+            "append_ms": self.append_seconds / self.appended * 1000.0 if self.appended else None,
+            "searches": self.searches,
+            "recalled": self.recalled,
+            "search_ms": self.search_seconds / self.searches * 1000.0 if self.searches else None,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,178 @@
+import collections
+import difflib
+import threading
+import time
+
+from response_cache import normalize_utterance
+
+
+class EchoSuppressor:
+    """Keep the bot's own voice, picked up by the microphone, out of recognition
+
+    The TTS service reports what it plays: the text of each utterance and,
+    for rendered audio, the energy of every block written to the speaker.
+    While the bot is audible (and for tail seconds after, to cover the room
+    and driver latency) each microphone frame is compared with the echo
+    expected from that playback, the recent playback energy scaled by a
+    coupling gain learned from frames without double talk (quick to rise,
+    slow to fall, so pauses in the voice do not erase it). A frame counts as
+    speech only if it is margin times louder than the expected echo, so the
+    bot's voice alone never opens an utterance and never costs an STT call.
+    When playback energy is unknown (the engine speaks directly) the
+    expected echo is a slow moving average of the microphone level during
+    playback instead.
+
+    Utterances that still overlap playback are forwarded, and their
+    transcript is rejected when its words are mostly found, in order, in
+    what the bot has just said. Transcripts shorter than min_words are never
+    rejected on text: a short "stop" or "yes" repeats the bot's words too
+    easily to tell it from echo.
+    """
+
+    def __init__(self, margin=2.0, tail=0.3, initial_gain=1.0, rise_rate=0.2, fall_rate=0.01, floor_rate=0.02,
+                 min_frames=3, hangover=0.8, text_threshold=0.7, text_window=10.0, min_words=4):
+        self.margin = margin
+        self.tail = tail
+        self.rise_rate = rise_rate
+        self.fall_rate = fall_rate
+        self.floor_rate = floor_rate
+        # Mirror the capture stream's endpointing when counting suppressed segments
+        self.min_frames = min_frames
+        self.hangover = hangover
+        self.text_threshold = text_threshold
+        self.text_window = text_window
+        self.min_words = min_words
+
+        # Microphone echo energy per unit of playback energy, and the echo
+        # level used when there is no playback energy to scale
+        self.gain = initial_gain
+        self.echo_floor = 0.0
+
+        self._lock = threading.Lock()
+        self._playing = 0
+        self._last_audible = None
+        # (time, playback energy) of recent blocks
+        self._reference = collections.deque(maxlen=256)
+        # (start, end) of recent playback; end is None while it lasts
+        self._intervals = collections.deque(maxlen=16)
+        # (time, words) of recently spoken utterances
+        self._spoken = collections.deque(maxlen=8)
+        self._gated_run = 0
+        self._segment_open_until = None
+
+        self.frames_gated = 0
+        self.segments_suppressed = 0
+        self.segments_forwarded = 0
+        self.transcripts_rejected = 0
+
+    # Playback side, called from the TTS threads
+
+    def playback_started(self, text):
+        now = time.perf_counter()
+        with self._lock:
+            self._playing += 1
+            self._intervals.append([now, None])
+            self._spoken.append((now, normalize_utterance(text).split()))
+
+    def playback_audio(self, energy):
+        with self._lock:
+            self._reference.append((time.perf_counter(), energy))
+
+    def playback_stopped(self):
+        now = time.perf_counter()
+        with self._lock:
+            self._playing = max(0, self._playing - 1)
+            self._last_audible = now
+            if self._intervals and self._intervals[-1][1] is None:
+                self._intervals[-1][1] = now
+
+    def active(self, now=None):
+        """True while the bot's voice may be reaching the microphone"""
+        now = now if now is not None else time.perf_counter()
+        return self._playing > 0 or (self._last_audible is not None and now - self._last_audible <= self.tail)
+
+    # Capture side, called on the reader thread for every frame
+
+    def admit(self, energy, speech):
+        """Frame-level decision: returns False for speech the echo explains"""
+        now = time.perf_counter()
+        if not self.active(now):
+            self._gated_run = 0
+            return speech
+
+        with self._lock:
+            reference = max((e for t, e in self._reference if now - t <= self.tail), default=None)
+            # Learn only while audio is being written, not in pauses or the tail
+            fresh = bool(self._reference) and self._playing > 0 and now - self._reference[-1][0] <= 0.1
+        if not reference and self._playing > 0:
+            # No playback energy to go by: follow the microphone level while the bot talks
+            self.echo_floor += self.floor_rate * (energy - self.echo_floor)
+        expected = self.gain * reference if reference else self.echo_floor
+        if energy > self.margin * expected:
+            # Louder than the echo can be: the user is talking
+            self._gated_run = 0
+            return speech
+
+        # Echo only: learn how loud it is
+        if reference and fresh:
+            self.gain = self._follow(self.gain, energy / float(reference))
+        if not speech:
+            self._gated_run = 0
+            return False
+        self.frames_gated += 1
+        self._gated_run += 1
+        if self._segment_open_until is not None and now <= self._segment_open_until:
+            self._segment_open_until = now + self.hangover
+        elif self._gated_run >= self.min_frames:
+            # Long enough that the VAD would have opened an utterance
+            self.segments_suppressed += 1
+            self._segment_open_until = now + self.hangover
+        return False
+
+    def _follow(self, value, sample):
+        """Asymmetric moving average: quick to rise, slow to fall"""
+        rate = self.rise_rate if sample > value else self.fall_rate
+        return value + rate * (sample - value)
+
+    # Utterance and transcript side, called by the recognizer
+
+    def overlaps(self, start, end):
+        """True when the stretch from start to end was heard while the bot was audible"""
+        if start is None or end is None:
+            return False
+        with self._lock:
+            intervals = list(self._intervals)
+        for playback_start, playback_end in intervals:
+            if playback_start <= end and (playback_end is None or start <= playback_end + self.tail):
+                return True
+        return False
+
+    def record_forwarded(self):
+        self.segments_forwarded += 1
+
+    def is_echo_text(self, text):
+        """True when the transcript is mostly words the bot has just spoken"""
+        words = normalize_utterance(text).split()
+        if len(words) < max(1, self.min_words):
+            return False
+        now = time.perf_counter()
+        with self._lock:
+            spoken = [spoken_words for t, spoken_words in self._spoken if now - t <= self.text_window]
+        for spoken_words in spoken:
+            matcher = difflib.SequenceMatcher(None, words, spoken_words, autojunk=False)
+            matched = sum(block.size for block in matcher.get_matching_blocks())
+            if matched / float(len(words)) >= self.text_threshold:
+                self.transcripts_rejected += 1
+                return True
+        return False
+
+    def stats(self):
+        """Counters of suppressed and forwarded segments and the STT calls saved"""
+        return {
+            "frames_gated": self.frames_gated,
+            "segments_suppressed": self.segments_suppressed,
+            "segments_forwarded": self.segments_forwarded,
+            "transcripts_rejected": self.transcripts_rejected,
+            "stt_calls_saved": self.segments_suppressed,
+            "gain": round(self.gain, 3),
+        }
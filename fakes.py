@@ -0,0 +1,484 @@
+import array
+import audioop
+import collections
+import math
+import random
+import threading
+import time
+import wave
+
+import speech_recognition as sr
+
+
+def fixed_latency(seconds):
+    """Latency distribution that always returns the same delay"""
+    return lambda rng: seconds
+
+
+def lognormal_latency(median, sigma=0.5):
+    """Long-tailed latency distribution, similar to real network calls"""
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+class FakeError(Exception):
+    """Error raised by the fake model; code mimics google.api_core exceptions"""
+
+    def __init__(self, message, code=503):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeChunk:
+    """Response or stream chunk shaped like the Gemini SDK objects"""
+
+    def __init__(self, text):
+        self.text = text
+        self.parts = [self]
+
+
+class FakeModel:
+    """Local stand-in for genai.GenerativeModel with configurable latency and errors
+
+    latency and chunk_latency are distributions: callables taking a
+    random.Random and returning seconds. errors maps an error code to its
+    probability per call, e.g. {503: 0.05, 429: 0.01}. reply is a string or
+    a callable taking the prompt. Runs are reproducible through seed.
+    """
+
+    def __init__(self, reply="This is a reply from the fake model. It has two sentences.",
+                 latency=fixed_latency(0.2), chunk_latency=fixed_latency(0.02), errors=None,
+                 words_per_chunk=4, seed=0):
+        self.reply = reply
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.errors = errors or {}
+        self.words_per_chunk = words_per_chunk
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompts = []
+
+    def _draw(self, distribution):
+        with self._lock:
+            return distribution(self._rng)
+
+    def _maybe_fail(self):
+        with self._lock:
+            roll = self._rng.random()
+        for code, probability in self.errors.items():
+            if roll < probability:
+                raise FakeError(f"fake error {code}", code)
+            roll -= probability
+
+    def _reply_text(self, prompt):
+        return self.reply(prompt) if callable(self.reply) else self.reply
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        """Sleep for the drawn latency, maybe fail, then return the reply"""
+        with self._lock:
+            self.calls += 1
+            self.prompts.append(prompt)
+        time.sleep(self._draw(self.latency))
+        self._maybe_fail()
+        text = self._reply_text(prompt)
+        if not stream:
+            return FakeChunk(text)
+
+        words = text.split(" ")
+        chunks = [" ".join(words[i:i + self.words_per_chunk]) + " "
+                  for i in range(0, len(words), self.words_per_chunk)]
+        return self._stream(chunks)
+
+    def _stream(self, chunks):
+        """Yield chunks with the configured gap between them"""
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(self._draw(self.chunk_latency))
+            yield FakeChunk(chunk)
+
+
+def synthetic_speech(seconds, sample_rate=16000, amplitude=3000, seed=0):
+    """Raw 16-bit mono audio loud and varied enough to pass as speech for the VAD"""
+    rng = random.Random(seed)
+    samples = array.array("h")
+    pitch = rng.uniform(110, 220)
+    for i in range(int(seconds * sample_rate)):
+        t = i / sample_rate
+        # Syllable-rate envelope over a voiced tone with a little noise
+        envelope = 0.6 + 0.4 * math.sin(2 * math.pi * 4 * t)
+        value = envelope * amplitude * math.sin(2 * math.pi * pitch * t) + rng.gauss(0, amplitude * 0.05)
+        samples.append(max(-32768, min(32767, int(value))))
+    return samples.tobytes()
+
+
+# One second of synthetic speech, cycled wherever the fakes need a voice
+_VOICE = None
+
+
+def _voice(size, offset=0, gain=1.0):
+    """size bytes of the cycled synthetic voice starting at offset, scaled by gain"""
+    global _VOICE
+    if _VOICE is None:
+        _VOICE = synthetic_speech(1.0, seed=99)
+    start = offset % len(_VOICE) & ~1
+    data = (_VOICE * (size // len(_VOICE) + 2))[start:start + size]
+    return data if gain == 1.0 else audioop.mul(data, 2, gain)
+
+
+def load_wav(path, sample_rate=16000):
+    """Read a WAV file as raw 16-bit mono audio at sample_rate"""
+    with sr.AudioFile(path) as source:
+        audio = sr.Recognizer().record(source)
+    return audio.get_raw_data(convert_rate=sample_rate, convert_width=2)
+
+
+class InjectedClip:
+    """Audio handed to a ScriptedAudioSource; records when it was actually heard"""
+
+    def __init__(self, data):
+        self.data = data
+        self.started_at = None
+        self.ended_at = None
+        self.played = threading.Event()
+
+
+class ScriptedAudioSource(sr.AudioSource):
+    """Microphone stand-in that plays background noise and injected clips in real time
+
+    Frames are paced at the real sample rate so endpointing, hangover and
+    barge-in timing behave as they would with a live microphone. Audio is
+    16-bit mono; clips are queued with inject() and played back to back.
+    echo(size), if given, returns the bot's voice as it reaches the
+    microphone (or None); it is mixed in while no clip is playing.
+    speed above 1 delivers frames that many times faster than real time.
+    """
+
+    def __init__(self, sample_rate=16000, chunk_size=512, noise_level=30, seed=0, realtime=True, echo=None,
+                 speed=1.0):
+        self.SAMPLE_RATE = sample_rate
+        self.SAMPLE_WIDTH = 2
+        self.CHUNK = chunk_size
+        self.device_index = None
+        self.realtime = realtime
+        self.speed = speed
+        self.stream = None
+
+        # A few pre-generated noise frames, cycled so reading stays cheap
+        rng = random.Random(seed)
+        self._noise = [array.array("h", (int(rng.gauss(0, noise_level)) for _ in range(chunk_size))).tobytes()
+                       for _ in range(8)]
+        self._clips = []
+        self._lock = threading.Lock()
+        self.echo = echo
+        # The start of recently played clips, to tell them apart from echo
+        self._clip_heads = collections.deque(maxlen=16)
+
+    def contains_clip(self, raw_data):
+        """True when raw audio includes the start of an injected clip"""
+        with self._lock:
+            heads = list(self._clip_heads)
+        return any(head in raw_data for head in heads)
+
+    def inject(self, data):
+        """Queue raw audio to be 'spoken' into the microphone and return its InjectedClip"""
+        clip = InjectedClip(data)
+        with self._lock:
+            self._clips.append(clip)
+        return clip
+
+    def idle(self):
+        """True when every injected clip has been played"""
+        with self._lock:
+            return not self._clips
+
+    def __enter__(self):
+        self.stream = _ScriptedStream(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stream = None
+
+
+class _ScriptedStream:
+    """The read() side of a ScriptedAudioSource"""
+
+    def __init__(self, source):
+        self.source = source
+        self.frames = 0
+        self.offset = 0
+        self.started_at = time.perf_counter()
+
+    def read(self, size):
+        source = self.source
+        frame_bytes = size * source.SAMPLE_WIDTH
+        if source.realtime:
+            due = self.started_at + self.frames * size / source.SAMPLE_RATE / source.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        noise = source._noise[self.frames % len(source._noise)]
+        self.frames += 1
+
+        with source._lock:
+            clip = source._clips[0] if source._clips else None
+        if clip is None:
+            echo = source.echo(frame_bytes) if source.echo is not None else None
+            if echo:
+                return audioop.add(noise[:frame_bytes], echo, source.SAMPLE_WIDTH)
+            return noise[:frame_bytes]
+
+        if clip.started_at is None:
+            clip.started_at = time.perf_counter()
+            with source._lock:
+                source._clip_heads.append(clip.data[:frame_bytes])
+        data = clip.data[self.offset:self.offset + frame_bytes]
+        self.offset += frame_bytes
+        if self.offset >= len(clip.data):
+            # The last frame is heard once it has been read
+            clip.ended_at = time.perf_counter()
+            self.offset = 0
+            with source._lock:
+                source._clips.pop(0)
+            clip.played.set()
+        return data + noise[len(data):frame_bytes]
+
+    def close(self):
+        pass
+
+
+class ScriptedRecognizer:
+    """Stand-in for sr.Recognizer that returns scripted transcripts after a delay
+
+    Transcripts queued with expect() are returned in order, one per
+    recognize_google() call; without one the default transcript is returned,
+    or the audio counts as unintelligible when there is no default.
+    hears_echo(audio_data), if given, returns the transcript of audio that
+    holds only the bot's own voice, which does not use up a scripted one.
+    """
+
+    def __init__(self, latency=fixed_latency(0.3), default=None, seed=0, hears_echo=None):
+        self.latency = latency
+        self.default = default
+        self.hears_echo = hears_echo
+        self.energy_threshold = 300
+        self.dynamic_energy_threshold = False
+        self._rng = random.Random(seed)
+        self._transcripts = []
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def expect(self, text):
+        """Queue the transcript of the next utterance"""
+        with self._lock:
+            self._transcripts.append(text)
+
+    def recognize_google(self, audio_data, **kwargs):
+        echo = self.hears_echo(audio_data) if self.hears_echo is not None else None
+        with self._lock:
+            self.calls += 1
+            delay = self.latency(self._rng)
+            if echo is not None:
+                text = echo
+            else:
+                text = self._transcripts.pop(0) if self._transcripts else self.default
+        time.sleep(delay)
+        if text is None:
+            raise sr.UnknownValueError()
+        return text
+
+
+class FakeVoice:
+    """Voice entry shaped like pyttsx3.voice.Voice"""
+
+    def __init__(self, voice_id, name):
+        self.id = voice_id
+        self.name = name
+        self.languages = []
+
+
+class FakeUtterance:
+    """One utterance 'played' by FakeTTSEngine"""
+
+    def __init__(self, text):
+        self.text = text
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.interrupted = False
+        # When the audio first stopped before its end (paused or interrupted)
+        self.silenced_at = None
+
+
+class FakeTTSEngine:
+    """Stand-in for a pyttsx3 engine that 'plays' speech by sleeping
+
+    Each utterance lasts as long as its words take at words_per_second and
+    can be cut short by stop(), like a real driver; 'started-word' callbacks
+    fire as each word begins. Audible utterances are recorded in utterances; wait_for() lets a driver block on playback events.
+    play_wav() stands in for the audio player of buffered playback: files
+    saved by save_to_file() carry their text, so it is recorded the same way.
+    echo() is the voice the microphone picks up while something is audible.
+    """
+
+    def __init__(self, words_per_second=3.0, start_latency=0.02):
+        self.words_per_second = words_per_second
+        self.start_latency = start_latency
+        self.properties = {
+            "voices": [FakeVoice("fake-male", "Fake Male"), FakeVoice("fake-female", "Fake Female")],
+            "voice": "fake-male",
+            "rate": 150,
+            "volume": 1.0,
+        }
+        self.utterances = []
+        self.current = None
+        self._pending = []
+        self._stop = threading.Event()
+        self._changed = threading.Condition()
+        self._word_callbacks = []
+
+    def getProperty(self, name):
+        return self.properties.get(name)
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+    def connect(self, topic, callback):
+        if topic == 'started-word':
+            self._word_callbacks.append(callback)
+
+    def say(self, text, name=None):
+        self._pending.append(text)
+
+    def save_to_file(self, text, path, name=None):
+        self._pending.append(None)
+        # The text goes at the start of the otherwise silent audio for play_wav()
+        label = text.encode("utf-8") + b"\0"
+        label += b"\0" * (len(label) % 2)
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(label + _voice(max(0, int(16000 * self._duration(text)) * 2 - len(label))))
+
+    def _duration(self, text):
+        return max(0.2, len(text.split()) / self.words_per_second)
+
+    def runAndWait(self):
+        pending, self._pending = self._pending, []
+        self._stop.clear()
+        for text in pending:
+            if text is None:
+                # Rendering to a file takes about as long to start as speaking
+                time.sleep(self.start_latency)
+                continue
+            if self._stop.is_set():
+                continue
+            time.sleep(self.start_latency)
+            audible = self.properties["volume"] > 0
+            utterance = FakeUtterance(text)
+            with self._changed:
+                self.current = utterance
+                if audible:
+                    self.utterances.append(utterance)
+                self._changed.notify_all()
+            utterance.interrupted = self._speak_words(text)
+            with self._changed:
+                if utterance.interrupted:
+                    utterance.silenced_at = time.perf_counter()
+                utterance.finished_at = time.perf_counter()
+                self.current = None
+                self._changed.notify_all()
+
+    def _speak_words(self, text):
+        """Wait out the utterance word by word; True when stop() cut it short"""
+        words = text.split(" ")
+        seconds_per_word = self._duration(text) / len(words)
+        location = 0
+        for word in words:
+            for callback in self._word_callbacks:
+                callback(None, location, len(word))
+            if self._stop.wait(seconds_per_word):
+                return True
+            location += len(word) + 1
+        return False
+
+    def stop(self):
+        self._stop.set()
+
+    def play_wav(self, path, should_stop=None, block_seconds=0.05, output_device_index=None, is_paused=None,
+                 on_block=None):
+        """Play audio saved by save_to_file() in real time; same interface as play_wav_file"""
+        with wave.open(path, "rb") as f:
+            rate = f.getframerate()
+            frames = f.readframes(f.getnframes())
+        text = frames.split(b"\0", 1)[0].decode("utf-8", "replace")
+        duration = len(frames) / 2.0 / rate
+
+        utterance = FakeUtterance(text)
+        with self._changed:
+            self.current = utterance
+            self.utterances.append(utterance)
+            self._changed.notify_all()
+        played = 0.0
+        while played < duration:
+            if should_stop is not None and should_stop():
+                utterance.interrupted = True
+                break
+            if is_paused is not None and is_paused():
+                if utterance.silenced_at is None:
+                    utterance.silenced_at = time.perf_counter()
+                time.sleep(block_seconds)
+                continue
+            # Audible again after a pause
+            utterance.silenced_at = None
+            block = min(block_seconds, duration - played)
+            if on_block is not None:
+                offset = int(played * rate) * 2
+                on_block(frames[offset:offset + int(block * rate) * 2], 2)
+            time.sleep(block)
+            played += block
+        with self._changed:
+            utterance.finished_at = time.perf_counter()
+            if utterance.interrupted and utterance.silenced_at is None:
+                utterance.silenced_at = utterance.finished_at
+            self.current = None
+            self._changed.notify_all()
+        return played
+
+    def echo(self, size, gain=0.3):
+        """size bytes of the voice reaching the microphone, or None while nothing is audible"""
+        utterance = self.current
+        if utterance is None or utterance.silenced_at is not None:
+            return None
+        return _voice(size, int((time.perf_counter() - utterance.started_at) * 32000), gain)
+
+    def wait_for(self, predicate, timeout=None):
+        """Block until predicate(engine) is true; returns its final value"""
+        with self._changed:
+            return self._changed.wait_for(lambda: predicate(self), timeout)
+
+
+class LookupRecognizer:
+    """Stand-in for sr.Recognizer that returns the transcript registered for identical audio"""
+
+    def __init__(self, latency=fixed_latency(0.3), seed=0):
+        self.latency = latency
+        self.energy_threshold = 300
+        self.dynamic_energy_threshold = False
+        self._rng = random.Random(seed)
+        self._transcripts = {}
+        self._lock = threading.Lock()
+
+    def add(self, audio_data, text):
+        """Register the transcript of a clip"""
+        with self._lock:
+            self._transcripts[audio_data.get_raw_data()] = text
+
+    def recognize_google(self, audio_data, **kwargs):
+        with self._lock:
+            delay = self.latency(self._rng)
+            text = self._transcripts.get(audio_data.get_raw_data())
+        time.sleep(delay)
+        if not text:
+            raise sr.UnknownValueError()
+        return text
@@ -0,0 +1,157 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class GenerationCancelled(Exception):
+    """Raised in the waiting thread when its generation was cancelled or superseded"""
+
+
+# Markers passed through a generation's result queue
+_DONE = object()
+_CANCELLED = object()
+
+
+class Generation:
+    """One LLM request, identified by a monotonically increasing generation id"""
+
+    def __init__(self, generation_id):
+        self.id = generation_id
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self._cancelled = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Cancel the request and wake anyone waiting on it"""
+        with self._lock:
+            if self._cancelled.is_set():
+                return False
+            self._cancelled.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+        return True
+
+    def on_cancel(self, callback):
+        """Run callback when the generation is cancelled (immediately if it already was)"""
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
+class GenerationManager:
+    """Hand out generation ids and make sure only the newest request counts
+
+    begin() cancels whatever request is still in flight, so a new user
+    utterance immediately discards stale work. Blocking model calls and
+    streams run on a small worker pool; the waiting thread wakes up as soon
+    as its generation is cancelled, and whatever the abandoned call returns
+    later is thrown away.
+    """
+
+    def __init__(self, max_workers=4):
+        self._ids = itertools.count(1)
+        self._current = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+
+        self.started = 0
+        self.cancelled = 0
+        self.discarded = 0
+
+    @property
+    def current(self):
+        return self._current
+
+    def begin(self):
+        """Start a new generation, cancelling the one in flight"""
+        with self._lock:
+            previous = self._current
+            generation = Generation(next(self._ids))
+            self._current = generation
+            self.started += 1
+        if previous is not None and previous.finished_at is None and previous.cancel():
+            self.cancelled += 1
+            print(f"Cancelled stale generation {previous.id}")
+        return generation
+
+    def cancel_current(self):
+        """Cancel the generation in flight, if any"""
+        generation = self._current
+        if generation is not None and generation.finished_at is None and generation.cancel():
+            self.cancelled += 1
+            print(f"Cancelled generation {generation.id}")
+
+    def is_current(self, generation):
+        """True while the generation is the newest one and has not been cancelled"""
+        return generation is self._current and not generation.cancelled
+
+    def discard(self, generation):
+        """Count a result that arrived too late to be used"""
+        self.discarded += 1
+        print(f"Discarding late result of generation {generation.id}")
+
+    def finish(self, generation):
+        """Mark the generation as finished"""
+        generation.finished_at = time.perf_counter()
+
+    def run(self, generation, fn, *args, **kwargs):
+        """Call fn on the worker pool and return its result unless the generation is cancelled"""
+        results = queue.Queue()
+        generation.on_cancel(lambda: results.put((_CANCELLED, None)))
+
+        def call():
+            try:
+                results.put((_DONE, fn(*args, **kwargs)))
+            except Exception as e:
+                results.put((e, None))
+
+        self._executor.submit(call)
+        marker, value = results.get()
+        if marker is _CANCELLED:
+            raise GenerationCancelled(generation.id)
+        if marker is not _DONE:
+            raise marker
+        return value
+
+    def stream(self, generation, fn, *args, **kwargs):
+        """Iterate fn(*args) on the worker pool, yielding items until done or cancelled"""
+        items = queue.Queue()
+        generation.on_cancel(lambda: items.put((_CANCELLED, None)))
+
+        def produce():
+            try:
+                for item in fn(*args, **kwargs):
+                    if generation.cancelled:
+                        # Stop pulling from the stream so no more tokens are spent
+                        return
+                    items.put((None, item))
+                items.put((_DONE, None))
+            except Exception as e:
+                items.put((e, None))
+
+        self._executor.submit(produce)
+        while True:
+            marker, item = items.get()
+            if marker is None:
+                yield item
+            elif marker is _DONE:
+                return
+            elif marker is _CANCELLED:
+                raise GenerationCancelled(generation.id)
+            else:
+                raise marker
+
+    def stats(self):
+        """Return counters of started, cancelled and discarded generations"""
+        return {"started": self.started, "cancelled": self.cancelled, "discarded": self.discarded}
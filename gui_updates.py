@@ -0,0 +1,136 @@
+import collections
+import itertools
+import threading
+import time
+import tkinter as tk
+
+
+class GuiUpdater:
+    """Thread-safe channel for every change made to the Tk window
+
+    Tk widgets may only be touched on the thread running the main loop.
+    Worker threads hand transcript lines to put() and other widget changes
+    to call(); nothing is applied until the Tk thread flushes the channel.
+    The first update after a flush wakes the Tk thread with a virtual
+    event, and flushes are at most one per frame_seconds, so a burst of
+    messages costs one insert, one scroll and one state toggle of the
+    transcript widget. Calls with the same key (e.g. "status") replace each
+    other, so only the latest status is drawn.
+
+    The transcript keeps the last max_lines lines; older lines are trimmed
+    from the widget, and lines that pile up while the window is not
+    flushing are bounded the same way, so memory and redraw cost stay flat
+    however long the session runs.
+    """
+
+    WAKE_EVENT = "<<GuiUpdate>>"
+
+    def __init__(self, max_lines=1000, frame_seconds=1 / 60.0):
+        self.max_lines = max_lines
+        self.frame_seconds = frame_seconds
+        self._lock = threading.Lock()
+        self._lines = collections.deque(maxlen=max_lines)
+        self._calls = collections.OrderedDict()
+        self._call_ids = itertools.count()
+        self._root = None
+        self._display = None
+        self._tk_thread = None
+        self._wake_pending = False
+        self._flush_scheduled = False
+        self._last_flush = 0.0
+
+        self.lines_posted = 0
+        self.lines_dropped = 0
+        self.lines_trimmed = 0
+        self.flushes = 0
+
+    def attach(self, root, display):
+        """Start applying updates to root and its transcript widget; call on the Tk thread"""
+        self._root = root
+        self._display = display
+        self._tk_thread = threading.current_thread()
+        root.bind(self.WAKE_EVENT, self._schedule)
+        self._wake()
+
+    def put(self, message):
+        """Append a line to the transcript"""
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self.lines_dropped += 1
+            self._lines.append(message)
+            self.lines_posted += 1
+        self._wake()
+
+    def call(self, function, *args, key=None, **kwargs):
+        """Run function(*args, **kwargs) on the Tk thread; a later call with the same key replaces it"""
+        with self._lock:
+            if key is None:
+                key = next(self._call_ids)
+            self._calls.pop(key, None)
+            self._calls[key] = (function, args, kwargs)
+        self._wake()
+
+    def _wake(self):
+        """Make sure the Tk thread flushes soon; only the first update after a flush signals it"""
+        with self._lock:
+            if self._wake_pending or self._root is None:
+                return
+            self._wake_pending = True
+        if threading.current_thread() is self._tk_thread:
+            self._schedule()
+            return
+        try:
+            self._root.event_generate(self.WAKE_EVENT, when="tail")
+        except (RuntimeError, tk.TclError):
+            # The main loop is not running (yet); the next flush picks the update up
+            with self._lock:
+                self._wake_pending = False
+
+    def _schedule(self, event=None):
+        """Tk thread: flush at the start of the next frame"""
+        if self._flush_scheduled:
+            return
+        self._flush_scheduled = True
+        delay = max(0.0, self._last_flush + self.frame_seconds - time.perf_counter())
+        self._root.after(int(delay * 1000), self.flush)
+
+    def flush(self):
+        """Tk thread: apply every pending call and append the pending lines in one insert"""
+        with self._lock:
+            lines = list(self._lines)
+            self._lines.clear()
+            calls = list(self._calls.values())
+            self._calls.clear()
+            self._wake_pending = False
+        self._flush_scheduled = False
+        self._last_flush = time.perf_counter()
+        self.flushes += 1
+
+        for function, args, kwargs in calls:
+            try:
+                function(*args, **kwargs)
+            except Exception as e:
+                print(f"Error updating the GUI: {e}")
+        if lines and self._display is not None:
+            self._append(lines)
+
+    def _append(self, lines):
+        display = self._display
+        display.config(state=tk.NORMAL)
+        display.insert(tk.END, "\n".join(lines) + "\n")
+        # The text always ends in an empty line after the last newline
+        excess = int(display.index("end-1c").split(".")[0]) - 1 - self.max_lines
+        if excess > 0:
+            display.delete("1.0", f"{excess + 1}.0")
+            self.lines_trimmed += excess
+        display.see(tk.END)
+        display.config(state=tk.DISABLED)
+
+    def stats(self):
+        """Lines posted, dropped before display and trimmed from the widget, and flushes"""
+        return {
+            "lines_posted": self.lines_posted,
+            "lines_dropped": self.lines_dropped,
+            "lines_trimmed": self.lines_trimmed,
+            "flushes": self.flushes,
+        }
@@ -0,0 +1,186 @@
+import collections
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+# Stages recorded for each turn, in pipeline order
+STAGES = [
+    "end_of_speech",       # last speech frame -> utterance endpointed
+    "stt",                 # recognize_google round trip
+    "command_spotting",    # utterance compared with the local command templates
+    "command_to_action",   # user stopped saying a command -> command carried out
+    "llm_first_token",     # request sent -> first chunk (whole reply when not streaming)
+    "llm_total",           # request sent -> reply complete
+    "tts_first_audio",     # first sentence queued -> playback started
+    "inter_chunk_gap",     # one sentence's audio ended -> the next one's started
+    "response_latency",    # user stopped speaking -> bot audio started
+    "barge_in_to_silence", # user started interrupting -> bot audio stopped
+]
+
+
+def percentile(sorted_samples, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, max(0, int(round(p / 100.0 * (len(sorted_samples) - 1)))))
+    return sorted_samples[index]
+
+
+class TurnTracer:
+    """Per-turn timing spans written to a JSONL log and kept as in-process histograms
+
+    Every span carries the turn id it belongs to. Histograms keep the most
+    recent samples per stage, so percentiles reflect current behaviour and
+    memory stays bounded; so are the per-turn stage times kept for the
+    last recent_turns turns.
+    """
+
+    def __init__(self, log_path=None, histogram_size=1000, recent_turns=32):
+        self.log_path = log_path
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=histogram_size))
+        self._turns = collections.OrderedDict()
+        self._recent_turns = recent_turns
+        self._log = None
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            self._log = open(log_path, "a", encoding="utf-8")
+
+    def new_turn(self):
+        """Allocate the id of a new turn"""
+        return next(self._ids)
+
+    def record(self, turn_id, stage, seconds, **fields):
+        """Record one span of the given turn"""
+        if seconds is None:
+            return
+        with self._lock:
+            self._samples[stage].append(seconds)
+            if turn_id is not None:
+                stages = self._turns.get(turn_id)
+                if stages is None:
+                    stages = self._turns[turn_id] = {}
+                    while len(self._turns) > self._recent_turns:
+                        self._turns.popitem(last=False)
+                stages[stage] = round(seconds * 1000.0, 1)
+            if self._log:
+                entry = {"ts": round(time.time(), 3), "turn": turn_id, "stage": stage, "ms": round(seconds * 1000.0, 1)}
+                entry.update(fields)
+                self._log.write(json.dumps(entry) + "\n")
+                self._log.flush()
+
+    def record_between(self, turn_id, stage, start, end, **fields):
+        """Record a span from two perf_counter() timestamps, skipping incomplete ones"""
+        if start is None or end is None:
+            return
+        self.record(turn_id, stage, max(0.0, end - start), **fields)
+
+    def turn_stages(self, turn_id):
+        """Milliseconds per stage recorded so far for a recent turn"""
+        with self._lock:
+            return dict(self._turns.get(turn_id, {}))
+
+    def span(self, turn_id, stage, **fields):
+        """Context manager timing the enclosed block as a span"""
+        return _Span(self, turn_id, stage, fields)
+
+    def percentiles(self, stage):
+        """Return count, p50, p95 and p99 (in seconds) for a stage"""
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        return {
+            "count": len(samples),
+            "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95),
+            "p99": percentile(samples, 99),
+        }
+
+    def summary(self):
+        """Percentiles of every stage that has samples"""
+        with self._lock:
+            stages = [stage for stage in STAGES if stage in self._samples]
+            stages += [stage for stage in self._samples if stage not in STAGES]
+        return {stage: self.percentiles(stage) for stage in stages}
+
+    def format_summary(self, stages=("stt", "llm_first_token", "tts_first_audio", "response_latency")):
+        """One-line p50/p95 summary for the GUI status area"""
+        parts = []
+        for stage in stages:
+            stats = self.percentiles(stage)
+            if stats["count"]:
+                parts.append(f"{stage} {stats['p50']:.2f}/{stats['p95']:.2f}s")
+        return " | ".join(parts) if parts else "No latency data yet"
+
+    def dump(self, file=None):
+        """Print the percentile table, e.g. at the end of a headless run"""
+        print_summary(self.summary(), file=file or sys.stdout)
+
+    def close(self):
+        with self._lock:
+            if self._log:
+                self._log.close()
+                self._log = None
+
+
+class _Span:
+    """Context manager returned by TurnTracer.span()"""
+
+    def __init__(self, tracer, turn_id, stage, fields):
+        self.tracer = tracer
+        self.turn_id = turn_id
+        self.stage = stage
+        self.fields = fields
+        self.started_at = None
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fields = dict(self.fields)
+        if exc_type is not None:
+            fields["error"] = exc_type.__name__
+        self.tracer.record(self.turn_id, self.stage, time.perf_counter() - self.started_at, **fields)
+        return False
+
+
+def print_summary(summary, file=None):
+    """Print a stage -> percentiles table in milliseconds"""
+    file = file or sys.stdout
+    print(f"{'stage':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}", file=file)
+    for stage, stats in summary.items():
+        values = [f"{stats[key] * 1000.0:>10.1f}" if stats[key] is not None else f"{'-':>10}"
+                  for key in ("p50", "p95", "p99")]
+        print(f"{stage:<22}{stats['count']:>7}{''.join(values)}", file=file)
+
+
+def summarize_log(path):
+    """Build percentile summaries from a JSONL latency log"""
+    samples = collections.defaultdict(list)
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            samples[entry["stage"]].append(entry["ms"] / 1000.0)
+
+    summary = {}
+    for stage in STAGES + sorted(set(samples) - set(STAGES)):
+        if stage in samples:
+            values = sorted(samples[stage])
+            summary[stage] = {"count": len(values), "p50": percentile(values, 50),
+                              "p95": percentile(values, 95), "p99": percentile(values, 99)}
+    return summary
+
+
+if __name__ == "__main__":
+    # Dump percentiles from a latency log written by a previous (headless) run
+    if len(sys.argv) != 2:
+        print("Usage: python latency_tracing.py LATENCY_LOG.jsonl")
+        sys.exit(1)
+    print_summary(summarize_log(sys.argv[1]))
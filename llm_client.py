@@ -0,0 +1,270 @@
+import collections
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# HTTP-style status codes of errors worth retrying (google.api_core exceptions carry .code)
+TRANSIENT_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+DEFAULT_FALLBACK_REPLY = "I'm having trouble reaching my language service right now. Please try again in a moment."
+
+
+class LLMTimeoutError(Exception):
+    """The model did not answer before the call's deadline"""
+
+
+def is_transient(error):
+    """True for errors that a retry has a fair chance of fixing"""
+    if isinstance(error, (LLMTimeoutError, TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    # grpc status codes are enums; api_core exceptions expose the HTTP status as an int
+    return isinstance(code, int) and code in TRANSIENT_STATUS_CODES
+
+
+class LocalResponse:
+    """Stand-in response produced locally, shaped like a Gemini response"""
+
+    local = True
+
+    def __init__(self, text):
+        self.text = text
+        self.parts = [self]
+
+    def __iter__(self):
+        # Streamed consumers see the reply as a single chunk
+        yield self
+
+
+class LatencyTracker:
+    """Recent successful call latencies, used to pick the hedging delay"""
+
+    def __init__(self, size=200):
+        self._samples = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def count(self):
+        return len(self._samples)
+
+    def percentile(self, p):
+        """Return the p-th percentile of recent latencies, or None without samples"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(p / 100.0 * (len(samples) - 1)))))
+        return samples[index]
+
+
+class CircuitBreaker:
+    """Stop calling a failing backend for a while after repeated failures
+
+    closed: calls go through. open: calls are refused until reset_timeout has
+    passed. half-open: one trial call decides whether to close again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may be made now"""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                # Let a single trial call through
+                self.state = "half-open"
+                return True
+            if self.state == "half-open":
+                return False
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def abandon(self):
+        """The call allowed through was given up by the caller before it succeeded or failed"""
+        with self._lock:
+            if self.state == "half-open":
+                # Nothing was learned; the next call becomes the trial
+                self.state = "open"
+                self.opened_at = time.monotonic() - self.reset_timeout
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                    print(f"Circuit breaker open after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class ResilientModel:
+    """Wrap a Gemini GenerativeModel with deadlines, retries, hedging and a circuit breaker
+
+    generate_content keeps the model's interface, so callers do not change.
+    Each call gets a deadline; transient errors are retried with jittered
+    exponential backoff while time remains. With hedging enabled a duplicate
+    request is sent once the first one is slower than the recent p95 latency
+    and the first reply wins. While the circuit breaker is open a local
+    fallback reply is returned immediately instead of calling the model.
+    """
+
+    def __init__(self, model, timeout=15.0, max_retries=2, backoff_base=0.5, backoff_max=4.0,
+                 hedge=False, hedge_percentile=95, hedge_min_delay=0.3, hedge_min_samples=20,
+                 breaker=None, fallback_reply=DEFAULT_FALLBACK_REPLY, max_workers=8, rng=None):
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.fallback_reply = fallback_reply
+        self.latencies = LatencyTracker()
+        self._rng = rng or random.Random()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-call")
+
+        # Counters exposed through stats()
+        self._counter_lock = threading.Lock()
+        self.counters = collections.Counter()
+
+    def _count(self, name, amount=1):
+        with self._counter_lock:
+            self.counters[name] += amount
+
+    def stats(self):
+        """Return call, retry, hedge and breaker counters"""
+        with self._counter_lock:
+            stats = dict(self.counters)
+        stats["breaker_state"] = self.breaker.state
+        stats["p95_latency"] = self.latencies.percentile(95)
+        return stats
+
+    def generate_content(self, prompt, stream=False, timeout=None, **kwargs):
+        """Call the model with a deadline, retries and optional hedging
+
+        With stream=True the deadline covers the first chunk, which is
+        fetched under the retry policy; after that each chunk must follow the
+        previous one within the same timeout or the stream counts as stalled.
+        """
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("fallbacks")
+            print("Circuit breaker open, using local fallback reply")
+            return LocalResponse(self.fallback_reply)
+
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            try:
+                response = self._call(prompt, stream, deadline, timeout, kwargs)
+                if stream:
+                    # The call has only succeeded once the whole stream has been read
+                    return self._read_stream(response, timeout)
+                self.breaker.record_success()
+                return response
+            except Exception as e:
+                self._count("errors")
+                remaining = deadline - time.monotonic()
+                delay = self._rng.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                if not is_transient(e) or attempt >= self.max_retries or delay >= remaining:
+                    self.breaker.record_failure()
+                    if isinstance(e, LLMTimeoutError):
+                        self._count("timeouts")
+                    raise
+                attempt += 1
+                self._count("retries")
+                print(f"Transient LLM error ({e}); retry {attempt} in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _call(self, prompt, stream, deadline, timeout, kwargs):
+        """One attempt, possibly hedged, bounded by the deadline"""
+        started = time.monotonic()
+        primary = self._executor.submit(self.model.generate_content, prompt, stream=stream, **kwargs)
+        pending = {primary}
+
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None:
+            done, _ = wait(pending, timeout=max(0.0, min(hedge_delay, deadline - time.monotonic())))
+            if not done and time.monotonic() < deadline:
+                self._count("hedges")
+                pending.add(self._executor.submit(self.model.generate_content, prompt, stream=stream, **kwargs))
+
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("hedge_wins")
+                    self.latencies.add(time.monotonic() - started)
+                    return future.result()
+                error = future.exception()
+
+        if error is not None and not pending:
+            raise error
+        raise LLMTimeoutError(f"no reply within {timeout:.1f}s")
+
+    def _hedge_delay(self):
+        """Delay before sending a duplicate request, or None when not hedging"""
+        if not self.hedge or self.latencies.count() < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latencies.percentile(self.hedge_percentile))
+
+    def _read_stream(self, response, stall_timeout):
+        """Yield the stream's chunks, recording the outcome with the breaker when it ends"""
+        chunks = 0
+        try:
+            for chunk in self._iterate_with_stall_timeout(response, stall_timeout):
+                chunks += 1
+                yield chunk
+        except GeneratorExit:
+            # The caller stopped reading (e.g. the user interrupted); chunks arriving is what counts
+            if chunks:
+                self.breaker.record_success()
+            else:
+                self.breaker.abandon()
+            raise
+        except Exception:
+            self._count("errors")
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+    def _iterate_with_stall_timeout(self, response, stall_timeout):
+        """Yield stream chunks, failing if the next chunk takes longer than stall_timeout"""
+        iterator = iter(response)
+        finished = object()
+        while True:
+            future = self._executor.submit(next, iterator, finished)
+            done, _ = wait([future], timeout=stall_timeout)
+            if not done:
+                self._count("timeouts")
+                raise LLMTimeoutError(f"stream stalled for {stall_timeout:.1f}s")
+            chunk = future.result()
+            if chunk is finished:
+                return
+            yield chunk
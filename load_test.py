@@ -0,0 +1,206 @@
+"""Load generator for the multi-session server
+
+Opens increasing numbers of concurrent sessions, each speaking a few turns
+of synthetic audio, and reports reply latency, errors and throughput per
+level. The sessions-per-host limit is the largest level whose p95 reply
+latency stays within the SLO with an acceptable error rate.
+
+    python load_test.py                                  # starts a fake server in-process
+    python load_test.py --url http://127.0.0.1:8765 --levels 1,8,32,64
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from fakes import synthetic_speech
+from latency_tracing import percentile
+
+
+class Client:
+    """Minimal HTTP client of one server session"""
+
+    def __init__(self, url, timeout=30.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session_id = None
+
+    def _request(self, method, path, body=None, content_type="application/json"):
+        data = body
+        if body is not None and content_type == "application/json":
+            data = json.dumps(body).encode("utf-8")
+        request = urllib.request.Request(self.url + path, data=data, method=method)
+        if data is not None:
+            request.add_header("Content-Type", content_type)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            payload = response.read()
+        return json.loads(payload) if payload else {}
+
+    def open(self, settings=None):
+        self.session_id = self._request("POST", "/sessions", settings or {})["session_id"]
+
+    def send_audio(self, data):
+        self._request("POST", f"/sessions/{self.session_id}/audio", data, "application/octet-stream")
+
+    def events(self, timeout=10.0):
+        return self._request("GET", f"/sessions/{self.session_id}/events?timeout={timeout}")["events"]
+
+    def close(self):
+        if self.session_id:
+            try:
+                self._request("DELETE", f"/sessions/{self.session_id}")
+            except (urllib.error.URLError, OSError):
+                pass
+
+    def stats(self):
+        return self._request("GET", "/stats")
+
+
+class LevelResult:
+    """Measurements of one concurrency level"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.admitted = 0
+        self.rejected = 0
+        self.turns = 0
+        self.errors = 0
+        self.reply_latencies = []
+        self.audio_latencies = []
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                if isinstance(value, list):
+                    getattr(self, name).extend(value)
+                else:
+                    setattr(self, name, getattr(self, name) + value)
+
+
+def run_session(url, turns, audio, settings, result, turn_timeout):
+    """One simulated user: open a session, speak the turns, wait for every reply"""
+    client = Client(url, timeout=turn_timeout)
+    tts = settings["tts"]
+    try:
+        client.open(settings)
+    except urllib.error.HTTPError as e:
+        result.add(rejected=1 if e.code == 503 else 0, errors=0 if e.code == 503 else 1)
+        return
+    except (urllib.error.URLError, OSError):
+        result.add(errors=1)
+        return
+    result.add(admitted=1)
+
+    try:
+        for _ in range(turns):
+            sent_at = time.perf_counter()
+            client.send_audio(audio)
+            reply_at = audio_at = None
+            deadline = sent_at + turn_timeout
+            while time.perf_counter() < deadline:
+                events = client.events(timeout=max(0.1, deadline - time.perf_counter()))
+                for event in events:
+                    if event["type"] == "reply" and reply_at is None:
+                        reply_at = time.perf_counter()
+                    elif event["type"] == "audio" and audio_at is None:
+                        audio_at = time.perf_counter()
+                    elif event["type"] in ("error", "unrecognized"):
+                        deadline = 0
+                if reply_at is not None and (audio_at is not None or not tts):
+                    break
+            if reply_at is None:
+                result.add(errors=1)
+                continue
+            result.add(turns=1, reply_latencies=[reply_at - sent_at],
+                       audio_latencies=[audio_at - sent_at] if audio_at is not None else [])
+    except (urllib.error.URLError, OSError):
+        result.add(errors=1)
+    finally:
+        client.close()
+
+
+def run_level(url, sessions, turns, audio, settings, turn_timeout):
+    """Run a number of concurrent sessions and return their LevelResult"""
+    result = LevelResult(sessions)
+    threads = [threading.Thread(target=run_session, args=(url, turns, audio, settings, result, turn_timeout))
+               for _ in range(sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def start_fake_server(**options):
+    """Start a fake-backed server on a free port in this process; returns its URL"""
+    from server import create_server
+    httpd = create_server(port=0, fake=True, **options)
+    thread = threading.Thread(target=httpd.serve_forever, name="load-test-server")
+    thread.daemon = True
+    thread.start()
+    host, port = httpd.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load generator for the speech bot server")
+    parser.add_argument("--url", help="server to test; without it a fake server is started in-process")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="comma-separated concurrent session counts")
+    parser.add_argument("--turns", type=int, default=3, help="turns per session")
+    parser.add_argument("--speech-seconds", type=float, default=1.5, help="length of each spoken turn")
+    parser.add_argument("--no-tts", action="store_true", help="ask for text replies only")
+    parser.add_argument("--cache", action="store_true",
+                        help="let sessions use the shared response cache (off, so every turn reaches the LLM)")
+    parser.add_argument("--slo", type=float, default=2.0, help="p95 reply latency target in seconds")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--turn-timeout", type=float, default=30.0)
+    parser.add_argument("--max-sessions", type=int, default=64, help="admission limit of the in-process server")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    url = args.url or start_fake_server(max_sessions=args.max_sessions)
+    levels = [int(level) for level in args.levels.split(",") if level.strip()]
+    settings = {"tts": not args.no_tts, "cache": args.cache}
+
+    # Speech followed by enough silence for the server's endpointing to close the turn
+    audio = synthetic_speech(args.speech_seconds) + b"\0\0" * int(16000 * 1.2)
+
+    print(f"Load testing {url}")
+    print(f"{'sessions':>9}{'admitted':>10}{'turns':>7}{'errors':>8}{'p50 reply':>11}{'p95 reply':>11}"
+          f"{'p95 audio':>11}{'turns/s':>9}")
+    limit = 0
+    for level in levels:
+        result = run_level(url, level, args.turns, audio, settings, args.turn_timeout)
+        replies = sorted(result.reply_latencies)
+        audio_latencies = sorted(result.audio_latencies)
+        attempted = result.turns + result.errors
+        error_rate = result.errors / attempted if attempted else 1.0
+        p95 = percentile(replies, 95)
+
+        def cell(value):
+            return f"{value:>11.3f}" if value is not None else f"{'-':>11}"
+        print(f"{level:>9}{result.admitted:>10}{result.turns:>7}{result.errors:>8}{cell(percentile(replies, 50))}"
+              f"{cell(p95)}{cell(percentile(audio_latencies, 95))}{result.turns / result.elapsed:>9.2f}")
+
+        if result.rejected == 0 and p95 is not None and p95 <= args.slo and error_rate <= args.max_error_rate:
+            limit = level
+        else:
+            break
+
+    print(f"\nSessions-per-host limit: {limit} (p95 reply <= {args.slo:.1f}s, "
+          f"error rate <= {args.max_error_rate:.0%}, no admission rejections)")
+    stats = Client(url).stats()
+    print("Server pools: " + ", ".join(f"{name} {pool['completed']} done / {pool['rejected']} rejected"
+                                        for name, pool in stats["pools"].items()))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,140 @@
+import collections
+import math
+import threading
+
+
+class NoiseFloorTracker:
+    """Continuously track the background noise floor and publish an energy threshold
+
+    Every captured frame is fed to update(). Frames classified as non-speech
+    pull the noise floor towards their energy with an asymmetric moving
+    average (quick to fall, slow to rise); a sliding-window minimum lets the
+    floor climb when the room gets louder for longer than the window. The
+    resulting threshold is a plain attribute, so consumers read it without
+    blocking. Updates are skipped while suspend_when() returns True, e.g.
+    while the bot itself is talking.
+    """
+
+    def __init__(self, initial_threshold=300, ratio=1.5, min_threshold=50, max_threshold=4000,
+                 warmup_seconds=1.0, fall_time=1.0, rise_time=4.0, window_seconds=5.0,
+                 history_interval=0.5, history_size=600, suspend_when=None):
+        self.ratio = ratio
+        self.min_threshold = min_threshold
+        self.max_threshold = max_threshold
+
+        # Time constants of the moving average, in seconds
+        self.warmup_seconds = warmup_seconds
+        self.fall_time = fall_time
+        self.rise_time = rise_time
+        self.window_seconds = window_seconds
+
+        # Predicate that pauses calibration, e.g. while the bot is speaking
+        self.suspend_when = suspend_when
+
+        self.noise_floor = initial_threshold / float(ratio)
+        self.energy_threshold = float(initial_threshold)
+
+        # Warm-up average taken before the first threshold is published
+        self._warmup_elapsed = 0.0
+        self._warmup_sum = 0.0
+        self._warmup_frames = 0
+
+        # Monotonic queue of (time, energy) holding the sliding-window minimum
+        self._elapsed = 0.0
+        self._window = collections.deque()
+
+        # (stream_time, threshold, noise_floor) samples for convergence checks
+        self.history_interval = history_interval
+        self._history = collections.deque(maxlen=history_size)
+        self._last_history = None
+
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.frames_seen = 0
+        self.frames_used = 0
+
+    @property
+    def calibrated(self):
+        """True once the warm-up period is over"""
+        return self._warmup_elapsed >= self.warmup_seconds
+
+    def add_listener(self, callback):
+        """Call callback(threshold) whenever a new threshold is published"""
+        self._listeners.append(callback)
+
+    def update(self, energy, is_speech, frame_seconds):
+        """Feed the RMS energy of one frame and its speech decision"""
+        self.frames_seen += 1
+        if self.suspend_when is not None and self.suspend_when():
+            return
+
+        with self._lock:
+            self._elapsed += frame_seconds
+            self._track_minimum(energy)
+
+            if not self.calibrated:
+                # Treat the first frames as background noise, like adjust_for_ambient_noise
+                self._warmup_elapsed += frame_seconds
+                self._warmup_sum += energy
+                self._warmup_frames += 1
+                self.noise_floor = self._warmup_sum / self._warmup_frames
+                if self.calibrated:
+                    self._publish(force=True)
+                return
+
+            if not is_speech:
+                time_constant = self.fall_time if energy < self.noise_floor else self.rise_time
+                alpha = 1.0 - math.exp(-frame_seconds / time_constant)
+                self.noise_floor += alpha * (energy - self.noise_floor)
+                self.frames_used += 1
+
+            # Even the quietest recent frame counts as speech: the noise itself got louder
+            window_minimum = self._window[0][1]
+            if self._elapsed >= self.window_seconds and window_minimum * self.ratio > self.energy_threshold:
+                self.noise_floor = window_minimum
+
+            self._publish()
+
+    def _track_minimum(self, energy):
+        """Maintain the minimum energy over the last window_seconds"""
+        while self._window and self._window[-1][1] >= energy:
+            self._window.pop()
+        self._window.append((self._elapsed, energy))
+        while self._window[0][0] < self._elapsed - self.window_seconds:
+            self._window.popleft()
+
+    def _publish(self, force=False):
+        """Recompute the threshold and notify listeners at most once per history interval"""
+        threshold = min(self.max_threshold, max(self.min_threshold, self.noise_floor * self.ratio))
+        self.energy_threshold = threshold
+
+        now = self._elapsed
+        if not force and self._last_history is not None and now - self._last_history < self.history_interval:
+            return
+        self._last_history = now
+        self._history.append((now, threshold, self.noise_floor))
+        for callback in self._listeners:
+            try:
+                callback(threshold)
+            except Exception as e:
+                print(f"Error publishing energy threshold: {e}")
+
+    def threshold_history(self):
+        """Return the published (stream_time, threshold, noise_floor) samples
+
+        stream_time counts seconds of audio fed to the tracker, so the history
+        is comparable between live capture and faster-than-real-time replays.
+        """
+        with self._lock:
+            return list(self._history)
+
+    def has_converged(self, window=5.0, tolerance=0.1):
+        """True when the threshold stayed within tolerance over the last window seconds of audio"""
+        history = self.threshold_history()
+        if not history:
+            return False
+        cutoff = history[-1][0] - window
+        recent = [threshold for timestamp, threshold, _ in history if timestamp >= cutoff]
+        if len(recent) < 2 or history[0][0] > cutoff:
+            return False
+        return (max(recent) - min(recent)) <= tolerance * max(recent)
@@ -0,0 +1,188 @@
+import collections
+import re
+
+SYSTEM_PROMPT = "You are a helpful AI assistant. Keep your responses concise and natural."
+
+# First sentence of a turn, used when compacting it into the summary
+_FIRST_SENTENCE = re.compile(r'^(.+?[.!?])(\s|$)')
+
+
+def _render(role, content):
+    """Prompt line of one turn"""
+    return f"{'User' if role == 'user' else 'Assistant'}: {content}\n"
+
+
+def estimate_tokens(text):
+    """Rough token count; about four characters per token for English text"""
+    return max(1, (len(text) + 3) // 4)
+
+
+class PromptBuilder:
+    """Bounded conversation history rendered into a token-budgeted prompt
+
+    Recent turns are kept verbatim as long as the prompt stays within
+    token_budget. Turns that fall out of that window are compacted into a
+    rolling summary, which is itself capped at summary_budget tokens, so
+    memory use and prompt size stay constant however long the session runs.
+    Each turn is rendered once when it is added; build() only joins the
+    cached lines.
+
+    With a ConversationStore every turn is also persisted, and build()
+    recalls up to recall_turns older exchanges sharing keywords with the
+    user's latest turn, within recall_budget tokens on top of token_budget.
+    """
+
+    def __init__(self, system_prompt=SYSTEM_PROMPT, token_budget=800, summary_budget=200,
+                 history_size=100, summary_words=20, store=None, recall_turns=2, recall_budget=150):
+        self.system_prompt = system_prompt
+        self.store = store
+        self.recall_turns = recall_turns
+        self.recall_budget = recall_budget
+        # The last recall: (query, oldest turn id in the window, rendered lines)
+        self._recall = None
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.summary_words = summary_words
+
+        # Recent raw turns for display and bookkeeping, bounded
+        self.history = collections.deque(maxlen=history_size)
+
+        # Turns currently in the prompt: (entry, rendered line, tokens)
+        self._window = collections.deque()
+        self._window_tokens = 0
+
+        # Compacted older turns: (summary line, tokens)
+        self._summary = collections.deque()
+        self._summary_tokens = 0
+
+        self._base_tokens = estimate_tokens(self.system_prompt) + estimate_tokens("Assistant:")
+        self.compacted_turns = 0
+
+    def add(self, role, content, **extra):
+        """Record a turn and return its history entry"""
+        entry = {"role": role, "content": content}
+        entry.update(extra)
+        if self.store is not None:
+            try:
+                entry["id"] = self.store.append(role, content, extra)
+            except Exception as e:
+                print(f"Error saving conversation turn: {e}")
+        self._append(entry)
+        return entry
+
+    def restore(self, entries):
+        """Load turns of a resumed session, e.g. from ConversationStore.recent(), without recording them again"""
+        for entry in entries:
+            self._append(entry)
+
+    def _append(self, entry):
+        role, content = entry["role"], entry["content"]
+        self.history.append(entry)
+
+        line = _render(role, content)
+        tokens = estimate_tokens(line)
+        self._window.append((entry, line, tokens))
+        self._window_tokens += tokens
+        self._fit()
+
+    def set_token_budget(self, token_budget, summary_budget=None):
+        """Change the budget and compact the window to match"""
+        self.token_budget = token_budget
+        if summary_budget is not None:
+            self.summary_budget = summary_budget
+            self._trim_summary()
+        self._fit()
+
+    def prompt_tokens(self):
+        """Estimated size of the prompt build() would return"""
+        return self._base_tokens + self._summary_tokens + self._window_tokens
+
+    def build(self, pending_user=None):
+        """Render the prompt: system prompt, rolling summary, recent turns
+
+        pending_user adds a user turn to this prompt only, without recording
+        it, e.g. to generate a reply before the user's turn is final.
+        """
+        parts = [self.system_prompt, "\n\n"]
+        recalled = self._recalled(pending_user)
+        if recalled:
+            parts.append("Relevant earlier conversation:\n")
+            parts.extend(recalled)
+            parts.append("\n")
+        if self._summary:
+            parts.append("Summary of the earlier conversation:\n")
+            parts.extend(line for line, _ in self._summary)
+            parts.append("\n")
+        parts.extend(line for _, line, _ in self._window)
+        if pending_user is not None:
+            parts.append(_render("user", pending_user))
+        parts.append("Assistant:")
+        return "".join(parts)
+
+    def _recalled(self, pending_user=None):
+        """Rendered older exchanges relevant to the latest user turn, from the store"""
+        if self.store is None or not self.recall_turns:
+            return []
+        query = pending_user
+        if query is None:
+            query = next((entry["content"] for entry, _, _ in reversed(self._window) if entry["role"] == "user"), None)
+        if not query:
+            return []
+        # Only turns older than everything the prompt already holds verbatim
+        before = self._window[0][0].get("id") if self._window else None
+        if self._recall is not None and self._recall[:2] == (query, before):
+            return self._recall[2]
+
+        lines = []
+        tokens = 0
+        try:
+            entries = self.store.search(query, limit=self.recall_turns, before=before)
+        except Exception as e:
+            print(f"Error searching the conversation store: {e}")
+            entries = []
+        for entry in entries:
+            line = _render(entry["role"], entry["content"])
+            tokens += estimate_tokens(line)
+            if tokens > self.recall_budget:
+                break
+            lines.append(line)
+        self._recall = (query, before, lines)
+        return lines
+
+    def clear(self):
+        """Forget the whole conversation"""
+        self.history.clear()
+        self._window.clear()
+        self._window_tokens = 0
+        self._summary.clear()
+        self._summary_tokens = 0
+
+    def _fit(self):
+        """Move the oldest turns into the summary until the prompt fits the budget"""
+        while len(self._window) > 1 and self.prompt_tokens() > self.token_budget:
+            entry, _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+            self._compact(entry)
+
+    def _compact(self, entry):
+        """Add a one-line digest of a turn to the rolling summary"""
+        content = " ".join(entry["content"].split())
+        match = _FIRST_SENTENCE.match(content)
+        digest = match.group(1) if match else content
+        words = digest.split()
+        if len(words) > self.summary_words:
+            digest = " ".join(words[:self.summary_words]) + "..."
+
+        speaker = "User said" if entry["role"] == "user" else "Assistant said"
+        line = f"- {speaker}: {digest}\n"
+        tokens = estimate_tokens(line)
+        self._summary.append((line, tokens))
+        self._summary_tokens += tokens
+        self.compacted_turns += 1
+        self._trim_summary()
+
+    def _trim_summary(self):
+        """Drop the oldest summary lines once the summary exceeds its budget"""
+        while len(self._summary) > 1 and self._summary_tokens > self.summary_budget:
+            _, tokens = self._summary.popleft()
+            self._summary_tokens -= tokens
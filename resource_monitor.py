@@ -0,0 +1,199 @@
+import collections
+import gc
+import os
+import threading
+import time
+import tracemalloc
+
+from audio_capture import open_input_streams
+from audio_playback import open_output_streams
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Growth within these bounds across the window is noise, not a leak
+DEFAULT_TOLERANCES = {
+    "threads": 1,
+    "open_files": 1,
+    "audio_handles": 1,
+    "rss_mb": 10.0,
+    "traced_mb": 5.0,
+}
+
+
+def audio_handles():
+    """Audio input and output streams currently held open"""
+    return open_input_streams() + open_output_streams()
+
+
+def open_files():
+    """Open file descriptors of this process, or None where they cannot be counted"""
+    if psutil is not None:
+        try:
+            process = psutil.Process()
+            return process.num_fds() if hasattr(process, "num_fds") else process.num_handles()
+        except psutil.Error:
+            return None
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def rss_mb():
+    """Resident memory of this process in MB, or None where it cannot be read"""
+    if psutil is not None:
+        try:
+            return psutil.Process().memory_info().rss / 1048576.0
+        except psutil.Error:
+            return None
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1048576.0
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ResourceMonitor:
+    """Periodic samples of the resources a long session could leak
+
+    Every interval seconds the monitor records live threads, open file
+    descriptors, open audio streams, resident memory and, with
+    trace_allocations, the memory traced by tracemalloc, plus any extra
+    probes (name -> callable returning a number). A metric that has not
+    gone down once over the last window samples and has grown by more than
+    its tolerance is flagged as growing, and an alert is printed with the
+    allocation sites that grew most since the baseline.
+
+    psutil is used when installed; without it file descriptors and memory
+    are read from /proc, and are left out where that does not exist.
+    """
+
+    def __init__(self, interval=60.0, window=10, trace_allocations=False, top=5, probes=None, tolerances=None):
+        self.interval = interval
+        self.window = window
+        self.trace_allocations = trace_allocations
+        self.top = top
+        self.probes = dict(probes or {})
+        self.tolerances = dict(DEFAULT_TOLERANCES, **(tolerances or {}))
+        self.samples = collections.deque(maxlen=max(window, 2) * 10)
+        self.baseline = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._alerted = set()
+
+        self.alerts = 0
+
+    def start(self):
+        """Take the baseline sample and keep sampling in the background"""
+        if self._thread is not None:
+            return
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.baseline is None:
+            self.mark_baseline()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="resource-monitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def mark_baseline(self, collect=True):
+        """Record the sample (and allocation snapshot) later ones are compared with"""
+        if collect:
+            gc.collect()
+        self.baseline = self.sample(record=False)
+        if tracemalloc.is_tracing():
+            self._snapshot = tracemalloc.take_snapshot()
+        return self.baseline
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+            growing = self.growing()
+            # Alert once per metric; a metric that levels off may alert again later
+            for name in growing:
+                if name not in self._alerted:
+                    self.alerts += 1
+                    print(f"Resource monitor: {name} keeps growing "
+                          f"({_rounded(self.baseline).get(name)} -> {_rounded(self.samples[-1]).get(name)})")
+                    for line in self.top_allocators():
+                        print(f"    {line}")
+            self._alerted = set(growing)
+
+    def sample(self, record=True):
+        """Measure every metric now"""
+        sample = {
+            "time": time.time(),
+            "threads": threading.active_count(),
+            "open_files": open_files(),
+            "audio_handles": audio_handles(),
+            "rss_mb": rss_mb(),
+            "traced_mb": tracemalloc.get_traced_memory()[0] / 1048576.0 if tracemalloc.is_tracing() else None,
+        }
+        for name, probe in self.probes.items():
+            try:
+                sample[name] = probe()
+            except Exception as e:
+                print(f"Error reading resource probe {name}: {e}")
+                sample[name] = None
+        if record:
+            with self._lock:
+                self.samples.append(sample)
+        return sample
+
+    def growing(self):
+        """Metrics that never went down over the last window samples and grew beyond tolerance"""
+        with self._lock:
+            recent = list(self.samples)[-self.window:]
+        if len(recent) < self.window:
+            return []
+        result = []
+        for name in recent[-1]:
+            if name == "time":
+                continue
+            values = [sample.get(name) for sample in recent]
+            if any(value is None for value in values):
+                continue
+            monotonic = all(later >= earlier for earlier, later in zip(values, values[1:]))
+            if monotonic and values[-1] - values[0] > self.tolerances.get(name, 0):
+                result.append(name)
+        return result
+
+    def top_allocators(self, limit=None):
+        """Allocation sites that grew most since the baseline, as printable lines"""
+        if self._snapshot is None or not tracemalloc.is_tracing():
+            return []
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)])
+        differences = snapshot.compare_to(self._snapshot, "lineno")
+        return [str(difference) for difference in differences[:limit or self.top] if difference.size_diff > 0]
+
+    def stats(self):
+        """Baseline and latest sample, metrics still growing and alerts raised"""
+        with self._lock:
+            latest = self.samples[-1] if self.samples else None
+        return {
+            "samples": len(self.samples),
+            "baseline": _rounded(self.baseline),
+            "latest": _rounded(latest),
+            "growing": self.growing(),
+            "alerts": self.alerts,
+        }
+
+
+def _rounded(sample):
+    if sample is None:
+        return None
+    return {name: round(value, 1) if isinstance(value, float) else value
+            for name, value in sample.items() if name != "time"}
@@ -0,0 +1,157 @@
+import collections
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import time
+
+# Characters that never change the meaning of a short spoken request
+_PUNCTUATION = re.compile(r"[^\w\s']")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_utterance(text):
+    """Normalize a transcript so trivially different phrasings share a cache key"""
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class ResponseCache:
+    """LRU cache of LLM replies keyed on the user utterance and recent history
+
+    Entries expire after a per-entry TTL and the least recently used entry is
+    evicted once max_entries is reached. When a path is given the cache is
+    loaded from and periodically written back to a JSON file, so it
+    survives restarts.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, history_window=2, path=None, save_interval=5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.history_window = history_window
+        self.path = path
+        self.save_interval = save_interval
+
+        # key -> (reply, expires_at); ordered from least to most recently used
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if self.path:
+            self.load()
+
+    def make_key(self, user_input, history):
+        """Build a cache key from the utterance and a fingerprint of the history window"""
+        window = list(itertools.islice(reversed(history), self.history_window))[::-1]
+        fingerprint = hashlib.sha1()
+        for item in window:
+            fingerprint.update(item["role"].encode("utf-8"))
+            fingerprint.update(b"\0")
+            fingerprint.update(normalize_utterance(item["content"]).encode("utf-8"))
+            fingerprint.update(b"\0")
+        return f"{normalize_utterance(user_input)}|{fingerprint.hexdigest()[:16]}"
+
+    def get(self, key):
+        """Return the cached reply for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            reply, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                self._dirty = True
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return reply
+
+    def put(self, key, reply, ttl=None):
+        """Store a reply; ttl overrides the default lifetime in seconds"""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (reply, time.time() + ttl if ttl else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._dirty = True
+        self._maybe_save()
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def stats(self):
+        """Return hit/miss counters for tuning"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def load(self):
+        """Load unexpired entries from the on-disk store"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error loading response cache: {e}")
+            return
+
+        now = time.time()
+        with self._lock:
+            for key, reply, expires_at in stored.get("entries", []):
+                if expires_at is None or expires_at > now:
+                    self._entries[key] = (reply, expires_at)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self):
+        """Write the cache to disk atomically"""
+        if not self.path:
+            return
+        with self._lock:
+            entries = [[key, reply, expires_at] for key, (reply, expires_at) in self._entries.items()]
+            self._dirty = False
+            self._last_save = time.time()
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"entries": entries}, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error saving response cache: {e}")
+
+    def flush(self):
+        """Write pending changes to disk"""
+        if self._dirty:
+            self.save()
+
+    def _maybe_save(self):
+        """Save at most once per save_interval to keep puts cheap"""
+        if self.path and self._dirty and time.time() - self._last_save >= self.save_interval:
+            self.save()
@@ -0,0 +1,573 @@
+"""Headless multi-session server
+
+Runs many conversations on one host. Each session has its own history,
+settings and voice-activity endpointing; speech recognition, the LLM and
+speech synthesis are shared through fair worker pools with admission
+control.
+
+    python server.py --port 8765
+    python server.py --fake --processes 4      # one process per core, ports 8765..8768
+
+HTTP API (JSON unless noted):
+    POST   /sessions                  create a session; body: optional settings
+    POST   /sessions/<id>/audio       raw 16-bit mono PCM at the session's sample rate
+    POST   /sessions/<id>/text        {"text": ...}: a turn that skips speech recognition
+    POST   /sessions/<id>/settings    change voice_id, rate or tts (other settings are fixed at creation)
+    GET    /sessions/<id>/events      long-poll for transcripts, replies and audio (?timeout=seconds)
+    DELETE /sessions/<id>             close the session
+    GET    /stats                     sessions, pool queues and latency percentiles
+"""
+import argparse
+import base64
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import speech_recognition as sr
+from dotenv import load_dotenv
+
+from audio_capture import AudioCapture, PushAudioSource
+from audio_frontend import AudioFrontEnd
+from latency_tracing import TurnTracer
+from llm_client import ResilientModel
+from noise_calibration import NoiseFloorTracker
+from prompt_builder import PromptBuilder
+from response_cache import ResponseCache
+from text_segmenter import SentenceSegmenter
+from worker_pool import FairWorkerPool, PoolOverloaded
+
+DEFAULT_SETTINGS = {
+    "voice_id": None,
+    "rate": None,
+    "tts": True,
+    "cache": True,
+    "sample_rate": 16000,
+    "energy_threshold": 300,
+    "token_budget": 800,
+}
+
+# Settings a client may change once the session is running
+MUTABLE_SETTINGS = ("voice_id", "rate", "tts")
+
+NO_RESPONSE_MESSAGE = "I apologize, but I couldn't generate a proper response."
+
+
+def _number(value, low, high, integer=False):
+    """True when value is a number (an int if integer) between low and high"""
+    kinds = int if integer else (int, float)
+    return isinstance(value, kinds) and not isinstance(value, bool) and low <= value <= high
+
+
+# What each setting accepts, and how a bad value is reported
+SETTING_CHECKS = {
+    "voice_id": (lambda value: value is None or isinstance(value, str), "a voice id string or null"),
+    "rate": (lambda value: value is None or _number(value, 50, 400), "words per minute between 50 and 400, or null"),
+    "tts": (lambda value: isinstance(value, bool), "true or false"),
+    "cache": (lambda value: isinstance(value, bool), "true or false"),
+    "sample_rate": (lambda value: _number(value, 8000, 48000, integer=True), "an integer between 8000 and 48000"),
+    "energy_threshold": (lambda value: _number(value, 1, 32767), "a number between 1 and 32767"),
+    "token_budget": (lambda value: _number(value, 100, 32000, integer=True), "an integer between 100 and 32000"),
+}
+
+
+def validate_settings(settings, allowed=tuple(DEFAULT_SETTINGS)):
+    """Return settings if every key is in allowed with a valid value, else raise ValueError"""
+    if not isinstance(settings, dict):
+        raise ValueError("settings must be a JSON object")
+    for key, value in settings.items():
+        if key not in allowed:
+            raise ValueError(f"unknown or read-only setting {key!r}")
+        check, expected = SETTING_CHECKS[key]
+        if not check(value):
+            raise ValueError(f"{key} must be {expected}")
+    return settings
+
+
+class Session:
+    """One conversation: isolated history, settings, endpointing and pending events"""
+
+    def __init__(self, session_id, settings, on_utterance, max_events=1000):
+        self.id = session_id
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(validate_settings(settings))
+        self.created_at = time.monotonic()
+        self.last_active = self.created_at
+        self.prompt_builder = PromptBuilder(token_budget=self.settings["token_budget"])
+        self.lock = threading.Lock()
+
+        # Newest turn; results of older turns are dropped when they arrive
+        self.turn = 0
+        self._turn_ids = itertools.count(1)
+
+        # Events waiting for the client's next poll
+        self._events = collections.deque(maxlen=max_events)
+        self._condition = threading.Condition()
+
+        # Server-side endpointing of the pushed audio; no warm-up so the first words count
+        self.source = PushAudioSource(self.settings["sample_rate"])
+        calibrator = NoiseFloorTracker(initial_threshold=self.settings["energy_threshold"], warmup_seconds=0)
+        self.capture = AudioCapture(self.source, calibrator=calibrator,
+                                    on_utterance=lambda utterance: on_utterance(self, utterance))
+        self.capture.start()
+
+    def new_turn(self):
+        """Start a turn, superseding the one in progress"""
+        with self.lock:
+            self.turn = next(self._turn_ids)
+            return self.turn
+
+    def is_current(self, turn):
+        return turn == self.turn
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def emit(self, event_type, **fields):
+        """Queue an event for the client"""
+        event = {"type": event_type, "ts": round(time.time(), 3)}
+        event.update(fields)
+        with self._condition:
+            self._events.append(event)
+            self._condition.notify_all()
+
+    def wait_events(self, timeout):
+        """Return the queued events, waiting up to timeout seconds for the first one"""
+        with self._condition:
+            if not self._events:
+                self._condition.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def close(self):
+        self.source.close()
+        self.capture.stop()
+        with self._condition:
+            self._condition.notify_all()
+
+
+class ConversationServer:
+    """Sessions plus the shared STT, LLM and TTS worker pools"""
+
+    def __init__(self, recognizer, model, tts, max_sessions=64, idle_timeout=300.0,
+                 stt_workers=8, llm_workers=16, tts_workers=1, max_pending_per_session=4, max_pending=256):
+        self.recognizer = recognizer
+        self.model = model
+        self.tts = tts
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+
+        self.stt_pool = FairWorkerPool("stt", stt_workers, max_pending_per_session, max_pending)
+        self.llm_pool = FairWorkerPool("llm", llm_workers, max_pending_per_session, max_pending)
+        self.tts_pool = FairWorkerPool("tts", tts_workers, max_pending_per_session, max_pending)
+        self.pools = (self.stt_pool, self.llm_pool, self.tts_pool)
+
+        # Replies to repeated requests are shared across sessions; keys include each session's history
+        self.response_cache = ResponseCache()
+        self.tracer = TurnTracer()
+        # Utterances are trimmed to the speech before they are uploaded
+        self.frontend = AudioFrontEnd()
+
+        self.sessions = {}
+        self._lock = threading.Lock()
+        self.sessions_created = 0
+        self.sessions_rejected = 0
+        self.stale_results = 0
+
+        self._stopped = threading.Event()
+        self._reaper = threading.Thread(target=self._reap, name="session-reaper")
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    # Sessions
+
+    def create_session(self, settings=None):
+        """Admit a new session, or raise PoolOverloaded when the host is saturated"""
+        with self._lock:
+            saturated = any(pool.pending() >= pool.max_pending * 0.8 for pool in self.pools)
+            if len(self.sessions) >= self.max_sessions or saturated:
+                self.sessions_rejected += 1
+                raise PoolOverloaded("server is at capacity")
+            session = Session(uuid.uuid4().hex[:12], settings or {}, self._on_utterance)
+            self.sessions[session.id] = session
+            self.sessions_created += 1
+        return session
+
+    def get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.touch()
+        return session
+
+    def close_session(self, session_id):
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        for pool in self.pools:
+            pool.discard(session.id)
+        session.close()
+        return True
+
+    def _reap(self):
+        """Close sessions that have been idle for longer than idle_timeout"""
+        while not self._stopped.wait(min(30.0, self.idle_timeout / 4)):
+            now = time.monotonic()
+            for session in list(self.sessions.values()):
+                if now - session.last_active > self.idle_timeout:
+                    print(f"Closing idle session {session.id}")
+                    self.close_session(session.id)
+
+    def shutdown(self):
+        self._stopped.set()
+        for session_id in list(self.sessions):
+            self.close_session(session_id)
+        for pool in self.pools:
+            pool.shutdown()
+
+    # Turn pipeline: capture -> STT -> LLM -> TTS, each stage on its shared pool
+
+    def _on_utterance(self, session, utterance):
+        """Capture thread of a session: send an endpointed utterance to speech recognition"""
+        turn = session.new_turn()
+        started_at = utterance.speech_ended_at
+        try:
+            future = self.stt_pool.submit(session.id, self._recognize, utterance.audio)
+        except PoolOverloaded as e:
+            session.emit("error", turn=turn, message=str(e))
+            return
+        future.add_done_callback(lambda f: self._on_transcript(session, turn, started_at, f))
+
+    def _recognize(self, audio):
+        audio = self.frontend.prepare(audio)
+        with self.tracer.span(None, "stt"):
+            try:
+                return self.recognizer.recognize_google(audio)
+            except sr.UnknownValueError:
+                return None
+
+    def _on_transcript(self, session, turn, started_at, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            session.emit("error", turn=turn, message=f"speech recognition failed: {future.exception()}")
+            return
+        text = future.result()
+        if not text:
+            session.emit("unrecognized", turn=turn)
+            return
+        session.emit("transcript", turn=turn, text=text)
+        self.start_reply(session, text, turn, started_at)
+
+    def start_reply(self, session, text, turn=None, started_at=None):
+        """Generate the reply to a user turn"""
+        turn = turn or session.new_turn()
+        started_at = started_at or time.perf_counter()
+        if not session.is_current(turn):
+            self.stale_results += 1
+            return
+
+        with session.lock:
+            cache_key = self.response_cache.make_key(text, session.prompt_builder.history)
+            session.prompt_builder.add("user", text)
+            prompt = session.prompt_builder.build()
+
+        cached = self.response_cache.get(cache_key) if session.settings["cache"] else None
+        if cached is not None:
+            self._on_reply(session, turn, started_at, cache_key, (cached, False))
+            return
+        try:
+            future = self.llm_pool.submit(session.id, self._generate, prompt)
+        except PoolOverloaded as e:
+            session.emit("error", turn=turn, message=str(e))
+            return
+        future.add_done_callback(lambda f: self._on_llm_done(session, turn, started_at, cache_key, f))
+
+    def _generate(self, prompt):
+        """Call the shared model; returns (text, cacheable)"""
+        with self.tracer.span(None, "llm_total"):
+            response = self.model.generate_content(prompt)
+        cacheable = not getattr(response, 'local', False)
+        if response and hasattr(response, 'parts') and response.parts:
+            return response.parts[0].text.strip(), cacheable
+        if response and hasattr(response, 'text'):
+            return response.text.strip(), cacheable
+        return NO_RESPONSE_MESSAGE, False
+
+    def _on_llm_done(self, session, turn, started_at, cache_key, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            session.emit("error", turn=turn, message=f"language model failed: {future.exception()}")
+            return
+        self._on_reply(session, turn, started_at, cache_key, future.result())
+
+    def _on_reply(self, session, turn, started_at, cache_key, result):
+        text, cacheable = result
+        if not session.is_current(turn):
+            # The user has already moved on; this reply is never delivered
+            self.stale_results += 1
+            return
+        with session.lock:
+            session.prompt_builder.add("assistant", text)
+        if cacheable:
+            self.response_cache.put(cache_key, text)
+
+        latency = time.perf_counter() - started_at
+        self.tracer.record(None, "response_latency", latency)
+        session.emit("reply", turn=turn, text=text, latency=round(latency, 3))
+
+        if session.settings["tts"] and self.tts is not None:
+            segmenter = SentenceSegmenter()
+            self._speak(session, turn, started_at, segmenter.feed(text) + segmenter.flush(), 0)
+
+    def _speak(self, session, turn, started_at, sentences, index):
+        """Synthesize the reply one sentence at a time, so sessions take turns on the TTS workers"""
+        if index >= len(sentences) or not session.is_current(turn):
+            return
+        try:
+            future = self.tts_pool.submit(session.id, self._synthesize, sentences[index],
+                                          session.settings["voice_id"], session.settings["rate"])
+        except PoolOverloaded as e:
+            session.emit("error", turn=turn, message=str(e))
+            return
+
+        def on_done(f):
+            if f.cancelled() or not session.is_current(turn):
+                return
+            if f.exception() is not None:
+                session.emit("error", turn=turn, message=f"speech synthesis failed: {f.exception()}")
+                return
+            if index == 0:
+                self.tracer.record(None, "first_audio", time.perf_counter() - started_at)
+            session.emit("audio", turn=turn, index=index, text=sentences[index],
+                         wav=base64.b64encode(f.result()).decode("ascii"))
+            self._speak(session, turn, started_at, sentences, index + 1)
+
+        future.add_done_callback(on_done)
+
+    def _synthesize(self, text, voice_id, rate):
+        with self.tracer.span(None, "tts"):
+            job = self.tts.synthesize(text, voice_id=voice_id, rate=rate)
+            job.wait()
+        if job.error is not None:
+            raise job.error
+        return job.audio or b""
+
+    def stats(self):
+        return {
+            "pid": os.getpid(),
+            "sessions": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "sessions_created": self.sessions_created,
+            "sessions_rejected": self.sessions_rejected,
+            "stale_results": self.stale_results,
+            "pools": {pool.name: pool.stats() for pool in self.pools},
+            "latency": self.tracer.summary(),
+            "response_cache": self.response_cache.stats(),
+            "audio_frontend": self.frontend.stats(),
+        }
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    """Threaded HTTP server with a listen backlog sized for many concurrent sessions"""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """HTTP front end of a ConversationServer (self.server.app)"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json_body(self):
+        """The request body as a JSON object; ValueError when it is anything else"""
+        body = self._body()
+        value = json.loads(body) if body else {}
+        if not isinstance(value, dict):
+            raise ValueError("body must be a JSON object")
+        return value
+
+    def _route(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        return parts, parse_qs(url.query)
+
+    def _session(self, parts):
+        session = self.server.app.get_session(parts[1]) if len(parts) >= 2 else None
+        if session is None:
+            self._send(404, {"error": "unknown session"})
+        return session
+
+    def do_GET(self):
+        app = self.server.app
+        parts, query = self._route()
+        if parts == ["stats"]:
+            self._send(200, app.stats())
+        elif parts == ["health"]:
+            self._send(200, {"ok": True})
+        elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "events":
+            session = self._session(parts)
+            if session is not None:
+                try:
+                    timeout = float(query.get("timeout", ["10"])[0])
+                except ValueError:
+                    timeout = None
+                if timeout is None or not timeout >= 0:
+                    self._send(400, {"error": "bad request: timeout must be a non-negative number of seconds"})
+                    return
+                self._send(200, {"events": session.wait_events(min(30.0, timeout))})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        app = self.server.app
+        parts, _ = self._route()
+        try:
+            if parts == ["sessions"]:
+                session = app.create_session(self._json_body())
+                self._send(201, {"session_id": session.id, "settings": session.settings})
+            elif len(parts) == 3 and parts[0] == "sessions":
+                session = self._session(parts)
+                if session is None:
+                    return
+                if parts[2] == "audio":
+                    data = self._body()
+                    session.source.push(data)
+                    self._send(202, {"bytes": len(data)})
+                elif parts[2] == "text":
+                    text = self._json_body()["text"]
+                    if not isinstance(text, str):
+                        raise ValueError("text must be a string")
+                    app.start_reply(session, text)
+                    self._send(202, {})
+                elif parts[2] == "settings":
+                    session.settings.update(validate_settings(self._json_body(), MUTABLE_SETTINGS))
+                    self._send(200, {"settings": session.settings})
+                else:
+                    self._send(404, {"error": "not found"})
+            else:
+                self._send(404, {"error": "not found"})
+        except PoolOverloaded as e:
+            self._send(503, {"error": str(e)})
+        except (ValueError, KeyError) as e:
+            self._send(400, {"error": f"bad request: {e}"})
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) == 2 and parts[0] == "sessions" and self.server.app.close_session(parts[1]):
+            self._send(204)
+        else:
+            self._send(404, {"error": "unknown session"})
+
+
+def create_components(fake=False):
+    """Recognizer, model and TTS service for the server; fake ones need no devices or network"""
+    if fake:
+        from fakes import FakeModel, FakeTTSEngine, ScriptedRecognizer, lognormal_latency
+        from tts_engine import TTSEngineService
+        recognizer = ScriptedRecognizer(latency=lognormal_latency(0.3, 0.3), default="hello there")
+        model = FakeModel(latency=lognormal_latency(0.4, 0.4))
+        engine = FakeTTSEngine(words_per_second=50.0, start_latency=0.0)
+        tts = TTSEngineService(engine_factory=lambda driver_name: engine)
+    else:
+        import google.generativeai as genai
+        from tts_engine import get_tts_service
+        load_dotenv()
+        recognizer = sr.Recognizer()
+        genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+        model = genai.GenerativeModel('gemini-1.5-flash')
+        tts = get_tts_service()
+    tts.wait_ready()
+    return recognizer, ResilientModel(model), tts
+
+
+def create_server(host="127.0.0.1", port=8765, fake=False, verbose=False, **options):
+    """Build the HTTP server; call serve_forever() on the result"""
+    recognizer, model, tts = create_components(fake)
+    httpd = _HTTPServer((host, port), _Handler)
+    httpd.app = ConversationServer(recognizer, model, tts, **options)
+    httpd.verbose = verbose
+    return httpd
+
+
+def serve(host="127.0.0.1", port=8765, fake=False, verbose=False, **options):
+    """Run one server process until interrupted"""
+    httpd = create_server(host, port, fake, verbose, **options)
+    print(f"Serving conversations on http://{host}:{httpd.server_address[1]} (pid {os.getpid()})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.app.shutdown()
+        httpd.server_close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-session speech bot server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--processes", type=int, default=1,
+                        help="server processes, one per core; process i listens on port + i")
+    parser.add_argument("--max-sessions", type=int, default=64, help="sessions admitted per process")
+    parser.add_argument("--idle-timeout", type=float, default=300.0, help="close sessions idle this long")
+    parser.add_argument("--stt-workers", type=int, default=8)
+    parser.add_argument("--llm-workers", type=int, default=16)
+    parser.add_argument("--tts-workers", type=int, default=1)
+    parser.add_argument("--max-pending-per-session", type=int, default=4,
+                        help="queued tasks a session may have per pool before it is refused")
+    parser.add_argument("--fake", action="store_true", help="use fake STT, LLM and TTS (for load testing)")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = dict(fake=args.fake, verbose=args.verbose, max_sessions=args.max_sessions,
+                   idle_timeout=args.idle_timeout, stt_workers=args.stt_workers, llm_workers=args.llm_workers,
+                   tts_workers=args.tts_workers, max_pending_per_session=args.max_pending_per_session)
+    if args.processes <= 1:
+        serve(args.host, args.port, **options)
+        return 0
+
+    # Independent processes sidestep the GIL; sessions stay on the process that created them
+    processes = [multiprocessing.Process(target=serve, args=(args.host, args.port + index), kwargs=options)
+                 for index in range(args.processes)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join(timeout=5)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,191 @@
+"""Soak test: thousands of turns through one bot, checking nothing leaks
+
+Drives the benchmark's scripted conversation (fake microphone, recognizer,
+LLM and TTS engine, faster than real time) through a single SpeechBot for
+many turns, interrupting some replies and restarting the conversation now
+and then. Threads, open files, audio streams and memory are sampled as it
+goes; the run fails when they have not come back to the baseline taken
+after warm-up, or when any of them grew steadily throughout.
+
+    python soak_test.py --turns 2000
+    python soak_test.py --turns 500 --engine --restart-every 50
+"""
+import argparse
+import contextlib
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmark import BenchmarkRun, parse_args as benchmark_args, wait_until_quiet
+from resource_monitor import ResourceMonitor
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Soak test of the speech bot for resource leaks")
+    parser.add_argument("--turns", type=int, default=2000, help="number of user turns to play")
+    parser.add_argument("--warm-up", type=int, default=20, help="turns played before the baseline is taken")
+    parser.add_argument("--interrupt-every", type=int, default=3,
+                        help="interrupt the bot mid-reply on every Nth turn (0 disables)")
+    parser.add_argument("--restart-every", type=int, default=200,
+                        help="stop and restart the conversation every N turns (0 disables)")
+    parser.add_argument("--speed", type=float, default=20.0, help="how much faster than real time the user speaks")
+    parser.add_argument("--tts-wps", type=float, default=15.0, help="speaking speed of the fake TTS in words/second")
+    parser.add_argument("--engine", action="store_true",
+                        help="speak through the engine instead of buffered playback")
+    parser.add_argument("--samples", type=int, default=20, help="resource samples taken over the run")
+    parser.add_argument("--window", type=int, default=8,
+                        help="consecutive samples without a decrease that count as steady growth")
+    parser.add_argument("--fd-slack", type=int, default=2, help="extra open files allowed at the end")
+    parser.add_argument("--rss-mb", type=float, default=20.0, help="resident memory growth allowed at the end")
+    parser.add_argument("--traced-mb", type=float, default=5.0, help="traced memory growth allowed at the end")
+    parser.add_argument("--objects", type=int, default=20000, help="live object growth allowed at the end")
+    parser.add_argument("--no-tracemalloc", action="store_true",
+                        help="skip allocation tracing (faster, but no top allocators)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="give up on a turn after this many seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own log output")
+    return parser.parse_args(argv)
+
+
+class SoakRun(BenchmarkRun):
+    """A benchmark conversation played for many turns while resources are sampled"""
+
+    def __init__(self, args, workdir, log):
+        # Near-instant services keep the turns short; pacing comes from the microphone and speech
+        settings = ["--stt-latency", "0.01", "--llm-latency", "0.01", "--chunk-latency", "0",
+                    "--tts-wps", str(args.tts_wps), "--interrupt-every", str(args.interrupt_every),
+                    "--interrupt-after", "0.3", "--timeout", str(args.timeout), "--seed", str(args.seed)]
+        if not args.engine:
+            settings.append("--buffered")
+        super().__init__(benchmark_args(settings), workdir)
+        self.soak = args
+        self.log = log
+        self.source.speed = args.speed
+        # Live Python objects catch leaks too small to show in memory over a short run
+        self.monitor = ResourceMonitor(window=args.window, trace_allocations=not args.no_tracemalloc,
+                                       probes={"objects": lambda: len(gc.get_objects())},
+                                       tolerances={"rss_mb": args.rss_mb, "traced_mb": args.traced_mb,
+                                                   "objects": args.objects})
+        self.played = 0
+        self.restarts = 0
+
+    def soak_run(self):
+        """Play every turn and return the failures found (empty when nothing leaked)"""
+        args = self.soak
+        self.bot.start_conversation()
+        try:
+            deadline = time.perf_counter() + 5.0
+            while not self.bot.calibrator.calibrated and time.perf_counter() < deadline:
+                time.sleep(0.05)
+
+            # Warm-up, including one restart, so caches and lazily created threads exist before the baseline
+            self.play(args.warm_up)
+            self.restart()
+            if self.monitor.trace_allocations:
+                tracemalloc.start()
+            self.settle()
+            self.monitor.mark_baseline()
+
+            every = max(1, args.turns // max(1, args.samples))
+            started = time.perf_counter()
+            for index in range(args.turns):
+                self.play(1, index)
+                if args.restart_every and (index + 1) % args.restart_every == 0:
+                    self.restart()
+                if (index + 1) % every == 0:
+                    self.settle()
+                    sample = self.monitor.sample()
+                    self.log(f"turn {index + 1:>6}  {time.perf_counter() - started:>7.0f} s  {_describe(sample)}")
+            self.settle()
+            return self.check(self.monitor.sample())
+        finally:
+            self.bot.stop_conversation()
+            self.tts.shutdown()
+
+    def play(self, turns, first=None):
+        for offset in range(turns):
+            index = first if first is not None else offset
+            interrupt = self.args.interrupt_every and (index + 1) % self.args.interrupt_every == 0
+            self.run_turn(index, interrupt)
+            self.played += 1
+            # Only the current turn's playback is inspected; drop the rest so the harness does not grow
+            self.engine.utterances.clear()
+            del self.turn_latencies[:], self.barge_ins[:], self.chunk_gaps[:]
+
+    def restart(self):
+        self.bot.stop_conversation()
+        self.bot.start_conversation()
+        self.restarts += 1
+
+    def settle(self):
+        """Let replies and background work finish, then collect garbage, before sampling"""
+        wait_until_quiet(self.bot, self.engine, timeout=self.soak.timeout)
+        time.sleep(0.2)
+        gc.collect()
+
+    def check(self, final):
+        """Failures: resources above the baseline at the end, or growing steadily"""
+        args = self.soak
+        baseline = self.monitor.baseline
+        allowed = {"threads": 0, "audio_handles": 0, "open_files": args.fd_slack, "rss_mb": args.rss_mb,
+                   "traced_mb": args.traced_mb, "objects": args.objects}
+        failures = []
+        for name, slack in allowed.items():
+            before, after = baseline.get(name), final.get(name)
+            if before is not None and after is not None and after > before + slack:
+                failures.append(f"{name} did not return to baseline: {_format(before)} -> {_format(after)}")
+        for name in self.monitor.growing():
+            failures.append(f"{name} grew over the last {args.window} samples")
+        if self.missed_replies or self.missed_barge_ins:
+            failures.append(f"{self.missed_replies} replies and {self.missed_barge_ins} barge-ins missed")
+        return failures
+
+
+def _format(value):
+    return f"{value:.1f}" if isinstance(value, float) else str(value)
+
+
+def _describe(sample):
+    return "  ".join(f"{name}={_format(value)}" for name, value in sample.items()
+                     if name != "time" and value is not None)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="speech-bot-soak-")
+    out = sys.stdout
+
+    def log(line):
+        print(line, file=out, flush=True)
+
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            run = SoakRun(args, workdir, log)
+            log(f"Soak test: {args.turns} turns, interrupting every {args.interrupt_every}, "
+                f"restarting every {args.restart_every}, {args.speed:g}x real time")
+            failures = run.soak_run()
+    run.bot.tracer.close()
+
+    log(f"\nPlayed {run.played} turns with {run.restarts} restarts in {time.perf_counter() - started:.0f} s")
+    log(f"baseline  {_describe(run.monitor.baseline)}")
+    log(f"final     {_describe(run.monitor.samples[-1])}")
+    allocators = run.monitor.top_allocators()
+    if allocators:
+        log("\nTop allocation growth since the baseline")
+        for line in allocators:
+            log(f"    {line}")
+    if failures:
+        log("\nFAILED")
+        for failure in failures:
+            log(f"    {failure}")
+        return 1
+    log("\nOK: resources returned to baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
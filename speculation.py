@@ -0,0 +1,56 @@
+import difflib
+import threading
+
+from response_cache import normalize_utterance
+
+
+def transcript_similarity(a, b):
+    """Similarity of two transcripts between 0 and 1, ignoring case and punctuation"""
+    a = normalize_utterance(a)
+    b = normalize_utterance(b)
+    if a == b:
+        return 1.0
+    return difflib.SequenceMatcher(None, a.split(), b.split()).ratio()
+
+
+class SpeculationStats:
+    """Counters for replies generated speculatively from interim transcripts
+
+    A speculation is a hit when the final transcript matched the interim one
+    and its reply was used, a miss when it was thrown away. saved is the
+    head start hits gave the reply: the time between starting the
+    speculative generation and receiving the final transcript.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def record_start(self):
+        with self._lock:
+            self.started += 1
+
+    def record_hit(self, saved):
+        with self._lock:
+            self.hits += 1
+            self.saved_seconds += max(0.0, saved)
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def stats(self):
+        """Return the counters, hit rate and average latency saved per hit"""
+        with self._lock:
+            decided = self.hits + self.misses
+            return {
+                "started": self.started,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / decided if decided else None,
+                "saved_ms_per_hit": self.saved_seconds / self.hits * 1000.0 if self.hits else None,
+                "saved_ms_total": self.saved_seconds * 1000.0,
+            }
@@ -1,96 +1,334 @@
+import time
+_IMPORT_STARTED_AT = time.perf_counter()
 import speech_recognition as sr
-import pyttsx3
 import threading
 import queue
-import time
-import google.generativeai as genai
 from dotenv import load_dotenv
 import os
 import tkinter as tk
 from tkinter import ttk, scrolledtext
 import sys
+from tts_engine import get_tts_service
+from text_segmenter import SentenceSegmenter
+from audio_capture import AudioCapture
+from noise_calibration import NoiseFloorTracker
+from response_cache import ResponseCache
+from audio_cache import TTSAudioCache
+from prompt_builder import PromptBuilder
+from generation import GenerationManager, GenerationCancelled
+from llm_client import ResilientModel
+from latency_tracing import TurnTracer
+from audio_devices import DeviceCache
+from conversation import ConversationOrchestrator, Transcript
+from echo_suppression import EchoSuppressor
+from command_spotter import COMMANDS, CommandSpotter, match_command
+from audio_frontend import AudioFrontEnd
+from gui_updates import GuiUpdater
+from conversation_store import ConversationStore
+from resource_monitor import ResourceMonitor
+
+# Time spent importing this module and its dependencies (part of the startup report)
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED_AT
+
+# Default location for caches and logs
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+# Fixed phrases the bot speaks repeatedly; rendered into the audio cache at startup
+NO_RESPONSE_MESSAGE = "I apologize, but I couldn't generate a proper response."
+REQUEST_ERROR_MESSAGE = "I apologize, but I'm having trouble processing your request."
+FALLBACK_MESSAGE = "I apologize, but I couldn't generate a response. Could you please try again?"
+ERROR_MESSAGE = "I encountered an error. Please try again."
+VOICE_TEST_MESSAGE = "Testing new voice settings."
+SERVICE_UNAVAILABLE_MESSAGE = "I'm having trouble reaching my language service right now. Please try again in a moment."
+CACHED_PHRASES = [NO_RESPONSE_MESSAGE, REQUEST_ERROR_MESSAGE, FALLBACK_MESSAGE, ERROR_MESSAGE, VOICE_TEST_MESSAGE,
+                  SERVICE_UNAVAILABLE_MESSAGE]
 
 class SpeechBot:
-    def __init__(self):
-        # Initialize speech recognition
-        self.recognizer = sr.Recognizer()
-        
-        # List available microphones
-        print("Available microphones:")
-        for index, name in enumerate(sr.Microphone.list_microphone_names()):
-            print(f"Microphone {index}: {name}")
-        
-        # Initialize microphone - use Microphone Array (Intel Smart Sound Technology)
-        try:
-            # Find the index of the Intel Smart Sound Technology microphone
-            mic_index = None
-            for index, name in enumerate(sr.Microphone.list_microphone_names()):
-                if "Intel" in name and "Smart" in name and "Microphone" in name:
-                    mic_index = index
-                    break
-            
-            if mic_index is not None:
-                self.microphone = sr.Microphone(device_index=mic_index)
-                print(f"Using microphone: {sr.Microphone.list_microphone_names()[mic_index]}")
-            else:
-                # Fall back to default microphone if Intel mic not found
-                self.microphone = sr.Microphone()
-                print(f"Using default microphone: {self.microphone.device_index}")
-        except Exception as e:
-            print(f"Error initializing microphone: {e}")
-            raise
-        
-        # Initialize text-to-speech engine
-        self.engine = None
-        self.init_tts_engine()
+    def __init__(self, warm_up_tts=True, stream_responses=True, response_cache_path=None, tts_cache_dir=None,
+                 prompt_token_budget=800, llm_timeout=15.0, llm_hedging=False, latency_log_path=None,
+                 microphone=None, recognizer=None, model=None, tts=None, headless=False,
+                 speculative_generation=False, speculation_threshold=0.9, early_endpoint=0.3,
+                 buffered_playback=True, barge_in_on_speech=True, playback_block_seconds=0.02,
+                 echo_suppression=True, command_spotting=True, voice_commands=COMMANDS,
+                 command_templates_path=None, conversation_store_path=None, resume_session=False,
+                 resource_monitor_interval=60.0, trace_allocations=False):
+        """Create the bot
+        
+        microphone, recognizer, model and tts replace the real devices and
+        services (e.g. with the stand-ins in fakes.py); headless skips the Tk
+        window so the bot can be driven from scripts and benchmarks, and
+        initializes everything before returning.
+        
+        speculative_generation starts the reply from an interim transcript
+        once the user has paused for early_endpoint seconds; it is kept if
+        the final transcript is at least speculation_threshold similar.
+        
+        buffered_playback renders the next sentence to audio while the
+        current one plays instead of speaking each one through the engine.
+        With it, barge_in_on_speech pauses a reply as soon as the user starts
+        talking over it; playback_block_seconds bounds the time to silence.
+        echo_suppression keeps the bot's own voice, picked up by the
+        microphone, from being taken for the user.
+        
+        voice_commands are carried out directly, with no LLM call, when a
+        transcript consists of one of them; with command_spotting they are
+        also recognized on the device from enrolled examples (see
+        command_spotter.py), skipping the recognizer as well.
+        
+        Every turn is saved to the conversation store at
+        conversation_store_path; resume_session continues the last session
+        there instead of starting a new one.
+        
+        While a conversation runs, threads, open files, audio streams and
+        memory are sampled every resource_monitor_interval seconds (0 turns
+        this off) and steady growth is reported; see resource_monitor.py.
+        trace_allocations also traces allocations with tracemalloc (slower),
+        so growth alerts list the code that allocated the memory.
+        """
+        # Read settings such as the API key and cache locations from .env
+        load_dotenv()
         
-        # List available voices
-        print("\nAvailable voices:")
-        voices = self.engine.getProperty('voices')
-        for idx, voice in enumerate(voices):
-            print(f"Voice {idx}: {voice.name} ({voice.id})")
+        # Per-turn timing spans for capture, STT, LLM and TTS
+        self.tracer = TurnTracer(latency_log_path or os.getenv('LATENCY_LOG_PATH') or
+                                 os.path.join(CACHE_DIR, "latency.jsonl"))
+        self.turn_id = None
         
-        # Set voice (default to the first voice)
-        if voices:
-            # You can change the index to select a different voice
-            # 0 is usually a male voice, 1 is usually a female voice
-            self.engine.setProperty('voice', voices[1].id)  # Change to index 1 for female voice
-            print(f"Using voice: {voices[1].name}")
+        self.headless = headless
+        self.status = "Starting..."
         
-        # Set speech rate
-        self.engine.setProperty('rate', 150)  # Speed of speech
+        # Where startup time went, reported once everything is ready
+        self.started_at = time.perf_counter()
+        self.startup_times = {"imports": IMPORT_SECONDS}
+        self.ready = threading.Event()
+        self.init_error = None
         
-        # Initialize Gemini
-        load_dotenv()
-        genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-        # Use Gemini 2.0 Flash model
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
+        # Initialize speech recognition
+        self.recognizer = recognizer or sr.Recognizer()
+        
+        # Devices and services; created by initialize() unless injected
+        self.microphone = microphone
+        self.tts = tts
+        self.llm = model
+        self.model = None
+        self.calibrator = None
+        self.capture = None
+        self.echo_suppression = echo_suppression
+        self.echo = None
+        
+        # Utterances are resampled to 16 kHz and trimmed before anything analyses or uploads them
+        self.frontend = AudioFrontEnd()
+        
+        # Short commands such as "stop" are spotted locally, before recognition
+        self.voice_commands = tuple(voice_commands)
+        self.commands = None
+        self._spotted = None
+        if command_spotting:
+            self.commands = CommandSpotter(command_templates_path or os.getenv('COMMAND_TEMPLATES_PATH') or
+                                           os.path.join(CACHE_DIR, "commands.json"), commands=self.voice_commands)
+        self.warm_up_tts = warm_up_tts
+        self.buffered_playback = buffered_playback
+        self.playback_block_seconds = playback_block_seconds
+        self.llm_timeout = llm_timeout
+        self.llm_hedging = llm_hedging
+        
+        # The chosen input device is remembered so later startups skip enumeration
+        self.device_cache = DeviceCache(os.getenv('DEVICE_CACHE_PATH') or os.path.join(CACHE_DIR, "devices.json"))
+        
+        # Rendered audio for the fixed phrases, reused across sessions
+        tts_cache_dir = tts_cache_dir or os.getenv('TTS_CACHE_DIR') or os.path.join(CACHE_DIR, "tts")
+        self.audio_cache = TTSAudioCache(tts_cache_dir)
+        
+        # Every LLM request gets a generation id; a newer one cancels stale requests
+        self.generations = GenerationManager()
+        
+        # Cache replies to repeated short requests; persisted when a path is configured
+        self.response_cache = ResponseCache(path=response_cache_path or os.getenv('RESPONSE_CACHE_PATH'))
         
         # Initialize queues for handling interruptions
         self.input_queue = queue.Queue()
-        self.output_queue = queue.Queue()
         
-        # Flag to control the conversation flow
-        self.is_speaking = False
-        self.should_stop = False
+        # Transcript lines and widget changes from any thread reach the window through here
+        self.gui = GuiUpdater()
         
-        # Create an event for signaling speech to stop
-        self.stop_event = threading.Event()
-        
-        # Store reference to current speech engine
-        self.current_engine = None
+        # Every turn is kept on disk; older turns relevant to the current one are recalled into the prompt
+        self.store = None
+        try:
+            self.store = ConversationStore(conversation_store_path or os.getenv('CONVERSATION_STORE_PATH') or
+                                           os.path.join(CACHE_DIR, "conversations.db"))
+            self.store.start_session(resume=resume_session)
+        except Exception as e:
+            print(f"Error opening the conversation store: {e}")
+            self.store = None
+        
+        # Conversation history, kept bounded; the prompt builder sizes the context
+        # window by an estimated token budget and summarizes turns that fall out of it
+        self.prompt_builder = PromptBuilder(token_budget=prompt_token_budget, store=self.store)
+        self.conversation_history = self.prompt_builder.history
+        if resume_session and self.store is not None:
+            # Only the latest turns are read back; older ones are recalled when relevant
+            self.prompt_builder.restore(self.store.recent(self.prompt_builder.history.maxlen))
+            print(f"Resumed session {self.store.session_id} with {len(self.conversation_history)} turns")
+        
+        # Speak replies sentence by sentence while Gemini is still generating them
+        self.stream_responses = stream_responses
+        
+        # Optionally start generating before the final transcript is in
+        self.speculative_generation = speculative_generation
+        self.early_endpoint = early_endpoint
+        
+        # Turn taking: capture, recognition, generation and playback are
+        # coordinated by one event-driven state machine
+        self.conversation = ConversationOrchestrator(self, FALLBACK_MESSAGE, ERROR_MESSAGE,
+                                                     speculate=speculative_generation,
+                                                     speculation_threshold=speculation_threshold,
+                                                     barge_in_on_speech=barge_in_on_speech)
+        self.running = False
         
-        # Conversation history
-        self.conversation_history = []
+        # Watch for resources that keep growing over a long session
+        self.monitor = None
+        if resource_monitor_interval:
+            self.monitor = ResourceMonitor(interval=resource_monitor_interval, trace_allocations=trace_allocations)
+        
+        # Initialize GUI; it appears before the slow parts of startup have run
+        self.root = None
+        if not self.headless:
+            step_started = time.perf_counter()
+            self.init_gui()
+            self.startup_times["gui"] = time.perf_counter() - step_started
+        
+        # Bring up the microphone, speech engine and LLM in the background
+        if self.headless:
+            self.initialize()
+        else:
+            self.startup_thread = threading.Thread(target=self.initialize, name="startup")
+            self.startup_thread.daemon = True
+            self.startup_thread.start()
+    
+    def initialize(self):
+        """Initialize the microphone, TTS engine and LLM client, then mark the bot ready
+        
+        The LLM SDK is imported and configured on its own thread while the
+        microphone and speech engine come up; the status bar shows which part
+        is still starting.
+        """
+        llm_thread = threading.Thread(target=self._timed_step, args=("llm", self.init_llm))
+        llm_thread.daemon = True
+        llm_thread.start()
+        
+        self.set_status("Starting: microphone...")
+        self._timed_step("microphone", self.init_microphone)
+        if self.init_error is None:
+            self.set_status("Starting: speech engine...")
+            self._timed_step("tts", self.init_tts)
+        if self.init_error is None:
+            self._timed_step("capture", self.init_capture)
+        if llm_thread.is_alive():
+            self.set_status("Starting: language model...")
+        llm_thread.join()
+        
+        total = time.perf_counter() - self.started_at
+        self.startup_times["ready"] = total
+        self.print_startup_report()
+        if self.init_error is not None:
+            self.set_status(f"Startup failed: {self.init_error}")
+            return
+        self.ready.set()
+        self.set_status(f"Ready (started in {total:.1f}s)")
+        if self.root is not None:
+            self.gui.call(self.on_ready)
+    
+    def _timed_step(self, name, step):
+        """Run one startup step, recording its duration and any error"""
+        step_started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"Error during startup ({name}): {e}")
+            if self.init_error is None:
+                self.init_error = e
+        finally:
+            self.startup_times[name] = time.perf_counter() - step_started
+    
+    def print_startup_report(self):
+        """Print where startup time went"""
+        print("Startup times:")
+        for step, seconds in self.startup_times.items():
+            print(f"  {step:<12}{seconds * 1000.0:>8.0f} ms")
+    
+    def init_microphone(self):
+        """Open the input device, preferring the Intel Smart Sound Technology array"""
+        if self.microphone is not None:
+            return
         
-        # Lock for thread synchronization
-        self.speech_lock = threading.Lock()
+        # Devices are enumerated once and the choice cached on disk
+        refresh = os.getenv('REFRESH_AUDIO_DEVICES') == '1'
+        self.microphone, selection = self.device_cache.open_microphone(refresh=refresh)
         
-        # Thread for non-blocking speech
-        self.speech_thread = None
+        print("Available microphones" + (" (cached):" if selection.cached else ":"))
+        for index, name in enumerate(selection.names):
+            print(f"Microphone {index}: {name}")
+        if selection.name is not None:
+            print(f"Using microphone: {selection.name}")
+        else:
+            # Fall back to default microphone if Intel mic not found
+            print(f"Using default microphone: {self.microphone.device_index}")
+    
+    def init_tts(self):
+        """Attach to the shared text-to-speech engine unless one was injected"""
+        if self.tts is None and not self.init_tts_engine(warm_up=self.warm_up_tts):
+            raise RuntimeError("text-to-speech engine unavailable")
         
-        # Initialize GUI
-        self.init_gui()
+        # List available voices from the cached catalog
+        print("\nAvailable voices:")
+        for idx, voice in enumerate(self.tts.voices):
+            print(f"Voice {idx}: {voice.name} ({voice.id})")
+    
+    def init_capture(self):
+        """Create the noise floor tracker and the always-open capture stream"""
+        # Track the noise floor continuously from non-speech frames; pause while
+        # the bot is talking so the threshold is not tuned to its own voice
+        self.calibrator = NoiseFloorTracker(initial_threshold=self.recognizer.energy_threshold,
+                                            suspend_when=self.tts.is_busy)
+        self.recognizer.dynamic_energy_threshold = False
+        self.calibrator.add_listener(lambda threshold: setattr(self.recognizer, 'energy_threshold', threshold))
+        
+        # Gate the bot's own voice out of voice activity detection; the TTS
+        # service tells the suppressor what it is playing
+        if self.echo_suppression:
+            self.echo = EchoSuppressor()
+            self.tts.monitor = self.echo
+        
+        # One continuously open input stream with voice-activity endpointing,
+        # shared by the main loop and the interruption listener; snapshots at
+        # pauses feed speculative generation and let commands act before endpointing
+        self.capture = AudioCapture(self.microphone, calibrator=self.calibrator, echo=self.echo,
+                                    early_endpoint=self.snapshot_endpoint(),
+                                    on_speech_start=lambda started_at: self.conversation.post("speech_started",
+                                                                                              started_at))
+    
+    def snapshot_endpoint(self):
+        """Pause that triggers a provisional snapshot, or None when nothing would use one"""
+        spotting = self.commands is not None and self.commands.active
+        return self.early_endpoint if self.speculative_generation or spotting else None
+    
+    def init_llm(self):
+        """Configure Gemini; the SDK is imported here because importing it is slow"""
+        model = self.llm
+        if model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+            # Use Gemini 2.0 Flash model
+            model = genai.GenerativeModel('gemini-1.5-flash')
+        # Put the model behind deadlines, retries, optional hedging and a
+        # circuit breaker that falls back to a local reply
+        self.model = ResilientModel(model, timeout=self.llm_timeout, hedge=self.llm_hedging,
+                                    fallback_reply=SERVICE_UNAVAILABLE_MESSAGE)
+    
+    def set_status(self, text):
+        """Show a status message in the GUI (or keep it when running headless)"""
+        self.status = text
+        if self.root is not None:
+            self.gui.call(self.status_label.config, text=text, key="status")
         
     def init_gui(self):
         """Initialize the graphical user interface"""
@@ -107,21 +345,27 @@ class SpeechBot:
         self.conversation_display = scrolledtext.ScrolledText(main_frame, wrap=tk.WORD, height=15, font=("Arial", 10))
         self.conversation_display.pack(fill=tk.BOTH, expand=True, pady=10)
         self.conversation_display.config(state=tk.DISABLED)
+        self.gui.attach(self.root, self.conversation_display)
         
         # Create status frame
         status_frame = ttk.Frame(main_frame)
         status_frame.pack(fill=tk.X, pady=5)
         
         # Status label
-        self.status_label = ttk.Label(status_frame, text="Ready", font=("Arial", 10))
+        self.status_label = ttk.Label(status_frame, text=self.status, font=("Arial", 10))
         self.status_label.pack(side=tk.LEFT)
         
+        # Latency percentiles (p50/p95) of the main pipeline stages
+        self.latency_label = ttk.Label(status_frame, text="", font=("Arial", 8))
+        self.latency_label.pack(side=tk.RIGHT)
+        
         # Create control frame
         control_frame = ttk.Frame(main_frame)
         control_frame.pack(fill=tk.X, pady=5)
         
-        # Start button
-        self.start_button = ttk.Button(control_frame, text="Start Conversation", command=self.start_conversation)
+        # Start button; enabled once startup has finished
+        self.start_button = ttk.Button(control_frame, text="Start Conversation", command=self.start_conversation,
+                                       state=tk.DISABLED)
         self.start_button.pack(side=tk.LEFT, padx=5)
         
         # Stop button
@@ -132,15 +376,11 @@ class SpeechBot:
         voice_frame = ttk.LabelFrame(main_frame, text="Voice Settings")
         voice_frame.pack(fill=tk.X, pady=5)
         
-        # Voice selection dropdown
-        voices = self.engine.getProperty('voices')
-        voice_names = [f"{voice.name} ({voice.id})" for voice in voices]
-        
+        # Voice selection dropdown; filled in once the speech engine is ready
         ttk.Label(voice_frame, text="Select Voice:").pack(side=tk.LEFT, padx=5)
         self.voice_var = tk.StringVar()
-        self.voice_var.set(voice_names[1] if len(voice_names) > 1 else voice_names[0])
-        voice_dropdown = ttk.Combobox(voice_frame, textvariable=self.voice_var, values=voice_names, state="readonly", width=30)
-        voice_dropdown.pack(side=tk.LEFT, padx=5)
+        self.voice_dropdown = ttk.Combobox(voice_frame, textvariable=self.voice_var, values=[], state="readonly", width=30)
+        self.voice_dropdown.pack(side=tk.LEFT, padx=5)
         
         # Rate slider
         ttk.Label(voice_frame, text="Speech Rate:").pack(side=tk.LEFT, padx=5)
@@ -152,460 +392,418 @@ class SpeechBot:
         apply_button = ttk.Button(voice_frame, text="Apply", command=self.apply_voice_settings)
         apply_button.pack(side=tk.LEFT, padx=5)
         
-        # Conversation thread
-        self.conversation_thread = None
-        self.running = False
+        # Refresh the latency summary once a second
+        self.refresh_latency()
         
-        # Update the GUI
-        self.update_gui()
+    def show_voices(self):
+        """Fill the voice settings from the engine's cached voice catalog"""
+        voice_names = [f"{voice.name} ({voice.id})" for voice in self.tts.voices]
+        current_voice = [name for voice, name in zip(self.tts.voices, voice_names) if voice.id == self.tts.voice_id]
+        self.voice_dropdown.config(values=voice_names)
+        self.voice_var.set(current_voice[0] if current_voice else (voice_names[0] if voice_names else ""))
+        self.rate_var.set(self.tts.rate)
         
-    def update_gui(self):
-        """Update the GUI periodically"""
-        try:
-            # Update the conversation display with any new messages
-            while not self.output_queue.empty():
-                message = self.output_queue.get_nowait()
-                self.conversation_display.config(state=tk.NORMAL)
-                self.conversation_display.insert(tk.END, message + "\n")
-                self.conversation_display.see(tk.END)
-                self.conversation_display.config(state=tk.DISABLED)
-        except queue.Empty:
-            pass
-        
-        # Schedule the next update
-        self.root.after(100, self.update_gui)
+    def on_ready(self):
+        """Enable the controls once background startup has finished (Tk thread)"""
+        self.show_voices()
+        self.start_button.config(state=tk.NORMAL)
+        
+    def refresh_latency(self):
+        """Show the latency summary; runs once a second on the Tk thread"""
+        self.latency_label.config(text=self.tracer.format_summary())
+        
+        # Also picks up updates posted before the main loop could be woken
+        self.gui.flush()
+        self.root.after(1000, self.refresh_latency)
         
     def start_conversation(self):
-        """Start the conversation thread"""
+        """Open the microphone and start taking turns"""
+        if not self.ready.is_set():
+            print("Still starting up")
+            return
         if not self.running:
             self.running = True
-            self.conversation_thread = threading.Thread(target=self.run)
-            self.conversation_thread.daemon = True
-            self.conversation_thread.start()
             
-            self.start_button.config(state=tk.DISABLED)
-            self.stop_button.config(state=tk.NORMAL)
-            self.status_label.config(text="Listening...")
+            # Open the microphone once for the whole conversation; commands
+            # enrolled since startup turn on snapshots at pauses
+            self.capture.early_endpoint = self.snapshot_endpoint()
+            self.capture.start()
+            
+            self.conversation.start()
+            if self.monitor is not None:
+                self.monitor.start()
+            print("Speech Bot is ready! Press Ctrl+C to exit.")
+            print("You can interrupt the bot at any time by speaking while it's responding.")
+            
+            if self.root is not None:
+                self.gui.call(self.start_button.config, state=tk.DISABLED, key="start_button")
+                self.gui.call(self.stop_button.config, state=tk.NORMAL, key="stop_button")
+            self.set_status("Listening...")
             
             # Add a message to the conversation display
-            self.output_queue.put("Bot: Hello! I'm ready to chat. You can interrupt me at any time by speaking.")
+            self.gui.put("Bot: Hello! I'm ready to chat. You can interrupt me at any time by speaking.")
             
     def stop_conversation(self):
-        """Stop the conversation thread"""
+        """Stop taking turns and release the microphone"""
         if self.running:
             self.running = False
-            self.should_stop = True
-            self.is_speaking = False
             
-            # Stop any ongoing speech
-            if self.speech_thread and self.speech_thread.is_alive():
-                self.stop_speech()
+            # Cancel any reply in progress and stop the conversation threads
+            self.conversation.stop()
+            
+            # Release the microphone
+            self.capture.stop()
+            self.capture.clear()
+            
+            # Persist cached replies and report how well the cache did
+            self.response_cache.flush()
+            print(f"Response cache: {self.response_cache.stats()}")
+            print(f"TTS audio cache: {self.audio_cache.stats()}")
+            print(f"Audio front end: {self.frontend.stats()}")
+            if self.store is not None:
+                print(f"Conversation store: {self.store.stats()}")
+            if self.echo is not None:
+                print(f"Echo suppression: {self.echo.stats()}")
+            if self.commands is not None and self.commands.active:
+                print(f"Command spotting: {self.commands.stats()}")
+            if self.speculative_generation:
+                print(f"Speculative generation: {self.conversation.speculation_stats.stats()}")
+            if self.monitor is not None:
+                self.monitor.stop()
+                print(f"Resources: {self.monitor.stats()}")
+            
+            # Show where the response time went
+            self.tracer.dump()
             
-            self.start_button.config(state=tk.NORMAL)
-            self.stop_button.config(state=tk.DISABLED)
-            self.status_label.config(text="Stopped")
+            if self.root is not None:
+                print(f"GUI updates: {self.gui.stats()}")
+                self.gui.call(self.start_button.config, state=tk.NORMAL, key="start_button")
+                self.gui.call(self.stop_button.config, state=tk.DISABLED, key="stop_button")
+            self.set_status("Stopped")
             
             # Add a message to the conversation display
-            self.output_queue.put("Bot: Conversation stopped.")
+            self.gui.put("Bot: Conversation stopped.")
             
     def apply_voice_settings(self):
         """Apply the selected voice settings"""
         try:
-            # Get the selected voice
-            voice_name = self.voice_var.get()
-            voice_id = voice_name.split("(")[1].strip(")")
+            # Get the selected voice by its position; names may contain parentheses themselves
+            index = self.voice_dropdown.current()
+            if index < 0 or index >= len(self.tts.voices):
+                self.gui.put("Bot: Select a voice first.")
+                return
+            voice_id = self.tts.voices[index].id
             
-            # Set the voice
-            self.engine.setProperty('voice', voice_id)
-            
-            # Set the rate
-            self.engine.setProperty('rate', self.rate_var.get())
+            # Hand the voice and rate to the engine service; it applies them once
+            self.tts.apply_settings(voice_id=voice_id, rate=self.rate_var.get())
             
             # Test the voice
-            self.output_queue.put("Bot: Testing new voice settings...")
-            self.speak("Testing new voice settings.")
+            self.gui.put("Bot: Testing new voice settings...")
+            self.tts.say(VOICE_TEST_MESSAGE)
             
-            self.output_queue.put("Bot: Voice settings applied.")
+            self.gui.put("Bot: Voice settings applied.")
         except Exception as e:
-            self.output_queue.put(f"Bot: Error applying voice settings: {e}")
+            self.gui.put(f"Bot: Error applying voice settings: {e}")
         
-    def init_tts_engine(self):
-        """Initialize or reinitialize the text-to-speech engine"""
+    def init_tts_engine(self, warm_up=True):
+        """Attach to the long-lived text-to-speech engine service"""
         try:
-            # If engine exists, stop it first
-            if self.engine:
-                try:
-                    self.engine.stop()
-                except:
-                    pass
+            # If we already hold a service, stop anything it is saying first
+            if self.tts:
+                self.tts.stop()
             
-            # Create a new engine instance
-            self.engine = pyttsx3.init()
+            # The service owns one warm engine per output driver
+            self.tts = get_tts_service(audio_cache=self.audio_cache, buffered=self.buffered_playback,
+                                       block_seconds=self.playback_block_seconds)
+            self.tts.wait_ready()
+            if self.tts.init_error:
+                raise self.tts.init_error
             
-            # Set voice (default to the first voice)
-            voices = self.engine.getProperty('voices')
-            if voices:
-                # You can change the index to select a different voice
-                # 0 is usually a male voice, 1 is usually a female voice
-                self.engine.setProperty('voice', voices[1].id)  # Change to index 1 for female voice
-                print(f"Using voice: {voices[1].name}")
+            # Render the fixed phrases in the background so they play back instantly
+            self.tts.prerender(CACHED_PHRASES)
             
-            # Set speech rate
-            self.engine.setProperty('rate', 150)  # Speed of speech
+            for voice in self.tts.voices:
+                if voice.id == self.tts.voice_id:
+                    print(f"Using voice: {voice.name}")
             
-            # Test the engine with a simple phrase
-            test_text = "Testing voice engine"
-            self.engine.say(test_text)
-            self.engine.runAndWait()
+            # Warm up silently in the background instead of speaking a test phrase
+            if warm_up:
+                self.tts.warm_up()
             
             return True
             
         except Exception as e:
             print(f"Error initializing TTS engine: {e}")
-            self.engine = None
             return False
         
-    def listen(self, interrupt_mode=False):
-        """Listen to user input and convert speech to text"""
-        # Create a new microphone instance for each listen call
-        mic = sr.Microphone(device_index=self.microphone.device_index)
+    def listen(self, timeout=5):
+        """Wait for the next utterance and convert it to text
         
-        with mic as source:
-            if interrupt_mode:
-                print("Listening for interruption...")
-                self.status_label.config(text="Listening for interruption...")
-            else:
-                print("Listening...")
-                self.status_label.config(text="Listening...")
-            try:
-                print("Adjusting for ambient noise...")
-                self.recognizer.adjust_for_ambient_noise(source, duration=1)
-                print("Ready to capture audio...")
-                audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=10)
-                print("Audio captured, converting to text...")
-                text = self.recognizer.recognize_google(audio)
-                print(f"You said: {text}")
-                self.output_queue.put(f"You: {text}")
-                return text
-            except sr.WaitTimeoutError:
-                print("Timeout waiting for audio input")
+        Utterances come from the shared capture stream, so nothing is lost
+        between calls and no time is spent reopening the microphone. Returns
+        a Transcript, or None on timeout or when nothing was understood.
+        Enrolled voice commands are spotted without calling the recognizer.
+        """
+        try:
+            utterance = self.capture.get_utterance(timeout=timeout)
+            if utterance is None:
                 return None
-            except sr.UnknownValueError:
-                print("Could not understand audio")
+            
+            # Speech heard while the bot was talking may be its own voice
+            overlaps_playback = self.echo is not None and self.echo.overlaps(utterance.speech_started_at,
+                                                                             utterance.speech_ended_at)
+            
+            # A short command is acted on without going to the recognizer, at
+            # the first pause; the final utterance of a spotted command is dropped.
+            # The spotter resamples and trims the captured audio itself
+            spotted, self._spotted = self._spotted, None
+            command = self.spot_command(utterance.audio)
+            if command is not None and utterance.provisional:
+                self._spotted = (utterance.speech_started_at, command)
+            elif command is not None and spotted == (utterance.speech_started_at, command):
                 return None
-            except sr.RequestError as e:
-                print(f"Could not request results; {e}")
+            
+            if command is not None:
+                turn_id = self.tracer.new_turn()
+                print(f"Command spotted: {command}")
+                self.gui.put(f"You: {command}")
+                return Transcript(command, turn_id, utterance.speech_started_at, utterance.speech_ended_at,
+                                  command=command)
+            
+            if utterance.provisional and not self.speculative_generation:
                 return None
-            except Exception as e:
-                print(f"Unexpected error in listen(): {e}")
+            
+            # Only audio that is sent to the recognizer goes through the front end
+            audio = self.frontend.prepare(utterance.audio, self.recognizer.energy_threshold)
+            
+            if utterance.provisional:
+                # Interim transcript for speculative generation; the final one follows
+                with self.tracer.span(None, "stt_interim"):
+                    text = self.recognizer.recognize_google(audio)
+                print(f"Interim transcript: {text}")
+                return Transcript(text, None, utterance.speech_started_at, utterance.speech_ended_at,
+                                  provisional=True)
+            
+            if overlaps_playback:
+                self.echo.record_forwarded()
+            
+            # Every utterance starts a new traced turn
+            turn_id = self.tracer.new_turn()
+            self.tracer.record_between(turn_id, "end_of_speech", utterance.speech_ended_at, utterance.ended_at)
+            
+            print("Audio captured, converting to text...")
+            with self.tracer.span(turn_id, "stt"):
+                text = self.recognizer.recognize_google(audio)
+            # A voice command is never dropped as echo, even when the bot just said the same words
+            command = match_command(text, self.voice_commands)
+            if command is None and overlaps_playback and self.echo.is_echo_text(text):
+                print(f"Ignoring the bot's own voice: {text}")
                 return None
+            print(f"You said: {text}")
+            self.gui.put(f"You: {text}")
+            return Transcript(text, turn_id, utterance.speech_started_at, utterance.speech_ended_at,
+                              command=command)
+        except sr.UnknownValueError:
+            print("Could not understand audio")
+            return None
+        except sr.RequestError as e:
+            print(f"Could not request results; {e}")
+            return None
+        except Exception as e:
+            print(f"Unexpected error in listen(): {e}")
+            return None
 
-    def get_llm_response(self, user_input):
-        """Get response from Gemini"""
+    def spot_command(self, audio):
+        """The voice command an utterance's audio consists of, spotted on the device, or None"""
+        if self.commands is None or not self.commands.active:
+            return None
+        with self.tracer.span(None, "command_spotting"):
+            return self.commands.spot(audio)
+    
+    def get_llm_response(self, user_input, on_sentence=None, generation=None, speculative=False):
+        """Get response from Gemini
+        
+        When on_sentence is given the reply is streamed: every complete sentence
+        is passed to on_sentence as soon as it arrives. Either way the caller
+        records the reply in the history once it knows how much of it was
+        actually spoken. generation is the request's Generation if the caller already
+        started one; cancelling it abandons the request. A speculative request
+        answers an interim transcript and leaves recording the user's turn to
+        the caller as well.
+        
+        Returns None when a newer request cancelled this one; such a reply must
+        not be spoken or recorded.
+        """
+        # Starting a new generation cancels any request still in flight
+        if generation is None:
+            generation = self.generations.begin()
+            generation.turn_id = self.turn_id
         try:
-            print(f"Sending to Gemini: {user_input}")
-            self.status_label.config(text="Getting response from AI...")
+            print(f"Sending to Gemini{' (speculative)' if speculative else ''}: {user_input}")
+            if not speculative:
+                self.set_status("Getting response from AI...")
+            
+            # The cache key covers the history that precedes this request
+            cache_key = self.response_cache.make_key(user_input, self.conversation_history)
             
-            # Add user input to conversation history
-            self.conversation_history.append({"role": "user", "content": user_input})
+            # Add user input to conversation history and build the budgeted prompt
+            if speculative:
+                prompt = self.prompt_builder.build(pending_user=user_input)
+            else:
+                self.prompt_builder.add("user", user_input, latency=self.tracer.turn_stages(generation.turn_id))
+                prompt = self.prompt_builder.build()
+            
+            # Answer repeated requests from the cache without a round trip
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                print(f"Cached response: {cached}")
+                self.tracer.record_between(generation.turn_id, "llm_total", generation.started_at,
+                                           time.perf_counter(), cached=True)
+                if on_sentence is not None:
+                    segmenter = SentenceSegmenter()
+                    for sentence in segmenter.feed(cached) + segmenter.flush():
+                        on_sentence(sentence)
+                return cached
+            
+            if on_sentence is not None:
+                return self._stream_llm_response(prompt, on_sentence, cache_key, generation)
             
-            # Create a prompt that includes conversation history
-            prompt = "You are a helpful AI assistant. Keep your responses concise and natural.\n\n"
-            for item in self.conversation_history[-5:]:  # Include last 5 exchanges
-                if item["role"] == "user":
-                    prompt += f"User: {item['content']}\n"
-                else:
-                    prompt += f"Assistant: {item['content']}\n"
+            # Run the call on the LLM worker pool so a newer request can abandon it
+            response = self.generations.run(generation, self.model.generate_content, prompt)
             
-            prompt += f"User: {user_input}\nAssistant:"
+            # Without streaming the first token arrives with the whole reply
+            replied_at = time.perf_counter()
+            self.tracer.record_between(generation.turn_id, "llm_first_token", generation.started_at, replied_at)
+            self.tracer.record_between(generation.turn_id, "llm_total", generation.started_at, replied_at)
             
-            response = self.model.generate_content(prompt)
+            # A reply that arrives after a newer request started is thrown away
+            if not self.generations.is_current(generation):
+                self.generations.discard(generation)
+                return None
+            
+            # Local fallback replies (circuit breaker open) are never cached
+            cacheable = not getattr(response, 'local', False)
             
             # Handle the response properly
             if response and hasattr(response, 'parts'):
                 result = response.parts[0].text.strip()
                 print(f"Gemini response: {result}")
-                # Add assistant response to conversation history
-                self.conversation_history.append({"role": "assistant", "content": result})
+                if cacheable:
+                    self.response_cache.put(cache_key, result)
                 return result
             elif response and hasattr(response, 'text'):
                 result = response.text.strip()
                 print(f"Gemini response: {result}")
-                # Add assistant response to conversation history
-                self.conversation_history.append({"role": "assistant", "content": result})
+                if cacheable:
+                    self.response_cache.put(cache_key, result)
                 return result
             else:
-                error_msg = "I apologize, but I couldn't generate a proper response."
                 print("No valid response from Gemini")
-                self.conversation_history.append({"role": "assistant", "content": error_msg})
-                return error_msg
+                return NO_RESPONSE_MESSAGE
+        except GenerationCancelled:
+            print(f"Generation {generation.id} cancelled")
+            return None
         except Exception as e:
             print(f"Error getting Gemini response: {e}")
-            error_msg = "I apologize, but I'm having trouble processing your request."
-            self.conversation_history.append({"role": "assistant", "content": error_msg})
+            error_msg = REQUEST_ERROR_MESSAGE
+            if not self.generations.is_current(generation):
+                return None
+            if on_sentence is not None:
+                on_sentence(error_msg)
             return error_msg
+        finally:
+            self.generations.finish(generation)
 
-    def speak(self, text):
-        """Convert text to speech"""
-        with self.speech_lock:
-            try:
-                print(f"Speaking: {text}")
-                self.is_speaking = True
-                self.should_stop = False
-                self.status_label.config(text="Speaking...")
-                
-                # Create a new event for signaling when speech should stop
-                self.stop_event = threading.Event()
-                
-                # Start a thread to listen for interruptions while speaking
-                interrupt_thread = threading.Thread(target=self.listen_for_interruptions)
-                interrupt_thread.daemon = True
-                interrupt_thread.start()
-                
-                # Create a new engine instance for each speech
-                try:
-                    # Create a new engine instance
-                    engine = pyttsx3.init()
-                    
-                    # Store the engine reference so it can be stopped
-                    self.current_engine = engine
-                    
-                    # Set voice
-                    voices = engine.getProperty('voices')
-                    if voices:
-                        engine.setProperty('voice', voices[1].id)  # Use female voice
-                    
-                    # Set speech rate
-                    engine.setProperty('rate', 150)
-                    
-                    # Split text into smaller chunks for better interruption handling
-                    sentences = [s.strip() for s in text.split('.') if s.strip()]
-                    
-                    # If no sentences were found, just use the original text
-                    if not sentences:
-                        sentences = [text]
-                    
-                    # Speak each sentence, checking for interruption between sentences
-                    for sentence in sentences:
-                        if self.should_stop or self.stop_event.is_set():
-                            print("Speech interrupted between sentences")
-                            break
-                            
-                        # Speak the sentence
-                        engine.say(sentence + '.')
-                        engine.runAndWait()
-                    
-                except Exception as e:
-                    print(f"Error in speech engine: {e}")
-                    # Try one more time with a new engine
-                    try:
-                        engine = pyttsx3.init()
-                        engine.say(text)
-                        engine.runAndWait()
-                    except:
-                        print("Failed to speak after retry")
-                finally:
-                    # Clean up engine reference
-                    self.current_engine = None
-                
-                # Stop the interruption thread
-                self.should_stop = True
-                self.stop_event.set()
-                self.is_speaking = False
-                
-                print("Ready for next input...")
-                self.status_label.config(text="Ready")
-            except Exception as e:
-                print(f"Error in speak(): {e}")
-                self.is_speaking = False
-                self.should_stop = True
-                if hasattr(self, 'stop_event'):
-                    self.stop_event.set()
-                self.status_label.config(text="Error")
-    
-    def stop_speech(self):
-        """Stop the current speech"""
+    def _stream_llm_response(self, prompt, on_sentence, cache_key=None, generation=None):
+        """Stream a reply from Gemini, forwarding each complete sentence as it arrives"""
+        segmenter = SentenceSegmenter()
+        parts = []
+        
+        interrupted = False
+        cacheable = True
+        
+        def forward(sentence):
+            # Sentences of a superseded generation are never spoken
+            if self.generations.is_current(generation):
+                on_sentence(sentence)
+        
         try:
-            print("Attempting to stop speech")
-            
-            # Set flags to stop speech
-            self.should_stop = True
-            if hasattr(self, 'stop_event'):
-                self.stop_event.set()
-            
-            # If we have a reference to the current engine, try to stop it
-            if hasattr(self, 'current_engine') and self.current_engine:
+            chunks = self.generations.stream(generation, self.model.generate_content, prompt, stream=True)
+            for chunk in chunks:
+                if not parts:
+                    self.tracer.record_between(generation.turn_id, "llm_first_token", generation.started_at,
+                                               time.perf_counter())
+                if getattr(chunk, 'local', False):
+                    cacheable = False
                 try:
-                    # This is a workaround since pyttsx3 doesn't have a direct stop method
-                    # We'll disconnect the engine from its driver to force it to stop
-                    self.current_engine.disconnect()
-                    print("Disconnected speech engine")
-                except:
-                    print("Failed to disconnect speech engine")
-                    
-            # If we have a speech thread, try to terminate it
-            if hasattr(self, 'speech_thread') and self.speech_thread and self.speech_thread.is_alive():
-                # Get the thread ID
-                thread_id = self.speech_thread.ident
-                
-                # Raise an exception in the thread
-                if sys.platform == 'win32':
-                    # Windows-specific code to terminate the thread
-                    import ctypes
-                    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_long(thread_id), ctypes.py_object(SystemExit))
-                    print("Sent termination signal to speech thread")
-                
-                # Wait briefly for thread to terminate
-                self.speech_thread.join(timeout=0.5)
-                
-            print("Speech stopped")
-        except Exception as e:
-            print(f"Error stopping speech: {e}")
-
-    def listen_for_interruptions(self):
-        """Listen for user interruptions while the bot is speaking"""
-        try:
-            # Continue until speech is done or interrupted
-            while self.is_speaking and not self.should_stop and self.running:
-                # Check if stop event is set
-                if hasattr(self, 'stop_event') and self.stop_event.is_set():
-                    break
-                    
-                # Listen for interruption
-                interruption = self.listen(interrupt_mode=True)
-                if interruption:
-                    print(f"Interruption detected: {interruption}")
-                    self.output_queue.put(f"Interruption: {interruption}")
-                    
-                    # Set flags to stop the current speech
-                    self.should_stop = True
-                    if hasattr(self, 'stop_event'):
-                        self.stop_event.set()
-                    
-                    # Stop the current speech
-                    self.stop_speech()
-                    
-                    # Wait a moment to ensure the previous speech is fully stopped
-                    time.sleep(0.3)
-                    
-                    # Process the interruption
-                    with self.speech_lock:
-                        try:
-                            # Get response to the interruption
-                            response = self.get_llm_response(interruption)
-                            
-                            # Reset flags
-                            self.is_speaking = False
-                            
-                            # Speak the response to the interruption
-                            if response:
-                                print(f"Speaking interruption response: {response}")
-                                self.output_queue.put(f"Bot: {response}")
-                                
-                                # Create a separate engine for interruption response
-                                try:
-                                    # Create a new engine instance for the response
-                                    engine = pyttsx3.init()
-                                    voices = engine.getProperty('voices')
-                                    if voices:
-                                        engine.setProperty('voice', voices[1].id)
-                                    engine.setProperty('rate', 150)
-                                    engine.say(response)
-                                    engine.runAndWait()
-                                except Exception as e:
-                                    print(f"Error speaking interruption response: {e}")
-                                    # Try one more time
-                                    try:
-                                        engine = pyttsx3.init()
-                                        engine.say(response)
-                                        engine.runAndWait()
-                                    except:
-                                        print("Failed to speak interruption response after retry")
-                        except Exception as e:
-                            print(f"Error handling interruption: {e}")
-                    break
-            
-        except Exception as e:
-            print(f"Error in interruption handling: {e}")
-            time.sleep(0.1)
-        finally:
-            print("Interruption listener thread ending")
-
-    def run(self):
-        """Main conversation loop"""
-        print("Speech Bot is ready! Press Ctrl+C to exit.")
-        print("You can interrupt the bot at any time by speaking while it's responding.")
-        
-        while self.running:
-            try:
-                # Listen for user input
-                user_input = self.listen()
-                if not user_input:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. safety metadata) carry nothing to speak
                     continue
+                parts.append(text)
+                for sentence in segmenter.feed(text):
+                    forward(sentence)
+            else:
+                for sentence in segmenter.flush():
+                    forward(sentence)
+        except GenerationCancelled:
+            print(f"Generation {generation.id} cancelled mid-stream")
+            interrupted = True
+        
+        if interrupted and generation is not None:
+            # Stop the producer from pulling further chunks
+            generation.cancel()
+        else:
+            self.tracer.record_between(generation.turn_id, "llm_total", generation.started_at, time.perf_counter())
+        
+        result = "".join(parts).strip()
+        if not result and not interrupted:
+            result = NO_RESPONSE_MESSAGE
+            print("No valid response from Gemini")
+            on_sentence(result)
+        else:
+            print(f"Gemini response: {result}")
+            # Only complete replies are worth caching
+            if cache_key is not None and cacheable and not interrupted:
+                self.response_cache.put(cache_key, result)
+        return result
 
-                # Get response from Gemini
-                response = self.get_llm_response(user_input)
-                
-                # Ensure we have a valid response
-                if response:
-                    # Always speak the response
-                    try:
-                        print(f"Speaking response: {response}")
-                        self.output_queue.put(f"Bot: {response}")
-                        # Create a new engine instance for the response
-                        engine = pyttsx3.init()
-                        voices = engine.getProperty('voices')
-                        if voices:
-                            engine.setProperty('voice', voices[1].id)
-                        engine.setProperty('rate', 150)
-                        engine.say(response)
-                        engine.runAndWait()
-                    except Exception as e:
-                        print(f"Error speaking response: {e}")
-                        # Try one more time
-                        try:
-                            engine = pyttsx3.init()
-                            engine.say(response)
-                            engine.runAndWait()
-                        except:
-                            print("Failed to speak response after retry")
-                else:
-                    # If no response, speak a fallback message
-                    try:
-                        print("Speaking fallback message")
-                        self.output_queue.put("Bot: I apologize, but I couldn't generate a response. Could you please try again?")
-                        engine = pyttsx3.init()
-                        engine.say("I apologize, but I couldn't generate a response. Could you please try again?")
-                        engine.runAndWait()
-                    except:
-                        print("Failed to speak fallback message")
-                
-                # Reset flags
-                self.should_stop = False
-                self.is_speaking = False
-                
-                # Add a small delay before listening again
-                time.sleep(0.5)
-                
-            except KeyboardInterrupt:
-                print("\nGoodbye!")
-                self.running = False
-                break
-            except Exception as e:
-                print(f"An error occurred: {e}")
-                # Try to speak the error message
-                try:
-                    engine = pyttsx3.init()
-                    engine.say("I encountered an error. Please try again.")
-                    engine.runAndWait()
-                except:
-                    print("Failed to speak error message")
-                continue
+    def _record_playback(self, turn_id, speech_ended_at, job):
+        """Trace when the first audio of a reply started playing"""
+        self.tracer.record_between(turn_id, "tts_first_audio", job.queued_at, job.started_at)
+        self.tracer.record_between(turn_id, "response_latency", speech_ended_at, job.started_at)
+
+    def stop_speech(self):
+        """Stop the current reply; the conversation keeps listening"""
+        self.conversation.interrupt()
 
     def start(self):
-        """Start the GUI main loop"""
-        self.root.mainloop()
+        """Start the GUI main loop (or, headless, converse until interrupted)"""
+        if self.root is not None:
+            self.root.mainloop()
+            return
+        
+        self.start_conversation()
+        if not self.running:
+            print(f"Could not start: {self.init_error}")
+            return
+        try:
+            # Short waits keep Ctrl+C responsive
+            while not self.conversation.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            print("\nGoodbye!")
+        finally:
+            self.stop_conversation()
 
 if __name__ == "__main__":
-    bot = SpeechBot()
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        # Headless multi-session server instead of the desktop app
+        from server import main
+        sys.exit(main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        # Transcribe and answer recorded utterances instead of listening live
+        from batch import main
+        sys.exit(main(sys.argv[2:]))
+    bot = SpeechBot(resume_session="--resume" in sys.argv[1:], trace_allocations="--trace-allocations" in sys.argv[1:])
     bot.start() 
\ No newline at end of file
@@ -0,0 +1,103 @@
+import re
+
+# A sentence ends at terminal punctuation followed by whitespace, or at a line break
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+|\n+')
+
+# Clause boundaries used to split sentences that grow too long
+CLAUSE_END = re.compile(r'[,;:]\s+')
+
+# Words whose trailing period does not end a sentence
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "mt", "ft", "vs", "etc", "approx", "fig",
+    "e.g", "i.e", "a.m", "p.m", "u.s", "u.k", "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep",
+    "sept", "oct", "nov", "dec", "inc", "ltd", "co", "corp",
+}
+
+# Words that are abbreviations only before a number ("No. 5"), and ordinary words otherwise ("The answer is no.")
+NUMBER_ABBREVIATIONS = {"no"}
+
+# The word (including inner periods) right before a sentence end candidate
+_LAST_WORD = re.compile(r'([\w.]+)\.$')
+
+
+def _is_abbreviation(text, following=""):
+    """True when text ends in an abbreviation or an initial such as 'J.'
+
+    following is the text after the period and its whitespace; for words
+    in NUMBER_ABBREVIATIONS the answer depends on it, and is None while
+    none of it has arrived. A lone "I" is the pronoun, not an initial.
+    """
+    match = _LAST_WORD.search(text)
+    if not match:
+        return False
+    word = match.group(1).lower()
+    if word in NUMBER_ABBREVIATIONS:
+        return following[:1].isdigit() if following else None
+    return word in ABBREVIATIONS or (len(word) == 1 and word.isalpha() and word != "i")
+
+
+class SentenceSegmenter:
+    """Incrementally split streamed text into speakable sentences
+
+    Text arrives in arbitrary chunks; feed() returns every sentence that is
+    complete so far and keeps the unfinished tail for the next call. Periods
+    of abbreviations, initials and decimals do not end a sentence, and a
+    sentence longer than max_chars is cut at its last clause boundary, or at
+    the last space when it has none.
+    """
+
+    def __init__(self, max_chars=200):
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """Add streamed text and return the sentences completed by it"""
+        self._buffer += text
+        sentences = []
+
+        while True:
+            end = self._sentence_end()
+            if end is not None:
+                sentence = self._buffer[:end].strip()
+                self._buffer = self._buffer[end:]
+                if sentence:
+                    sentences.append(sentence)
+                continue
+
+            # No sentence end yet; break an overlong run at a clause boundary or a space
+            if len(self._buffer) > self.max_chars:
+                cut = self._overlong_cut()
+                if cut:
+                    sentences.append(self._buffer[:cut].strip())
+                    self._buffer = self._buffer[cut:]
+                    continue
+            break
+
+        return sentences
+
+    def flush(self):
+        """Return whatever text is left once the stream has ended"""
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        return [remainder] if remainder else []
+
+    def _sentence_end(self):
+        """Offset just past the first real sentence end in the buffer, or None"""
+        for match in SENTENCE_END.finditer(self._buffer):
+            if match.group().startswith("."):
+                abbreviation = _is_abbreviation(self._buffer[:match.start() + 1], self._buffer[match.end():])
+                if abbreviation is None:
+                    # Whether this period ends the sentence depends on text not streamed yet
+                    return None
+                if abbreviation:
+                    continue
+            return match.end()
+        return None
+
+    def _overlong_cut(self):
+        """Where to cut an overlong run: the last clause boundary, else the last space"""
+        clauses = list(CLAUSE_END.finditer(self._buffer, 0, self.max_chars + 1))
+        if clauses:
+            return clauses[-1].end()
+        space = self._buffer.rfind(" ", 0, self.max_chars + 1)
+        return space + 1 if space > 0 else None
@@ -0,0 +1,622 @@
+import audioop
+import collections
+import io
+import os
+import tempfile
+import threading
+import queue
+import time
+import wave
+import pyttsx3
+from audio_playback import play_wav_file
+
+
+def is_wav(audio):
+    """True when audio (bytes) is a WAV file the player can open
+
+    Some drivers' save_to_file writes another format (nsss on macOS writes AIFF).
+    """
+    try:
+        with wave.open(io.BytesIO(audio), "rb") as wav:
+            return wav.getframerate() > 0
+    except (wave.Error, EOFError):
+        return False
+
+
+class SpeechJob:
+    """Handle for a single utterance queued on a TTS engine service"""
+
+    def __init__(self, text):
+        self.text = text
+        self.done = threading.Event()
+        self.cancelled = False
+        self.error = None
+        self.queued_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+        # When playback fell silent before the end (paused or stopped)
+        self.silenced_at = None
+        # Characters of text heard so far, tracked per word while speaking
+        self.heard_chars = 0
+        # WAV bytes of a synthesize() job
+        self.audio = None
+        self.voice_id = None
+        self.rate = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """Mark the job so the worker skips it if it has not started yet"""
+        self.cancelled = True
+
+    def heard_text(self):
+        """The part of the text that was played, up to the end of the word being spoken"""
+        if self.started_at is None:
+            return ""
+        if self.heard_chars >= len(self.text) or (self.finished_at is not None and self.silenced_at is None):
+            return self.text
+        end = self.text.find(" ", self.heard_chars)
+        return (self.text if end < 0 else self.text[:end]).strip()
+
+    def wait(self, timeout=None):
+        """Block until the job has been spoken, skipped or failed"""
+        return self.done.wait(timeout)
+
+    def add_done_callback(self, callback):
+        """Call callback(job) once the job is done (immediately if it already is)"""
+        with self._lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def finish(self):
+        """Mark the job done and run its callbacks"""
+        with self._lock:
+            if self.done.is_set():
+                return
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"Error in speech job callback: {e}")
+
+
+class TTSEngineService:
+    """Long-lived pyttsx3 engine owned by a dedicated worker thread
+
+    All engine calls happen on the worker thread; other threads talk to it
+    through a command queue so the engine is created, warmed up and
+    configured exactly once instead of on every utterance.
+
+    With buffered playback the worker renders each utterance to WAV in
+    memory and a separate playback thread plays it, so the next sentence is
+    synthesized while the current one is heard and there is no synthesis gap
+    between them. player(wav_file, should_stop, block_seconds, is_paused)
+    plays one buffer and defaults to play_wav_file; stop() and pause()
+    silence it within block_seconds.
+
+    Every job tracks how much of its text was heard: from the engine's word
+    callbacks when it speaks directly, and from the share of the audio
+    played when it plays rendered audio.
+
+    A monitor, such as an EchoSuppressor, can be attached to learn what is
+    being played: playback_started(text) and playback_stopped() bracket
+    every utterance, and playback_audio(energy) reports each block of
+    rendered audio as it is written.
+    """
+
+    def __init__(self, driver_name=None, voice_index=1, rate=150, audio_cache=None, engine_factory=None,
+                 buffered=False, player=None, prefetch=1, block_seconds=0.02):
+        self.driver_name = driver_name
+        # Callable taking the driver name and returning a pyttsx3-style engine
+        self.engine_factory = engine_factory or pyttsx3.init
+        self.voice_index = voice_index
+        self.rate = rate
+        self.volume = 1.0
+        self.voice_id = None
+
+        # Cached voice catalog, filled in once by the worker thread
+        self.voices = []
+
+        # Commands for the worker thread
+        self._commands = queue.Queue()
+
+        # Signalled once the engine exists and the voice catalog is cached
+        self.ready = threading.Event()
+        self.init_error = None
+
+        # Settings that still have to be pushed to the engine
+        self._pending_settings = None
+        self._settings_lock = threading.Lock()
+
+        # Rendered audio for repeated phrases, played back without synthesis
+        self.audio_cache = audio_cache
+        self._known_phrases = []
+        self._renders = collections.deque()
+
+        self._engine = None
+        self._current_job = None
+        self._running = True
+
+        # Rendered utterances waiting for the playback thread; bounded so the
+        # worker renders at most prefetch utterances ahead of the speaker
+        self.buffered = buffered
+        self.player = player or play_wav_file
+        self.block_seconds = block_seconds
+        # Cleared while playback is paused, e.g. because the user started talking
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._playback = queue.Queue(maxsize=prefetch)
+        self._playing_job = None
+        self._player_thread = None
+
+        # Told what is being played, e.g. for echo suppression
+        self.monitor = None
+
+        self._thread = threading.Thread(target=self._run, name=f"tts-{driver_name or 'default'}")
+        self._thread.daemon = True
+        self._thread.start()
+
+        if buffered:
+            self._player_thread = threading.Thread(target=self._play, name=f"tts-playback-{driver_name or 'default'}")
+            self._player_thread.daemon = True
+            self._player_thread.start()
+
+    def wait_ready(self, timeout=None):
+        """Wait for the engine and the voice catalog to be available"""
+        return self.ready.wait(timeout)
+
+    def say(self, text):
+        """Queue text to be spoken and return its SpeechJob"""
+        job = SpeechJob(text)
+        self._commands.put(("say", job))
+        return job
+
+    def speak(self, text, timeout=None):
+        """Speak text and block until it has finished"""
+        job = self.say(text)
+        job.wait(timeout)
+        return job
+
+    def synthesize(self, text, voice_id=None, rate=None):
+        """Queue text to be rendered to WAV instead of played; the job's audio holds the bytes
+
+        voice_id and rate override the engine settings for this job only.
+        """
+        job = SpeechJob(text)
+        job.voice_id = voice_id
+        job.rate = rate
+        self._commands.put(("synth", job))
+        return job
+
+    def apply_settings(self, voice_id=None, rate=None, volume=None):
+        """Record new voice settings; they are applied once before the next utterance"""
+        with self._settings_lock:
+            voice_id = voice_id if voice_id is not None else self.voice_id
+            rate = rate if rate is not None else self.rate
+            volume = volume if volume is not None else self.volume
+            self._pending_settings = (voice_id, int(rate), min(1.0, max(0.0, float(volume))))
+        self._commands.put(("settings", None))
+
+    def prerender(self, phrases):
+        """Render known phrases into the audio cache while the engine is idle
+
+        The phrases are remembered and rendered again whenever the voice or
+        rate changes, since cached audio is keyed on both.
+        """
+        if self.audio_cache is None:
+            return
+        for phrase in phrases:
+            if phrase not in self._known_phrases:
+                self._known_phrases.append(phrase)
+        self._renders.extend(phrases)
+        # Wake the worker; renders run only when no speech is waiting
+        self._commands.put(("render", None))
+
+    def warm_up(self):
+        """Exercise the audio path silently in the background"""
+        self._commands.put(("warmup", None))
+
+    def stop(self):
+        """Drop queued utterances and stop the one currently playing"""
+        kept = []
+        while True:
+            try:
+                command, job = self._commands.get_nowait()
+            except queue.Empty:
+                break
+            if command == "say":
+                job.cancel()
+                job.finish()
+            else:
+                # Keep non-speech commands such as pending settings
+                kept.append((command, job))
+        for item in kept:
+            self._commands.put(item)
+
+        # Drop rendered audio that has not started playing
+        while True:
+            try:
+                job = self._playback.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job.cancel()
+                job.finish()
+
+        current = self._current_job
+        if current:
+            current.cancel()
+            try:
+                self._engine.stop()
+            except Exception as e:
+                print(f"Error stopping TTS engine: {e}")
+
+        # The player checks the flag between audio blocks
+        playing = self._playing_job
+        if playing:
+            playing.cancel()
+        self._resumed.set()
+
+    def pause(self):
+        """Hold buffered playback within one audio block; resume() or stop() ends the pause"""
+        if self.buffered:
+            self._resumed.clear()
+
+    def resume(self):
+        """Continue buffered playback where pause() held it"""
+        self._resumed.set()
+
+    @property
+    def paused(self):
+        return not self._resumed.is_set()
+
+    def shutdown(self):
+        """Stop the worker and playback threads"""
+        self.stop()
+        self._running = False
+        self._commands.put(("shutdown", None))
+        self._thread.join(timeout=2)
+        if self._player_thread is not None:
+            try:
+                self._playback.put_nowait(None)
+            except queue.Full:
+                pass
+            self._player_thread.join(timeout=2)
+
+    def is_busy(self):
+        """Return True while an utterance is playing or waiting in the queue"""
+        if self._current_job is not None or self._playing_job is not None or not self._playback.empty():
+            return True
+        return any(command == "say" for command, _ in list(self._commands.queue))
+
+    def _create_engine(self):
+        """Create the engine and cache its voice catalog"""
+        self._engine = self.engine_factory(self.driver_name)
+        self.voices = list(self._engine.getProperty('voices') or [])
+
+        if self.voice_id is None and self.voices:
+            # 0 is usually a male voice, 1 is usually a female voice
+            index = self.voice_index if self.voice_index < len(self.voices) else 0
+            self.voice_id = self.voices[index].id
+
+        if self.voice_id is not None:
+            self._engine.setProperty('voice', self.voice_id)
+        self._engine.setProperty('rate', self.rate)
+
+        # Word boundaries tell how much of an utterance was heard when it is stopped
+        try:
+            self._engine.connect('started-word', self._on_word)
+        except Exception as e:
+            print(f"Word callbacks unavailable: {e}")
+
+    def _on_word(self, name, location, length):
+        """Engine callback at the start of each spoken word"""
+        job = self._current_job
+        if job is not None and job.started_at is not None:
+            job.heard_chars = max(job.heard_chars, location + length)
+
+    def _apply_pending_settings(self):
+        """Push settings recorded by apply_settings to the engine"""
+        with self._settings_lock:
+            settings = self._pending_settings
+            self._pending_settings = None
+        if not settings:
+            return
+
+        voice_id, rate, volume = settings
+        if volume != self.volume:
+            self._engine.setProperty('volume', volume)
+            self.volume = volume
+        changed = False
+        if voice_id is not None and voice_id != self.voice_id:
+            self._engine.setProperty('voice', voice_id)
+            self.voice_id = voice_id
+            changed = True
+        if rate != self.rate:
+            self._engine.setProperty('rate', rate)
+            self.rate = rate
+            changed = True
+
+        # Cached audio of the old voice no longer matches; render the new one
+        if changed and self._known_phrases:
+            self._renders.extend(self._known_phrases)
+
+    def _speak_job(self, job):
+        """Speak a job on the worker thread, recreating the engine once on failure"""
+        if job.cancelled:
+            return
+
+        self._current_job = job
+        job.started_at = time.perf_counter()
+        try:
+            if self._play_cached(job):
+                return
+            for attempt in range(2):
+                monitor = self.monitor
+                if monitor is not None:
+                    monitor.playback_started(job.text)
+                try:
+                    self._engine.say(job.text)
+                    self._engine.runAndWait()
+                    job.error = None
+                    if job.cancelled:
+                        job.silenced_at = time.perf_counter()
+                    break
+                except Exception as e:
+                    print(f"Error in speech engine: {e}")
+                    job.error = e
+                    if attempt == 0 and not job.cancelled:
+                        # Try one more time with a fresh engine
+                        self._create_engine()
+                    else:
+                        print("Failed to speak after retry")
+                finally:
+                    if monitor is not None:
+                        monitor.playback_stopped()
+        finally:
+            job.finished_at = time.perf_counter()
+            self._current_job = None
+
+    def _play_cached(self, job):
+        """Play pre-rendered audio for the job if the cache has it"""
+        if self.audio_cache is None:
+            return False
+        path = self.audio_cache.lookup(job.text, self.voice_id, self.rate)
+        if path is None:
+            return False
+        try:
+            with open(path, "rb") as f:
+                self._play_audio(job, f.read(), self.player)
+            return True
+        except Exception as e:
+            print(f"Error playing cached audio, synthesizing instead: {e}")
+            return False
+
+    def _render(self, text):
+        """Render text with the current voice and rate into the audio cache"""
+        if self.audio_cache.contains(text, self.voice_id, self.rate):
+            return
+        temp_path = self.audio_cache.temp_path(text, self.voice_id, self.rate)
+        try:
+            self._engine.save_to_file(text, temp_path)
+            self._engine.runAndWait()
+            if os.path.exists(temp_path):
+                with open(temp_path, "rb") as f:
+                    playable = is_wav(f.read())
+                if playable:
+                    self.audio_cache.add(text, self.voice_id, self.rate, temp_path)
+                else:
+                    # The phrase is spoken through the engine instead
+                    os.remove(temp_path)
+        except Exception as e:
+            print(f"Error rendering '{text}' to the audio cache: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _save_wav(self, text):
+        """Render text with the engine's current settings and return the WAV bytes"""
+        fd, path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            self._engine.save_to_file(text, path)
+            self._engine.runAndWait()
+            with open(path, "rb") as f:
+                return f.read()
+        finally:
+            os.remove(path)
+
+    def _buffer_job(self, job):
+        """Render a say() job to memory and hand it to the playback thread
+
+        Returns False when the job was spoken or skipped here instead, and so
+        is already done.
+        """
+        if job.cancelled:
+            return False
+
+        self._current_job = job
+        try:
+            path = self.audio_cache.lookup(job.text, self.voice_id, self.rate) if self.audio_cache else None
+            if path is not None:
+                with open(path, "rb") as f:
+                    job.audio = f.read()
+            else:
+                job.audio = self._save_wav(job.text)
+            if job.audio and not is_wav(job.audio):
+                raise ValueError("the driver did not render WAV audio")
+        except Exception as e:
+            print(f"Error rendering speech, speaking directly: {e}")
+            job.audio = None
+
+        if not job.audio:
+            self._current_job = None
+            # Speak through the engine once the speaker is free, keeping the order
+            while self._playing_job is not None or not self._playback.empty():
+                time.sleep(0.01)
+            self._speak_job(job)
+            return False
+
+        # Blocks while the player is prefetch utterances behind; the job stays
+        # current meanwhile so stop() cancels it
+        try:
+            self._playback.put(job)
+        finally:
+            self._current_job = None
+        return True
+
+    def _play(self):
+        """Playback thread loop: play rendered utterances back to back"""
+        while self._running:
+            job = self._playback.get()
+            if job is None:
+                break
+            if job.cancelled:
+                job.finish()
+                continue
+            # Hold the next utterance while paused
+            while not self._resumed.is_set() and not job.cancelled:
+                self._resumed.wait(self.block_seconds)
+            if job.cancelled:
+                job.finish()
+                continue
+            self._playing_job = job
+            job.started_at = time.perf_counter()
+            try:
+                self._play_audio(job, job.audio, self.player)
+            except Exception as e:
+                print(f"Error playing speech: {e}")
+                job.error = e
+            finally:
+                job.finished_at = time.perf_counter()
+                job.audio = None
+                self._playing_job = None
+                job.finish()
+
+    def _play_audio(self, job, audio, player=play_wav_file):
+        """Play WAV bytes for a job, tracking silence and how much of it was heard"""
+        with wave.open(io.BytesIO(audio), "rb") as wav:
+            duration = wav.getnframes() / float(wav.getframerate())
+
+        def should_stop():
+            if job.cancelled and job.silenced_at is None:
+                job.silenced_at = time.perf_counter()
+            return job.cancelled
+
+        def is_paused():
+            if self._resumed.is_set():
+                if not job.cancelled:
+                    # The pause was lifted: the audio is being heard again
+                    job.silenced_at = None
+                return False
+            if job.silenced_at is None:
+                job.silenced_at = time.perf_counter()
+            return True
+
+        monitor = self.monitor
+        on_block = None
+        if monitor is not None:
+            monitor.playback_started(job.text)
+            on_block = lambda data, width: monitor.playback_audio(audioop.rms(data, width))
+        try:
+            played = player(io.BytesIO(audio), should_stop=should_stop, block_seconds=self.block_seconds,
+                            is_paused=is_paused, on_block=on_block)
+        finally:
+            if monitor is not None:
+                monitor.playback_stopped()
+        # Rendered audio has no word timings; assume an even speaking pace
+        job.heard_chars = len(job.text) if played >= duration else int(len(job.text) * played / duration)
+
+    def _synthesize_job(self, job):
+        """Render a synthesize() job to WAV bytes on the worker thread"""
+        if job.cancelled:
+            return
+        job.started_at = time.perf_counter()
+        try:
+            if job.voice_id is not None:
+                self._engine.setProperty('voice', job.voice_id)
+            if job.rate is not None:
+                self._engine.setProperty('rate', job.rate)
+            job.audio = self._save_wav(job.text)
+        except Exception as e:
+            print(f"Error synthesizing '{job.text}': {e}")
+            job.error = e
+        finally:
+            # Put the service's own settings back
+            if self.voice_id is not None:
+                self._engine.setProperty('voice', self.voice_id)
+            self._engine.setProperty('rate', self.rate)
+            job.finished_at = time.perf_counter()
+
+    def _warm_up(self):
+        """Run a silent utterance so the first real reply starts immediately"""
+        volume = self._engine.getProperty('volume')
+        self._engine.setProperty('volume', 0.0)
+        try:
+            self._engine.say("warm up")
+            self._engine.runAndWait()
+        finally:
+            self._engine.setProperty('volume', volume)
+
+    def _run(self):
+        """Worker thread loop"""
+        try:
+            self._create_engine()
+        except Exception as e:
+            print(f"Error initializing TTS engine: {e}")
+            self.init_error = e
+        self.ready.set()
+
+        while self._running:
+            # Pre-render cached phrases only while no speech is waiting
+            if self._renders and self._commands.empty() and self._engine is not None:
+                try:
+                    self._apply_pending_settings()
+                    self._render(self._renders.popleft())
+                except Exception as e:
+                    print(f"Error in TTS worker: {e}")
+                continue
+
+            command, job = self._commands.get()
+            handed_off = False
+            try:
+                if command == "shutdown":
+                    break
+                if self._engine is None:
+                    # Without an engine every job fails immediately
+                    if job is not None:
+                        job.error = self.init_error
+                    continue
+                self._apply_pending_settings()
+                if command == "say" and self.buffered:
+                    handed_off = self._buffer_job(job)
+                elif command == "say":
+                    self._speak_job(job)
+                elif command == "synth":
+                    self._synthesize_job(job)
+                elif command == "warmup":
+                    self._warm_up()
+            except Exception as e:
+                print(f"Error in TTS worker: {e}")
+            finally:
+                # Buffered utterances are finished by the playback thread
+                if job is not None and not handed_off:
+                    job.finish()
+
+
+# One warm engine service per output driver
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_tts_service(driver_name=None, **kwargs):
+    """Return the shared TTS engine service for a driver, creating it on first use"""
+    with _services_lock:
+        service = _services.get(driver_name)
+        if service is None:
+            service = TTSEngineService(driver_name, **kwargs)
+            _services[driver_name] = service
+        return service
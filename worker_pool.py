@@ -0,0 +1,134 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+
+class PoolOverloaded(Exception):
+    """A task was refused because its session or the whole pool has too much queued"""
+
+
+class FairWorkerPool:
+    """Fixed set of worker threads shared by many sessions, served round-robin
+
+    Each session (key) has its own queue; workers take one task from each
+    session in turn, so a session that submits a burst cannot starve the
+    others. Admission control refuses new tasks with PoolOverloaded once a
+    session has max_pending_per_key tasks waiting or the pool as a whole has
+    max_pending.
+    """
+
+    def __init__(self, name, workers=4, max_pending_per_key=4, max_pending=256):
+        self.name = name
+        self.max_pending_per_key = max_pending_per_key
+        self.max_pending = max_pending
+
+        # key -> deque of (future, fn, args, kwargs, submitted_at); keys rotate in _order
+        self._queues = {}
+        self._order = collections.deque()
+        self._pending = 0
+        self._condition = threading.Condition()
+        self._running = True
+
+        # Counters exposed through stats()
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy = 0
+        self._wait_total = 0.0
+
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._work, name=f"{name}-{index}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) for a session and return a Future"""
+        with self._condition:
+            if not self._running:
+                raise PoolOverloaded(f"{self.name} pool is shut down")
+            tasks = self._queues.get(key)
+            if self._pending >= self.max_pending or (tasks and len(tasks) >= self.max_pending_per_key):
+                self.rejected += 1
+                raise PoolOverloaded(f"{self.name} pool is full")
+            if tasks is None:
+                tasks = self._queues[key] = collections.deque()
+                self._order.append(key)
+            future = Future()
+            tasks.append((future, fn, args, kwargs, time.perf_counter()))
+            self._pending += 1
+            self.submitted += 1
+            self._condition.notify()
+        return future
+
+    def pending(self, key=None):
+        """Number of queued tasks, for one session or in total"""
+        with self._condition:
+            if key is None:
+                return self._pending
+            return len(self._queues.get(key, ()))
+
+    def discard(self, key):
+        """Cancel every queued task of a session, e.g. when it closes"""
+        with self._condition:
+            tasks = self._queues.pop(key, None)
+            if tasks is None:
+                return
+            self._order.remove(key)
+            self._pending -= len(tasks)
+        for future, _, _, _, _ in tasks:
+            future.cancel()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "pending": self._pending,
+                "busy": self.busy,
+                "workers": len(self._threads),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_queue_wait": self._wait_total / self.completed if self.completed else 0.0,
+            }
+
+    def shutdown(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2)
+
+    def _next_task(self):
+        """Take the next task round-robin across sessions; caller holds the condition"""
+        key = self._order.popleft()
+        tasks = self._queues[key]
+        task = tasks.popleft()
+        if tasks:
+            self._order.append(key)
+        else:
+            del self._queues[key]
+        self._pending -= 1
+        return task
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._running and not self._order:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                future, fn, args, kwargs, submitted_at = self._next_task()
+                self.busy += 1
+                self._wait_total += time.perf_counter() - submitted_at
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except Exception as e:
+                        future.set_exception(e)
+            finally:
+                with self._condition:
+                    self.busy -= 1
+                    self.completed += 1